@@ -123,6 +123,7 @@ fi
 # Initialize the database.
 python3.6 manage.py migrate
 python3.6 manage.py load_modules
+python3.6 manage.py warm_module_cache
 
 # Create an initial administrative user and organization
 # non-interactively and write the administrator's initial
@@ -20,6 +20,7 @@ cd src
 if [ "$CF_INSTANCE_INDEX" == "0" ]; then
 	python manage.py migrate --no-input
 	python manage.py load_modules
+	python manage.py warm_module_cache
 fi
 
 # Prepare static assets. TODO: This should probably be done so
@@ -33,9 +34,13 @@ python manage.py collectstatic --noinput
 # Check that everything looks OK.
 python manage.py check --deploy
 
-# On instance zero, run send_notification_emails in the background.
+# On instance zero, run send_notification_emails, render_output_documents,
+# rollup_instrumentation_events and generate_thumbnails in the background.
 if [ "$CF_INSTANCE_INDEX" == "0" ]; then
 	nohup python manage.py send_notification_emails forever &
+	nohup python manage.py render_output_documents forever &
+	nohup python manage.py rollup_instrumentation_events forever &
+	nohup python manage.py generate_thumbnails forever &
 fi
 
 # Configure New Relic monitoring by pulling credentials from the
@@ -15,9 +15,15 @@ python3 manage.py migrate &&
 # Load updated modules into database.
 python3 manage.py load_modules &&
 
+# Precompute module dependency graphs into the database.
+python3 manage.py warm_module_cache &&
+
 # Extract static assets.
 python3 manage.py collectstatic --noinput &&
 
 # Kick the processes to reload modules.
 pkill -u govready-q -f uwsgi
 pkill -u govready-q -f send_notification_emails
+pkill -u govready-q -f render_output_documents
+pkill -u govready-q -f rollup_instrumentation_events
+pkill -u govready-q -f generate_thumbnails
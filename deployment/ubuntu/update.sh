@@ -12,9 +12,15 @@ python3 manage.py migrate &&
 # Load updated modules into database.
 python3 manage.py load_modules &&
 
+# Precompute module dependency graphs into the database.
+python3 manage.py warm_module_cache &&
+
 # Extract static assets.
 python3 manage.py collectstatic --noinput &&
 
 # Kick the processes to reload modules.
 killall -HUP uwsgi_python3
 pkill -f send_notification_emails
+pkill -f render_output_documents
+pkill -f rollup_instrumentation_events
+pkill -f generate_thumbnails
@@ -5,7 +5,7 @@ from django.utils.html import escape as escape_html
 from .models import \
 	AppSource, AppVersion, Module, ModuleQuestion, ModuleAsset, \
 	Task, TaskAnswer, TaskAnswerHistory, \
-	InstrumentationEvent
+	OutputDocumentExport, InstrumentationEvent, InstrumentationEventRollup
 
 class AppSourceSpecWidget(forms.Widget):
     fields = [
@@ -274,11 +274,22 @@ class TaskAnswerHistoryAdmin(admin.ModelAdmin):
 	             (None, { "fields": ('extra',) }) ]
 	def answer(self, obj): return obj.get_answer_display()
 
+class OutputDocumentExportAdmin(admin.ModelAdmin):
+	list_display = ('created', 'task', 'document_id', 'download_format', 'status', 'finished_at')
+	list_filter = ('status', 'download_format')
+	raw_id_fields = ('task', 'requested_by')
+	readonly_fields = ('task', 'document_id', 'download_format', 'requested_by', 'output_version', 'filename', 'mime_type', 'error', 'finished_at')
+	exclude = ('blob',)
+
 class InstrumentationEventAdmin(admin.ModelAdmin):
 	list_display = ('event_time', 'event_type', 'user', 'event_value', 'task')
 	raw_id_fields = ('project', 'user', 'module', 'question', 'task', 'answer')
 	readonly_fields = ('event_time', 'event_type', 'event_value', 'user', 'module', 'question', 'task', 'answer')
 
+class InstrumentationEventRollupAdmin(admin.ModelAdmin):
+	list_display = ('day', 'event_type', 'module', 'question', 'events', 'count', 'total')
+	raw_id_fields = ('module', 'question')
+
 admin.site.register(AppSource, AppSourceAdmin)
 admin.site.register(AppVersion, AppVersionAdmin)
 admin.site.register(Module, ModuleAdmin)
@@ -287,4 +298,6 @@ admin.site.register(ModuleAsset, ModuleAssetAdmin)
 admin.site.register(Task, TaskAdmin)
 admin.site.register(TaskAnswer, TaskAnswerAdmin)
 admin.site.register(TaskAnswerHistory, TaskAnswerHistoryAdmin)
+admin.site.register(OutputDocumentExport, OutputDocumentExportAdmin)
 admin.site.register(InstrumentationEvent, InstrumentationEventAdmin)
+admin.site.register(InstrumentationEventRollup, InstrumentationEventRollupAdmin)
@@ -102,6 +102,11 @@ def load_app_into_database(app, update_mode=AppImportUpdateMode.CreateInstance,
     # and by the loading of a README.md file.
     appinst.save()
 
+    # If the AppVersion is in the catalog (i.e. it was updated in place),
+    # render its catalog entry now rather than on the next catalog page load.
+    if appinst.show_in_catalog:
+        appinst.get_catalog_entry()
+
     return appinst
 
 
@@ -234,6 +239,11 @@ def update_module(m, spec, log_status):
     m.spec = remove_questions(spec)
     m.save()
 
+    # Anything this process has precomputed from the module's templates
+    # is stale.
+    from .module_logic import clear_module_question_cache
+    clear_module_question_cache()
+
     # Update its questions.
     qs = set()
     for i, question in enumerate(spec.get("questions", [])):
@@ -282,6 +292,11 @@ def update_question(m, definition_order, spec, log_status):
                 setattr(q, k, v)
             q.save(update_fields=field_values.keys())
 
+            # The question's dependencies and impute rules may have changed,
+            # so anything this process has precomputed from them is stale.
+            from .module_logic import clear_module_question_cache
+            clear_module_question_cache()
+
     return q
 
 
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from guidedmodules.models import TaskAnswer
+
+class Command(BaseCommand):
+    help = 'Sets TaskAnswer.current_answer from the answer history of every TaskAnswer. The field is maintained automatically, but this repairs it if TaskAnswerHistory records were created or deleted outside of the normal code paths.'
+
+    def handle(self, *args, **options):
+        count = TaskAnswer.update_current_answers()
+        print("Updated the current answer of {} question answers.".format(count))
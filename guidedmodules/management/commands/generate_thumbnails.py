@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+import time
+
+from exclusiveprocess import Lock
+
+from guidedmodules.models import TaskAnswerHistory
+
+class Command(BaseCommand):
+    help = 'Generates thumbnails for uploaded files that need them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('forever', nargs='?', type=bool)
+
+    def handle(self, *args, **options):
+        # Ensure this process doesn't run multiple times concurrently.
+        Lock(die=True).forever()
+
+        # Don't retry files that failed until the process is restarted.
+        self.failed = set()
+
+        if options["forever"]:
+            # Loop forever.
+            while True:
+                self.generate_thumbnails()
+                time.sleep(5)
+
+        else:
+            # Run on-off job.
+            self.generate_thumbnails()
+
+    def generate_thumbnails(self):
+        for answer in TaskAnswerHistory.get_answers_needing_thumbnails()\
+            .exclude(id__in=self.failed)\
+            .order_by('id'):
+            if not answer.generate_thumbnail():
+                self.failed.add(answer.id)
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.conf import settings
+
+import time
+
+from exclusiveprocess import Lock
+
+from guidedmodules.models import OutputDocumentExport
+
+class Command(BaseCommand):
+    help = 'Generates queued output document exports (PDF, DOCX, etc.).'
+
+    # Large documents can take much longer to convert than a web request
+    # is allowed to take.
+    timeout = 300
+
+    def add_arguments(self, parser):
+        parser.add_argument('forever', nargs='?', type=bool)
+
+    def handle(self, *args, **options):
+        # Ensure this process doesn't run multiple times concurrently.
+        Lock(die=True).forever()
+
+        # Since only one worker runs at a time, any export marked as running
+        # was interrupted (e.g. the worker was killed). Queue it again.
+        OutputDocumentExport.objects.filter(status="running").update(status="queued")
+
+        if options["forever"]:
+            # Loop forever.
+            while True:
+                self.run_queued_exports()
+                time.sleep(2)
+
+        else:
+            # Run on-off job.
+            self.run_queued_exports()
+
+    def run_queued_exports(self):
+        # Take exports off of the queue in order until it is empty.
+        while True:
+            with transaction.atomic():
+                export = OutputDocumentExport.objects.select_for_update()\
+                    .filter(status="queued")\
+                    .order_by('id')\
+                    .first()
+                if export is None:
+                    return
+                export.status = "running"
+                export.save(update_fields=["status", "updated"])
+            export.run(self.timeout)
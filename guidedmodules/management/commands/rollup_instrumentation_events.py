@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from datetime import timedelta
+import time
+
+from exclusiveprocess import Lock
+
+from guidedmodules.models import InstrumentationEventRollup
+
+class Command(BaseCommand):
+    help = 'Aggregates new instrumentation events into the daily rollups shown on the analytics page.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('forever', nargs='?', type=bool)
+        parser.add_argument('--retain-days', type=int, help="Delete events older than this many days once they are rolled up. By default events are kept forever.")
+
+    def handle(self, *args, **options):
+        # Ensure this process doesn't run multiple times concurrently.
+        Lock(die=True).forever()
+
+        if options["forever"]:
+            # Loop forever.
+            while True:
+                self.update(options["retain_days"])
+                time.sleep(60)
+
+        else:
+            # Run on-off job.
+            self.update(options["retain_days"])
+
+    def update(self, retain_days):
+        # Roll up events in batches until the rollups are up to date.
+        while InstrumentationEventRollup.update_rollups() > 0:
+            pass
+
+        # Apply the retention policy.
+        if retain_days is not None:
+            InstrumentationEventRollup.delete_rolled_up_events(timezone.now() - timedelta(days=retain_days))
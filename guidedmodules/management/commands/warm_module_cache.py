@@ -0,0 +1,22 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from guidedmodules.models import Module
+from guidedmodules.module_logic import get_all_question_dependencies
+
+class Command(BaseCommand):
+    help = 'Precomputes the question dependency graph of every Module into the database. Run after load_modules or after loading apps.'
+
+    def handle(self, *args, **options):
+        # get_all_question_dependencies stores each graph that it computes
+        # in the dependency graph store, which is in the database, so that
+        # web workers don't have to compute it.
+        count = 0
+        for module in Module.objects.all():
+            try:
+                get_all_question_dependencies(module)
+                count += 1
+            except Exception as e:
+                print(module, e, file=sys.stderr)
+        print("Computed the dependency graphs of {} modules.".format(count))
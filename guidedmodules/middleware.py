@@ -1,6 +1,7 @@
 from time import time as now
 
-from .models import InstrumentationEvent
+from .models import instrumentation_event_buffer
+from .module_logic import ProjectEvaluationSession
 
 class InstrumentQuestionPageLoadTimes:
     def __init__(self, next_middleware):
@@ -21,11 +22,29 @@ class InstrumentQuestionPageLoadTimes:
         if event_info:
             duration = (now() - start) * 1000 # store in msec because that's a more natural scale and
                                               # the analytics page likes to round event_value to integers
-            InstrumentationEvent.objects.create(
+            instrumentation_event_buffer.add(
                 user=request.user,
                 event_value=duration,
                 **event_info
             )
 
+        # Write out the buffered instrumentation events if enough have
+        # accumulated or they've been waiting long enough.
+        instrumentation_event_buffer.flush_if_due()
+
         # Return the response unchanged.
-        return response
\ No newline at end of file
+        return response
+
+
+class ProjectEvaluationSessionMiddleware:
+    # Make a ProjectEvaluationSession active for the duration of each
+    # request so that Tasks are evaluated at most once per request.
+    def __init__(self, next_middleware):
+        self.next_middleware = next_middleware
+
+    def __call__(self, request):
+        ProjectEvaluationSession.for_request(request).activate()
+        try:
+            return self.next_middleware(request)
+        finally:
+            ProjectEvaluationSession.deactivate()
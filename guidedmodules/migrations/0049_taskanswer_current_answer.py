@@ -0,0 +1,30 @@
+# Generated by Django 2.2.4 on 2026-10-18 06:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+def forward(apps, schema_editor):
+    # Set the current_answer of every TaskAnswer to its most recent
+    # TaskAnswerHistory in a single UPDATE query.
+    TaskAnswer = apps.get_model("guidedmodules", "TaskAnswer")
+    TaskAnswerHistory = apps.get_model("guidedmodules", "TaskAnswerHistory")
+    TaskAnswer.objects.update(current_answer=models.Subquery(
+        TaskAnswerHistory.objects
+            .filter(taskanswer=models.OuterRef('pk'))
+            .order_by('-id')
+            .values('id')[:1]))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0048_appversion_show_in_catalog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskanswer',
+            name='current_answer',
+            field=models.ForeignKey(blank=True, help_text="The current (most recent) TaskAnswerHistory of this TaskAnswer, denormalized so it doesn't have to be looked up in the history. Updated whenever a TaskAnswerHistory is created.", null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='guidedmodules.TaskAnswerHistory'),
+        ),
+        migrations.RunPython(forward, migrations.RunPython.noop),
+    ]
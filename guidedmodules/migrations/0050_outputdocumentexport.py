@@ -0,0 +1,38 @@
+# Generated by Django 2.2.4 on 2026-10-18 06:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('guidedmodules', '0049_taskanswer_current_answer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutputDocumentExport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_id', models.CharField(help_text="The id of the output document in the Task's Module.", max_length=256)),
+                ('download_format', models.CharField(help_text='The format the document is exported to, e.g. pdf or docx.', max_length=16)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', help_text='Where the export is in the queue.', max_length=16)),
+                ('output_version', models.CharField(blank=True, help_text="The Task's output version (see Task.get_output_version) at the time the export was generated, which tells whether the export is up to date.", max_length=32, null=True)),
+                ('blob', models.BinaryField(blank=True, help_text='The exported document, once it is done.', null=True)),
+                ('filename', models.CharField(blank=True, help_text='A suggested filename for the exported document.', max_length=256, null=True)),
+                ('mime_type', models.CharField(blank=True, help_text='The MIME type of the exported document.', max_length=128, null=True)),
+                ('error', models.TextField(blank=True, help_text='If the export failed, the error message.', null=True)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated', models.DateTimeField(auto_now=True, db_index=True)),
+                ('finished_at', models.DateTimeField(blank=True, help_text='When the export was done or failed.', null=True)),
+                ('requested_by', models.ForeignKey(blank=True, help_text='The user who requested the export, or null if it was queued because the answers changed.', null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('task', models.ForeignKey(help_text='The Task whose output document is exported.', on_delete=django.db.models.deletion.CASCADE, related_name='output_document_exports', to='guidedmodules.Task')),
+            ],
+            options={
+                'index_together': {('task', 'document_id', 'download_format')},
+            },
+        ),
+    ]
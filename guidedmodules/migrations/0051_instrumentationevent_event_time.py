@@ -0,0 +1,19 @@
+# Generated by Django 2.2.4 on 2026-10-18 07:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0050_outputdocumentexport'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='instrumentationevent',
+            name='event_time',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.4 on 2026-10-18 07:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0051_instrumentationevent_event_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstrumentationEventRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=32)),
+                ('day', models.DateField()),
+                ('events', models.IntegerField(help_text='The number of events aggregated into this rollup.')),
+                ('count', models.IntegerField(help_text='The number of those events that have an event_value.')),
+                ('total', models.FloatField(help_text="The sum of those events' event_values.")),
+                ('last_event_id', models.IntegerField(db_index=True, help_text='The highest InstrumentationEvent id aggregated into this rollup. The highest over all rollups is where the next update starts.')),
+                ('module', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='guidedmodules.Module')),
+                ('question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='guidedmodules.ModuleQuestion')),
+            ],
+            options={
+                'index_together': {('event_type', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.4 on 2026-10-18 07:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0052_instrumentationeventrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModuleDependencyGraph',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spec_hash', models.CharField(help_text="A hash of the specifications of the Module's questions that the graph was computed from.", max_length=32)),
+                ('graph', jsonfield.fields.JSONField(help_text='The keys of the questions that each question depends on and the keys of the root questions.')),
+                ('updated', models.DateTimeField(auto_now=True, db_index=True)),
+                ('module', models.OneToOneField(help_text='The Module whose questions this is the dependency graph of.', on_delete=django.db.models.deletion.CASCADE, related_name='dependency_graph', to='guidedmodules.Module')),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.4 on 2026-10-18 07:48
+
+from django.db import migrations, models
+
+def forward(apps, schema_editor):
+    # Delete all but the most recent of any exports of the same document
+    # from the same version of the answers so that the new unique
+    # constraint can be added.
+    OutputDocumentExport = apps.get_model("guidedmodules", "OutputDocumentExport")
+    duplicates = OutputDocumentExport.objects\
+        .exclude(output_version=None)\
+        .values("task", "document_id", "download_format", "output_version")\
+        .annotate(count=models.Count("id"), last_id=models.Max("id"))\
+        .filter(count__gt=1)
+    for d in duplicates:
+        OutputDocumentExport.objects\
+            .filter(task=d["task"], document_id=d["document_id"], download_format=d["download_format"], output_version=d["output_version"])\
+            .exclude(id=d["last_id"])\
+            .delete()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0053_moduledependencygraph'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='outputdocumentexport',
+            unique_together={('task', 'document_id', 'download_format', 'output_version')},
+        ),
+        migrations.AlterIndexTogether(
+            name='outputdocumentexport',
+            index_together=set(),
+        ),
+    ]
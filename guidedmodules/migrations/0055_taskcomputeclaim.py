@@ -0,0 +1,26 @@
+# Generated by Django 2.2.4 on 2026-10-18 08:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0054_outputdocumentexport_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskComputeClaim',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='The cached_state key (or other name) of the value being computed.', max_length=255)),
+                ('expires', models.DateTimeField(help_text='When other processes stop waiting for the value and compute it themselves.')),
+                ('task', models.ForeignKey(help_text='The Task that the value is being computed for.', on_delete=django.db.models.deletion.CASCADE, related_name='compute_claims', to='guidedmodules.Task')),
+            ],
+            options={
+                'unique_together': {('task', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.2.4 on 2026-10-18 08:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+def forward(apps, schema_editor):
+    # Summarize the existing events of the types that views look up.
+    InstrumentationEvent = apps.get_model("guidedmodules", "InstrumentationEvent")
+    InstrumentationEventSummary = apps.get_model("guidedmodules", "InstrumentationEventSummary")
+    groups = InstrumentationEvent.objects\
+        .filter(event_type__in=("task-create", "task-done", "task-question-show", "task-question-interact-first"))\
+        .exclude(user=None).exclude(task=None)\
+        .values("event_type", "user", "task", "question")\
+        .annotate(first_event_time=models.Min("event_time"), last_id=models.Max("id"))\
+        .order_by()
+    batch = []
+    def save_batch():
+        last_events = InstrumentationEvent.objects.in_bulk([g["last_id"] for g in batch])
+        InstrumentationEventSummary.objects.bulk_create([
+            InstrumentationEventSummary(
+                event_type=g["event_type"], user_id=g["user"], task_id=g["task"], question_id=g["question"],
+                first_event_time=g["first_event_time"],
+                last_event_time=last_events[g["last_id"]].event_time,
+                last_event_value=last_events[g["last_id"]].event_value)
+            for g in batch ])
+        batch.clear()
+    for g in groups.iterator():
+        batch.append(g)
+        if len(batch) == 1000:
+            save_batch()
+    if batch:
+        save_batch()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('guidedmodules', '0055_taskcomputeclaim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstrumentationEventSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=32)),
+                ('first_event_time', models.DateTimeField(help_text='The time of the first event.')),
+                ('last_event_time', models.DateTimeField(help_text='The time of the last event.')),
+                ('last_event_value', models.FloatField(help_text='The value of the last event.', null=True)),
+                ('question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='guidedmodules.ModuleQuestion')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='guidedmodules.Task')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('task', 'user', 'event_type', 'question')},
+            },
+        ),
+        migrations.RunPython(forward, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.4 on 2026-10-18 08:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0056_instrumentationeventsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderedOutputDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('output_version', models.CharField(help_text='The output version of the Task (see Task.get_output_version) that the document was rendered from.', max_length=32)),
+                ('document_index', models.IntegerField(help_text="The index of the document in the Module's output documents.")),
+                ('output_format', models.CharField(help_text='The format that the document was rendered in.', max_length=32)),
+                ('use_data_urls', models.BooleanField(help_text='Whether images in the document are data: URLs.')),
+                ('content', models.TextField(help_text='The rendered document.')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('task', models.ForeignKey(help_text='The Task whose output document this is.', on_delete=django.db.models.deletion.CASCADE, related_name='rendered_documents', to='guidedmodules.Task')),
+            ],
+            options={
+                'unique_together': {('task', 'output_version', 'document_index', 'output_format', 'use_data_urls')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.4 on 2026-10-18 08:15
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0057_renderedoutputdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appversion',
+            name='catalog_entry',
+            field=jsonfield.fields.JSONField(blank=True, help_text="The rendered parts of this AppVersion's entry in the compliance app catalog (see get_catalog_entry).", null=True),
+        ),
+        migrations.AddField(
+            model_name='appversion',
+            name='catalog_entry_key',
+            field=models.CharField(blank=True, help_text='A key that identifies the state of the AppSource and this AppVersion that catalog_entry was rendered from.', max_length=64, null=True),
+        ),
+    ]
@@ -5,9 +5,11 @@ from django.conf import settings
 from jsonfield import JSONField
 
 from collections import OrderedDict
+from datetime import timedelta
+import threading
 import uuid
 
-from .module_logic import ModuleAnswers, render_content
+from .module_logic import ModuleAnswers, AnswerSet, render_content
 from .answer_validation import validator
 from siteapp.models import User, Organization, Project, ProjectMembership
 from guardian.shortcuts import (assign_perm, get_objects_for_user,
@@ -90,6 +92,10 @@ class AppSource(models.Model):
             appver = load_app_into_database(app)
             appver.show_in_catalog = True
             appver.save()
+
+        # Render its catalog entry now rather than on the next catalog page load.
+        appver.get_catalog_entry()
+
         return appver
 
 class AppVersion(models.Model):
@@ -109,6 +115,8 @@ class AppVersion(models.Model):
     trust_assets = models.BooleanField(default=False, help_text="Are assets trusted? Assets include Javascript that will be served on our domain, Python code included with Modules, and Jinja2 templates in Modules.")
 
     show_in_catalog = models.BooleanField(default=False, help_text='Whether to show this AppVersion in the compliane app catalog, which allows users to start the app.')
+    catalog_entry = JSONField(blank=True, null=True, help_text="The rendered parts of this AppVersion's entry in the compliance app catalog (see get_catalog_entry).")
+    catalog_entry_key = models.CharField(max_length=64, blank=True, null=True, help_text="A key that identifies the state of the AppSource and this AppVersion that catalog_entry was rendered from.")
 
     created = models.DateTimeField(auto_now_add=True, db_index=True)
     updated = models.DateTimeField(auto_now=True, db_index=True)
@@ -144,6 +152,86 @@ class AppVersion(models.Model):
         import rtyaml
         return rtyaml.dump(self.catalog_metadata)
 
+    def get_catalog_entry(self):
+        # Returns the parts of this AppVersion's entry in the compliance app
+        # catalog that don't depend on who is looking at the catalog, with the
+        # descriptions rendered to HTML and the icon to a data: URL. Entries are
+        # computed when apps are added to the catalog and are stored in the
+        # catalog_entry field, so that every process sees them, along with
+        # a key made from the AppSource's stale key and this AppVersion's last
+        # update time so that entries are never stale.
+        key = "{}_{}".format(self.source.make_cache_stale_key(), self.updated.isoformat())
+        if self.catalog_entry is None or self.catalog_entry_key != key:
+            self.catalog_entry = self.render_catalog_entry()
+            self.catalog_entry_key = key
+            # Don't use save(), which would change the update time and so
+            # the key.
+            AppVersion.objects.filter(id=self.id).update(
+                catalog_entry=self.catalog_entry, catalog_entry_key=self.catalog_entry_key)
+        return self.catalog_entry
+
+    def render_catalog_entry(self):
+        from .module_logic import render_content
+
+        key = "{source}/{name}".format(source=self.source.slug, name=self.appname)
+
+        catalog = self.catalog_metadata
+        if not isinstance(catalog, dict): catalog = { }
+
+        app_module = self.modules.filter(module_name="app").first()
+
+        return {
+            # app identification
+            "appsource_id": self.source.id,
+            "key": key,
+
+            # main display fields
+            "title": catalog.get('title') or self.appname,
+            "description": { # rendered as markdown
+                "short": render_content(
+                    {
+                        "template": catalog.get("description", {}).get("short") or "",
+                        "format": "markdown",
+                    },
+                    None,
+                    "html",
+                    "%s %s" % (key, "short description")
+                ),
+                "long": render_content(
+                    {
+                        "template": catalog.get("description", {}).get("long")
+                            or catalog.get("description", {}).get("short")
+                            or "",
+                        "format": "markdown",
+                    },
+                    None,
+                    "html",
+                    "%s %s" % (key, "short description")
+                )
+            },
+
+            # catalog page metadata
+            "categories": catalog.get("categories", [catalog.get("category")]),
+            "search_haystak": "".join([ # free text search uses this
+                self.appname,
+                catalog.get('title', ""),
+                catalog.get("vendor", ""),
+                catalog.get("description", {}).get("short", ""),
+                catalog.get("description", {}).get("long", ""),
+            ]),
+            "icon": None if "icon" not in catalog
+                        else image_to_dataurl(self.get_asset(catalog["icon"]), 128),
+            "protocol": app_module.spec.get("protocol", []) if app_module else [],
+
+            # catalog detail page metadata
+            "vendor": catalog.get("vendor"),
+            "vendor_url": catalog.get("vendor_url"),
+            "source_url": catalog.get("source_url"),
+            "status": catalog.get("status"),
+            "version": self.version_number,
+            "recommended_for": catalog.get("recommended_for", []),
+        }
+
     def is_authoring_tool_enabled(self, user):
         return (user.has_perm('guidedmodules.change_module'))
 
@@ -177,7 +265,30 @@ class AppVersion(models.Model):
         return AppVersion.objects\
             .filter(show_in_catalog=True)\
             .filter(source__is_system_source=False)\
-            .filter(Q(source__available_to_all=True) | Q(source__available_to_orgs=organization))
+            .filter(Q(source__available_to_all=True) | Q(source__available_to_orgs=organization))\
+            .select_related("source")
+
+    @staticmethod
+    def get_startable_apps_by_organization(organizations):
+        # Same as get_startable_apps but for many organizations at once, with
+        # one query. Returns a dict mapping each organization to a list of the
+        # AppVersions that are startable by it.
+        from django.db.models import Q
+        organizations = list(organizations)
+        appvers = AppVersion.objects\
+            .filter(show_in_catalog=True)\
+            .filter(source__is_system_source=False)\
+            .filter(Q(source__available_to_all=True) | Q(source__available_to_orgs__in=organizations))\
+            .distinct()\
+            .select_related("source")\
+            .prefetch_related("source__available_to_orgs")
+        return {
+            org: [
+                av for av in appvers
+                if av.source.available_to_all or org in av.source.available_to_orgs.all()
+            ]
+            for org in organizations
+        }
 
 def extract_catalog_metadata(app_module, migration=None):
     # Note that this function is used in migration 0044 and so
@@ -558,6 +669,21 @@ class ModuleQuestion(models.Model):
             return "An array containing " + ", ".join(json.dumps(choice['key']) for choice in self.spec["choices"]) + "."
         return ""
 
+class ModuleDependencyGraph(models.Model):
+    # The dependency graph of a Module's questions, as computed by
+    # module_logic.get_all_question_dependencies, stored so that every
+    # process can use it without parsing all of the Module's templates
+    # again (see module_logic.DependencyGraphStore).
+    module = models.OneToOneField(Module, related_name="dependency_graph", on_delete=models.CASCADE, help_text="The Module whose questions this is the dependency graph of.")
+    spec_hash = models.CharField(max_length=32, help_text="A hash of the specifications of the Module's questions that the graph was computed from.")
+    graph = JSONField(help_text="The keys of the questions that each question depends on and the keys of the root questions.")
+
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        # For the admin.
+        return "Dependency graph of %s" % self.module
+
 class Task(models.Model):
     project = models.ForeignKey(Project, related_name="tasks", on_delete=models.CASCADE, help_text="The Project that this Task is a part of, or empty for Tasks that are just directly owned by the user.")
     title_override = models.CharField(max_length=256, blank=True, null=True, help_text="The title of this Task if overriding the computed instance-name or Module.title default.")
@@ -593,7 +719,7 @@ class Task(models.Model):
         task = Task.objects.create(**kwargs)
 
         # Add instrumentation event.
-        InstrumentationEvent.objects.create(
+        instrumentation_event_buffer.add(
             user=kwargs["editor"],
             event_type="task-create",
             module=task.module,
@@ -640,13 +766,18 @@ class Task(models.Model):
             # This path is not an asset.
             print("ERROR: '" + "{}".format(self.project) + "' - asset_path '" + asset_path + "'' is not an asset")
             return "/error/image/asset_path[" + asset_path + "]/path-is-not-an-asset."
-        with self.module.app.get_asset(asset_path) as f:
-            try:
-                return image_to_dataurl(f, max_image_size)
-            except:
-                # image processing error
-                print("ERROR: '" + "{}".format(self.project) + "' - asset_path '" + asset_path + "'' has invalid image data.")
-                return "/error/image/asset_path[" + asset_path + "]/image-processing-error."
+        def read_asset():
+            with self.module.app.get_asset(asset_path) as f:
+                return f.read()
+        try:
+            # The asset's content hash is already known, so a cached
+            # thumbnail can be returned without reading the asset.
+            return image_to_dataurl(read_asset, max_image_size,
+                content_hash=self.module.app.asset_paths[asset_path])
+        except:
+            # image processing error
+            print("ERROR: '" + "{}".format(self.project) + "' - asset_path '" + asset_path + "'' has invalid image data.")
+            return "/error/image/asset_path[" + asset_path + "]/image-processing-error."
 
 
     # ANSWERS
@@ -656,37 +787,38 @@ class Task(models.Model):
         # Efficiently get the current answer to every question of each of the tasks.
         #
         # Since we track the history of answers to each question, we need to get the most
-        # recent answer for each question. It's fastest if we pre-load the complete history
-        # of every question rather than making a separate database call for each question
-        # to find its most recent answer. See TaskAnswer.get_current_answer().
+        # recent answer for each question. Rather than making a separate database call for
+        # each question to find its most recent answer (see TaskAnswer.get_current_answer()),
+        # or loading the complete history of every question, we load only the most recent
+        # TaskAnswerHistory of each TaskAnswer, using TaskAnswer.current_answer, in a single
+        # query.
         #
         # Return a generator that yields tuples of (Task, ModuleQuestion, TaskAnswerHistory).
         # Among tuples for a particular Task, the tuples are in order of ModuleQuestion.definition_order.
+        tasks = list(tasks)
 
-        # Batch load all of the current answers of the tasks.
-        current_answers = { } # Question => TaskAnswerHistory
+        # Batch load the current answers of the tasks.
+        current_answers = { } # (Task ID, ModuleQuestion ID) => TaskAnswerHistory
         for ansh in \
             (TaskAnswerHistory.objects
-                .filter(taskanswer__task__in=tasks)
-                .order_by('-id')
+                .filter(taskanswer__task__in=tasks, taskanswer__current_answer=models.F('id'))
                 .select_related('taskanswer', 'taskanswer__task', 'taskanswer__question', 'answered_by')
                 .prefetch_related('answered_by_task')
                 .prefetch_related("answered_by_task__module__app__source")
                 .prefetch_related("answered_by_task__module__questions")):\
-            current_answers.setdefault((ansh.taskanswer.task, ansh.taskanswer.question), ansh)
+            current_answers[(ansh.taskanswer.task_id, ansh.taskanswer.question_id)] = ansh
 
-        # Batch load all of the ModuleQuestions.
-        questions = ModuleQuestion.objects.filter(module__in={ task.module for task in tasks })\
-            .order_by("definition_order")
+        # Batch load all of the ModuleQuestions, grouped by Module.
+        questions = { } # Module ID => [ModuleQuestion]
+        for question in ModuleQuestion.objects.filter(module__in={ task.module_id for task in tasks })\
+            .order_by("definition_order"):
+            questions.setdefault(question.module_id, []).append(question)
 
         # Iterate over the tasks and their questions in order...
         for task in tasks:
-            for question in questions:
-                # Skip if this question is not for this task.
-                if question.module != task.module: continue
-
+            for question in questions.get(task.module_id, []):
                 # Get the latest TaskAnswerHistory instance, if there is any.
-                answer = current_answers.get((task, question), None)
+                answer = current_answers.get((task.id, question.id), None)
 
                 # If the answer is marked as cleared, then treat as if it had
                 # not been there at all.
@@ -696,6 +828,26 @@ class Task(models.Model):
                 # Yield.
                 yield (task, question, answer)
 
+    @staticmethod
+    def get_all_current_answer_records_in_tree(tasks):
+        # Like get_all_current_answer_records, but also yields the current
+        # answers of the Tasks that answer module-type questions of the tasks,
+        # recursively, walking the tree of Tasks breadth-first so that each
+        # level of the tree is loaded with a fixed number of queries. Each Task
+        # is visited once even if it is the answer to more than one question.
+        seen_task_ids = set()
+        tasks = list(tasks)
+        while tasks:
+            seen_task_ids |= { task.id for task in tasks }
+            next_tasks = { }
+            for task, question, answer in Task.get_all_current_answer_records(tasks):
+                yield (task, question, answer)
+                if answer is not None:
+                    for t in answer.answered_by_task.all():
+                        if t.id not in seen_task_ids:
+                            next_tasks[t.id] = t
+            tasks = list(next_tasks.values())
+
     def get_current_answer_records(self):
         for task, question, answer in \
             Task.get_all_current_answer_records([self]):
@@ -703,8 +855,8 @@ class Task(models.Model):
 
     def get_answers(self):
         # Return a ModuleAnswers instance that wraps this Task and its Pythonic answer values.
-        # The dict of answers is ordered to preserve the question definition order.
-        answertuples = OrderedDict()
+        # The answers are ordered to preserve the question definition order.
+        answertuples = AnswerSet(self.module)
         for q, a in self.get_current_answer_records():
             # Get the value of that answer.
             if a is not None:
@@ -716,6 +868,37 @@ class Task(models.Model):
             answertuples[q.key] = (q, is_answered, a, value)
         return ModuleAnswers(self.module, self, answertuples)
 
+    def get_answers_with_extended_info(self, answers=None, save=True):
+        # Return self.get_answers().with_extended_info(). The outcome of the
+        # evaluation is kept in cached_state so that when only some of this
+        # Task's answers have changed since (see on_answer_changed), only the
+        # questions that could be affected by those changes are evaluated again.
+        # The caller may pass the return value of get_answers if it already
+        # has it, and pass save=False to only update cached_state in memory.
+        if answers is None:
+            answers = self.get_answers()
+        previous_state = None
+        changed_keys = None
+        if isinstance(self.cached_state, dict) and "module_state" in self.cached_state:
+            previous_state = ModuleAnswers.from_module_state(answers, self.cached_state["module_state"])
+            changed_keys = set(self.cached_state.get("module_state_changed_keys", []))
+        ret = answers.with_extended_info(previous_state=previous_state, changed_keys=changed_keys)
+
+        # Save the new outcome if it changed.
+        if previous_state is None or changed_keys:
+            if not isinstance(self.cached_state, dict):
+                self.cached_state = { }
+            module_state = ret.get_module_state()
+            if module_state is not None:
+                self.cached_state["module_state"] = module_state
+            else:
+                self.cached_state.pop("module_state", None)
+            self.cached_state.pop("module_state_changed_keys", None)
+            if save:
+                Task.save_cached_states([self], ["module_state", "module_state_changed_keys"])
+
+        return ret
+
     def get_last_modification(self):
         ans = TaskAnswerHistory.objects\
                 .filter(taskanswer__task=self)\
@@ -735,118 +918,415 @@ class Task(models.Model):
 
         # Handle a cache miss --- call refresh_func() and
         # then save it to cached_state (and save to the db).
+        # Right after the state is cleared, many requests may want the
+        # same value at once. Only one of them computes it and the others
+        # wait for it to appear in the database.
         if key not in self.cached_state:
-            self.cached_state[key] = refresh_func()
-            self.save(update_fields=["cached_state"])
+            def compute():
+                self.cached_state[key] = refresh_func()
+                Task.save_cached_states([self], [key])
+            def check(current):
+                if isinstance(current.cached_state, dict) and key in current.cached_state:
+                    for k, v in current.cached_state.items():
+                        self.cached_state.setdefault(k, v)
+                    return True
+                return False
+            self._run_once(key, compute, check)
 
         # Return cached value.
         return self.cached_state[key]
 
+    # How long a process may take to compute a cached_state value before
+    # the other processes that want it stop waiting for it and compute it
+    # themselves, and how often they check for it while they wait.
+    COMPUTE_CLAIM_TIMEOUT = timedelta(seconds=10)
+    COMPUTE_CLAIM_POLL_INTERVAL = .1
+
+    def _run_once(self, key, compute, check):
+        # Call compute() unless another process has already computed what's
+        # needed, which check() is called with the Task's row to find out.
+        # The row also gives the updated time that the result is computed
+        # from, so that save_cached_states can tell if the state is cleared
+        # meanwhile.
+        #
+        # Only one process at a time computes the same key of the same Task.
+        # It claims the key (see TaskComputeClaim) and the other processes
+        # that want the key wait for the value to appear rather than compute
+        # it too. Nothing is locked while compute() runs, so saving answers
+        # isn't held up by it. Claims expire after COMPUTE_CLAIM_TIMEOUT, and
+        # processes that have waited that long compute the value themselves,
+        # so a slow or crashed process only holds up others for so long.
+        import time
+        deadline = timezone.now() + Task.COMPUTE_CLAIM_TIMEOUT
+        claim = None
+        while True:
+            current = Task.objects.only("id", "updated", "cached_state").get(id=self.id)
+            self.updated = current.updated
+            if check(current):
+                return
+            if not Task._can_claim_compute() or timezone.now() >= deadline:
+                break
+            claim = TaskComputeClaim.claim(self, key)
+            if claim is not None:
+                break
+            time.sleep(Task.COMPUTE_CLAIM_POLL_INTERVAL)
+        try:
+            compute()
+        finally:
+            if claim is not None:
+                claim.release()
+
+    @staticmethod
+    def _can_claim_compute():
+        # A claim made inside a transaction isn't seen by other processes
+        # until the transaction is committed, and a process that makes the
+        # same claim meanwhile would wait on the transaction, so claims are
+        # only made outside of transactions.
+        return not transaction.get_connection().in_atomic_block
+
+    @staticmethod
+    def save_cached_states(tasks, keys):
+        # Save the given keys of the in-memory cached_state of the Tasks
+        # into the database, or delete them if they are not in memory.
+        # Other processes may have saved other keys since the Tasks were
+        # loaded, so the keys are merged into what's in the database rather
+        # than overwriting it. If a Task's state was cleared since it was
+        # loaded (clear_state bumps its updated time), what was computed may
+        # be out of date, so it's not saved. The merged cached_state is
+        # put back into the Task instances that were saved.
+        #
+        # The caller may hold locks on other rows in its transaction, so to
+        # rule out deadlocks, the rows of Tasks that another process has
+        # locked are skipped rather than waited for. The computed values
+        # just don't get saved then. Changes that must not be skipped, like
+        # invalidations, can't be saved this way (see clear_ancestor_task_ids).
+        from django.db import connection
+        tasks = { task.id: task for task in tasks if isinstance(task.cached_state, dict) }
+        if not tasks:
+            return
+        with transaction.atomic():
+            updates = []
+            for current in Task.objects.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)\
+                .filter(id__in=tasks.keys())\
+                .only("id", "updated", "cached_state"):
+                task = tasks[current.id]
+                if current.updated != task.updated:
+                    continue
+                cached_state = current.cached_state
+                if not isinstance(cached_state, dict):
+                    cached_state = { }
+                for key in keys:
+                    if key in task.cached_state:
+                        cached_state[key] = task.cached_state[key]
+                    else:
+                        cached_state.pop(key, None)
+                task.cached_state = cached_state
+                updates.append(task)
+
+            # Don't use save() which would set the instances' updated time
+            # without saving it.
+            Task.objects.bulk_update(updates, ["cached_state"])
+
+    def get_output_version(self):
+        # Returns a token that changes whenever the cached_state is cleared,
+        # i.e. whenever anything that the Task's output documents can depend
+        # on has changed.
+        return self._get_cached_state("output_version", lambda : uuid.uuid4().hex)
+
+    def _get_rendered_document(self, index, output_format, use_data_urls, refresh_func):
+        # Rendered output documents can be large, so rather than storing them
+        # in cached_state, cached_state holds only a token that changes whenever
+        # the cached_state is cleared, and the documents are stored under
+        # that token in the rendered_document_store.
+        from .module_logic import rendered_document_store
+        version = self.get_output_version()
+        content = rendered_document_store.get(self, version, index, output_format, use_data_urls)
+        if content is None:
+            # Only one process renders the document at a time.
+            result = []
+            def compute():
+                result.append(refresh_func())
+                rendered_document_store.set(self, version, index, output_format, use_data_urls, result[0])
+            def check(current):
+                content = rendered_document_store.get(self, version, index, output_format, use_data_urls)
+                if content is not None:
+                    result.append(content)
+                return content is not None
+            self._run_once("rendered_document_{}_{}_{}_{}".format(version, index, output_format, 1 if use_data_urls else 0),
+                compute, check)
+            content = result[0]
+        return content
+
+    def get_output_document_text(self, document_id):
+        # Returns the text rendering of the one output document of this
+        # Task with the given id, or None if the Task's module has no such
+        # document. None of the module's other output documents are
+        # rendered. The text is kept in cached_state, which is cleared
+        # whenever anything the document can depend on changes, so reading
+        # it for many Tasks loaded in one query doesn't render anything.
+        for index, document in enumerate(self.module.spec.get("output", [])):
+            if document.get("id") == document_id:
+                break
+        else:
+            return None
+        return self._get_cached_state("document_text_" + document_id,
+            lambda : self.render_output_documents()[index]["text"])
+
     def is_started(self):
         return self.answers.exists()
 
     def is_finished(self):
         def compute_is_finished():
-            # Check that all questions that need an answer have
-            # an answer and that all module-type questions are
-            # finished.
             try:
-                answers = self.get_answers().with_extended_info()
+                answers = self.get_answers_with_extended_info()
             except Exception:
                 # If there is an error evaluating imputed conditions,
                 # just say the task is unfinished.
                 return False
-            if len(answers.can_answer) != 0:
-                return False
-            for a in answers.as_dict().values():
-                # module-type questions
-                if isinstance(a, ModuleAnswers) and a.task:
-                    if not a.task.is_finished():
-                        return False
-                # module-set-type questions
-                if isinstance(a, list):
-                    for item in a:
-                        if isinstance(item, ModuleAnswers) and item.task:
-                            if not item.task.is_finished():
-                                return False
-            return True
+            return self._compute_is_finished(answers)
         return self._get_cached_state("is_finished", compute_is_finished)
 
+    def _compute_is_finished(self, answers):
+        # Check that all questions that need an answer have
+        # an answer and that all module-type questions are
+        # finished.
+        if len(answers.can_answer) != 0:
+            return False
+        for a in answers.as_dict().values():
+            # module-type questions
+            if isinstance(a, ModuleAnswers) and a.task:
+                if not a.task.is_finished():
+                    return False
+            # module-set-type questions
+            if isinstance(a, list):
+                for item in a:
+                    if isinstance(item, ModuleAnswers) and item.task:
+                        if not item.task.is_finished():
+                            return False
+        return True
+
     def get_progress_percent(self):
          answered, total = self.get_progress_percent_tuple()
          return (answered/total*100) if (total > 0) else 100
 
     def get_progress_percent_tuple(self):
         def compute_progress_percent():
-            # Return a tuple of the number of questions that have an answer
-            # and the total number of questions. For module-type questions
-            # that are answered, recursively add the questions of the inner module.
             try:
-                answers = self.get_answers().with_extended_info()
+                answers = self.get_answers_with_extended_info()
             except Exception:
                 # If there is an error evaluating imputed conditions,
                 # just say the task is empty.
                 return (0, 0)
+            return self._compute_progress_percent_tuple(answers)
+        return self._get_cached_state("progress_percent_tuple", compute_progress_percent)
 
-            num_answered = 0
-            num_questions = 0
-            for (q, is_answered, a, value) in answers.answertuples.values():
-                # module-type questions with a real answer
-                if isinstance(value, ModuleAnswers) and value.task:
-                    inner_answered, inner_total = value.task.get_progress_percent_tuple()
-                    num_answered += inner_answered
-                    num_questions += inner_total
-
-                # all other questions
-                else:
-                    if is_answered:
-                        num_answered += 1
-                    num_questions += 1
+    def _compute_progress_percent_tuple(self, answers):
+        # Return a tuple of the number of questions that have an answer
+        # and the total number of questions. For module-type questions
+        # that are answered, recursively add the questions of the inner module.
+        num_answered = 0
+        num_questions = 0
+        for (q, is_answered, a, value) in answers.answertuples.values():
+            # module-type questions with a real answer
+            if isinstance(value, ModuleAnswers) and value.task:
+                inner_answered, inner_total = value.task.get_progress_percent_tuple()
+                num_answered += inner_answered
+                num_questions += inner_total
+
+            # all other questions
+            else:
+                if is_answered:
+                    num_answered += 1
+                num_questions += 1
 
-            return (num_answered, num_questions)
-        return self._get_cached_state("progress_percent_tuple", compute_progress_percent)
+        return (num_answered, num_questions)
 
+    @staticmethod
+    def compute_states_in_tree(tasks, evaluated={}):
+        # Compute is_finished and get_progress_percent_tuple for the given
+        # Tasks, and the Tasks that answer their module-type questions,
+        # recursively, in one pass. Calling those methods on a Task after
+        # its cached_state was cleared evaluates the Task and then each of
+        # its sub-tasks in turn, each with its own queries and save. Here
+        # the current answers of the whole tree are loaded a level at a
+        # time, each Task is evaluated once, sub-tasks before the Tasks
+        # they answer, and the results are saved in one bulk update.
+        # Sub-tasks whose state is already cached are not loaded. The
+        # given Task instances are updated in place. evaluated may map
+        # Task IDs to the return value of get_answers_with_extended_info
+        # for Tasks that the caller already evaluated.
+        state_keys = ("is_finished", "progress_percent_tuple")
+        def needs_state(task):
+            return not isinstance(task.cached_state, dict) \
+                or any(key not in task.cached_state for key in state_keys)
+
+        # Load the current answers of the Tasks that need to be evaluated,
+        # and of their sub-tasks that need to be evaluated, a level at a time.
+        pending = OrderedDict() # Task ID => Task
+        answertuples = { } # Task ID => AnswerSet
+        subtasks = { } # Task ID => [Task]
+        level = [task for task in tasks if needs_state(task)]
+        while level:
+            next_level = OrderedDict()
+            for task in level:
+                pending[task.id] = task
+                answertuples[task.id] = AnswerSet(task.module)
+                subtasks[task.id] = []
+                if task.id in evaluated:
+                    for t in evaluated[task.id].get_subtasks():
+                        subtasks[task.id].append(t)
+                        if t.id not in pending and needs_state(t):
+                            next_level[t.id] = t
+            for task, q, a in Task.get_all_current_answer_records(
+              [task for task in level if task.id not in evaluated]):
+                if a is not None:
+                    value = a.get_value()
+                    for t in a.answered_by_task.all():
+                        subtasks[task.id].append(t)
+                        if t.id not in pending and needs_state(t):
+                            next_level[t.id] = t
+                else:
+                    value = None
+                answertuples[task.id][q.key] = (q, a is not None, a, value)
+            level = list(next_level.values())
+
+        # Point the ModuleAnswers of the sub-tasks at the Task instances in
+        # pending, so that evaluating a Task reads the state of its sub-tasks
+        # from memory, and give them the answers that were just loaded so
+        # that impute conditions that refer to them don't load them again.
+        for tuples in list(answertuples.values()) + [evaluated[id].answertuples for id in pending if id in evaluated]:
+            for q, is_answered, a, value in tuples.values():
+                for v in (value if isinstance(value, list) else [value]):
+                    if isinstance(v, ModuleAnswers) and v.task is not None \
+                      and v.task.id in pending:
+                        v.task = pending[v.task.id]
+                        if v.answertuples is None and v.task.id not in evaluated:
+                            v.answertuples = answertuples[v.task.id]
+
+        # Evaluate the Tasks, sub-tasks first.
+        done = set()
+        def evaluate(task):
+            if task.id in done:
+                return
+            done.add(task.id) # also guards against cycles
+            for t in subtasks[task.id]:
+                if t.id in pending:
+                    evaluate(pending[t.id])
+            if not isinstance(task.cached_state, dict):
+                task.cached_state = { }
+            try:
+                if task.id in evaluated:
+                    answers = evaluated[task.id]
+                else:
+                    answers = task.get_answers_with_extended_info(
+                        answers=ModuleAnswers(task.module, task, answertuples[task.id]),
+                        save=False)
+            except Exception:
+                # If there is an error evaluating imputed conditions,
+                # just say the task is unfinished and empty.
+                task.cached_state.setdefault("is_finished", False)
+                task.cached_state.setdefault("progress_percent_tuple", (0, 0))
+                return
+            if "is_finished" not in task.cached_state:
+                task.cached_state["is_finished"] = task._compute_is_finished(answers)
+            if "progress_percent_tuple" not in task.cached_state:
+                task.cached_state["progress_percent_tuple"] = task._compute_progress_percent_tuple(answers)
+        for task in pending.values():
+            evaluate(task)
+
+        # Save. The module state of the Tasks that the caller evaluated was
+        # saved then (on other Task instances).
+        Task.save_cached_states([task for task in pending.values() if task.id in evaluated],
+            ["is_finished", "progress_percent_tuple"])
+        Task.save_cached_states([task for task in pending.values() if task.id not in evaluated],
+            ["is_finished", "progress_percent_tuple", "module_state", "module_state_changed_keys"])
 
     # This method is called any time an answer to any of this Task's questions
     # is changed, or for questions that are answered by sub-tasks, and if any
     # of their answers changed too, recursively.
-    def on_answer_changed(self):
+    #
+    # If the caller knows which of this Task's questions had their answers
+    # changed, it can pass their keys in changed_keys. Then this Task's
+    # saved module state is kept (see get_answers_with_extended_info)
+    # so that it can be updated incrementally.
+    @transaction.atomic
+    def on_answer_changed(self, changed_keys=None):
+        # The changed keys are merged into the ones already saved, so the
+        # Task's row is locked from reading them until the merged keys are
+        # written, as in save_cached_states. Otherwise answers to different
+        # questions saved at the same time could each overwrite the other's
+        # changed key.
+        cached_state = None
+        if changed_keys:
+            cached_state = Task.objects.select_for_update().only("cached_state").get(id=self.id).cached_state
+
         Task.clear_state({ self })
 
+        if isinstance(cached_state, dict) and "module_state" in cached_state:
+            self.cached_state = {
+                "module_state": cached_state["module_state"],
+                "module_state_changed_keys": sorted(set(cached_state.get("module_state_changed_keys", [])) | set(changed_keys)),
+            }
+            Task.objects.filter(id=self.id).update(cached_state=self.cached_state)
+        else:
+            self.cached_state = None
+
+        # clear_state bumped the updated time. Keep this instance in sync
+        # so that it can go on to save its cached_state.
+        self.updated = Task.objects.values_list("updated", flat=True).get(id=self.id)
+
     # Do the work of clearing the cached_state of a set of Tasks.
     # * Clear the Tasks' cached_state field and bump their 'updated' time so
     #   anyone waiting for changes to the tasks knows a change ocurred.
     # * Do the same for any Tasks that these Tasks are a current answer of a question to.
-    # * Since templates can peek up to the project and see anything within it,
-    #   then any Task in the same project must also have their cache cleared.
-    #   TODO: It would be nice to know whether or not the cached_state is actually
-    #   based on project-level information because most Tasks might not peek
-    #   up and Tasks that don't do not need to have their cached_state cleared
-    #   in this case.
+    # * Templates can peek up to the project and organization and see anything
+    #   within their root Tasks. So if a project's root Task is affected, then
+    #   the Tasks in the project whose module's templates refer to "project"
+    #   are affected too, and likewise for an organization's project and Tasks
+    #   whose templates refer to "organization". Tasks that don't peek up keep
+    #   their cached_state.
     @staticmethod
     def clear_state(tasks):
+        from .module_logic import get_module_context_dependencies
+
+        # Look up each module's dependencies once, since many tasks share
+        # a module and the lookup queries the module's questions.
+        module_context_dependencies = { }
+        def get_tasks_referring_to(tasks, context_variable):
+            ret = set()
+            for task in tasks.select_related("module"):
+                if task.module_id not in module_context_dependencies:
+                    module_context_dependencies[task.module_id] = get_module_context_dependencies(task.module)
+                if context_variable in module_context_dependencies[task.module_id]:
+                    ret.add(task)
+            return ret
+
         tasks = set(tasks)
         target_tasks = tasks
+        seen_projects = set()
         while target_tasks:
             new_tasks = set()
 
-            # Add Tasks whose current answers include any of these Tasks. First
-            # find TaskAnswerHistory records that reference the tasks....
-            ans = TaskAnswerHistory.objects.filter(answered_by_task__in=target_tasks)\
-                .select_related("taskanswer__task")
-
-            # Then find the IDs of the *current* answers of any of those questions.
-            curans = list(TaskAnswer.objects\
-                .filter(id__in={ a.taskanswer.id for a in ans })\
-                .annotate(current_answer_id=models.Max('answer_history__id'))\
-                .values_list('current_answer_id', flat=True))
-
-            # And filter so we only have current answers remaining.
-            ans = ans.filter(id__in=curans)
-
-            # Add Tasks in the same Project as any of the Tasks seen so far.
-            for task in Task.objects.filter(project__in={ t.project_id for t in target_tasks }):
-                new_tasks.add(task)
+            # Add Tasks whose current answers include any of these Tasks.
+            for ans in TaskAnswerHistory.objects\
+                .filter(answered_by_task__in=target_tasks, taskanswer__current_answer=models.F('id'))\
+                .select_related("taskanswer__task"):
+                new_tasks.add(ans.taskanswer.task)
+
+            # If any of these Tasks are the root Task of a project, add the
+            # Tasks that refer to the project, and if the project is an
+            # organization's project, the Tasks that refer to the organization.
+            for project in Project.objects\
+                .filter(root_task__in=target_tasks)\
+                .exclude(id__in=seen_projects):
+                seen_projects.add(project.id)
+                new_tasks |= get_tasks_referring_to(
+                    Task.objects.filter(project=project),
+                    "project")
+                if project.is_organization_project:
+                    new_tasks |= get_tasks_referring_to(
+                        Task.objects.filter(project__organization=project.organization_id),
+                        "organization")
 
             new_tasks -= tasks
             tasks |= new_tasks
@@ -856,6 +1336,14 @@ class Task(models.Model):
         tasks_qs = Task.objects.filter(id__in={ t.id for t in tasks })
         tasks_qs.update(cached_state=None, updated=timezone.now())
 
+        # Forget answers evaluated earlier in this request.
+        from .module_logic import ProjectEvaluationSession
+        ProjectEvaluationSession.clear_current()
+
+        # Queue new exports of any output documents that have been exported
+        # before, since they are now out of date.
+        OutputDocumentExport.queue_reexports(tasks_qs)
+
 
     def get_status_display(self):
         # Is this task done?
@@ -866,6 +1354,121 @@ class Task(models.Model):
 
     # AUTHZ
 
+    @staticmethod
+    def get_ancestor_task_ids(task_ids):
+        # Returns the IDs of all Tasks that refer to any of the given Tasks
+        # as a *current* answer to a question, directly or through other
+        # Tasks. Tasks in the same project are included because they may in
+        # turn be answers to tasks in other projects. Runs one query per
+        # level of the answer tree using the current answer pointers.
+        ancestors = set()
+        search_ids = set(task_ids)
+        while search_ids:
+            parent_ids = set(TaskAnswerHistory.objects
+                .filter(answered_by_task__in=search_ids, taskanswer__current_answer=models.F('id'))
+                .values_list("taskanswer__task_id", flat=True))
+            search_ids = parent_ids - ancestors
+            ancestors |= parent_ids
+        return ancestors
+
+    @staticmethod
+    def get_descendant_task_ids(task_ids):
+        # The inverse of get_ancestor_task_ids: Returns the IDs of all Tasks
+        # that are current answers to questions in any of the given Tasks,
+        # directly or through other Tasks.
+        descendants = set()
+        search_ids = set(task_ids)
+        while search_ids:
+            child_ids = set(TaskAnswerHistory.objects
+                .filter(taskanswer__task__in=search_ids, taskanswer__current_answer=models.F('id'))
+                .exclude(answered_by_task=None)
+                .values_list("answered_by_task", flat=True))
+            search_ids = child_ids - descendants
+            descendants |= child_ids
+        return descendants
+
+    def get_cached_ancestor_task_ids(self):
+        # get_ancestor_task_ids for this Task, kept in cached_state so that
+        # access checks don't walk the answer tree on every request. The
+        # entry is removed from this Task and every Task below it by
+        # clear_ancestor_task_ids whenever a current answer that points to a
+        # Task changes (see TaskAnswer.create_answer_history).
+        return set(self._get_cached_state("ancestor_task_ids",
+            lambda : sorted(Task.get_ancestor_task_ids([self.id]))))
+
+    @staticmethod
+    def resolve_ancestor_task_ids(tasks):
+        # Compute the cached ancestors (see get_cached_ancestor_task_ids) of
+        # the Tasks whose ancestors aren't cached, all at once: the answer
+        # tree is walked upward from all of them together with one query per
+        # level, and the results are saved with one update. The given Task
+        # instances are updated in place.
+        tasks = [
+            task for task in tasks
+            if not (isinstance(task.cached_state, dict) and "ancestor_task_ids" in task.cached_state)
+        ]
+        if not tasks:
+            return
+
+        # Find the Tasks that have each Task as a current answer, starting
+        # with the given Tasks and continuing with the Tasks found.
+        parents = { } # Task ID => set of Task IDs
+        search_ids = { task.id for task in tasks }
+        while search_ids:
+            for task_id in search_ids:
+                parents[task_id] = set()
+            for child_id, parent_id in TaskAnswerHistory.answered_by_task.through.objects\
+                .filter(task_id__in=search_ids, taskanswerhistory__taskanswer__current_answer=models.F('taskanswerhistory_id'))\
+                .values_list("task_id", "taskanswerhistory__taskanswer__task_id"):
+                parents[child_id].add(parent_id)
+            search_ids = set().union(*parents.values()) - set(parents)
+
+        # Collect the ancestors of each Task.
+        for task in tasks:
+            ancestors = set()
+            stack = list(parents[task.id])
+            while stack:
+                task_id = stack.pop()
+                if task_id not in ancestors:
+                    ancestors.add(task_id)
+                    stack.extend(parents[task_id])
+            if not isinstance(task.cached_state, dict):
+                task.cached_state = { }
+            task.cached_state["ancestor_task_ids"] = sorted(ancestors)
+
+        # Save.
+        Task.save_cached_states(tasks, ["ancestor_task_ids"])
+
+    @staticmethod
+    def clear_ancestor_task_ids(task_ids):
+        # The ancestors of these Tasks and all of the Tasks below them may
+        # have changed. Remove their cached ancestors (and nothing else
+        # from their cached_state).
+        #
+        # The cached ancestors grant access, so unlike save_cached_states,
+        # which may skip rows, this waits for the locks on the rows. The
+        # Tasks' updated time is bumped so that ancestors computed before
+        # the change but saved after it are discarded by save_cached_states.
+        task_ids = set(task_ids) | Task.get_descendant_task_ids(task_ids)
+        with transaction.atomic():
+            tasks = []
+            for task in Task.objects.select_for_update().filter(id__in=task_ids).only("id", "updated", "cached_state"):
+                if isinstance(task.cached_state, dict) and "ancestor_task_ids" in task.cached_state:
+                    del task.cached_state["ancestor_task_ids"]
+                    task.updated = timezone.now()
+                    tasks.append(task)
+            Task.objects.bulk_update(tasks, ["cached_state", "updated"])
+
+    @staticmethod
+    def is_editor_or_member_of_any(user, task_filter):
+        # Is the user the editor of, or a member of the project of, any of
+        # the Tasks matching task_filter (a Q object)? This is the source of
+        # all task-level access, so it's a single indexed query.
+        return Task.objects\
+            .filter(task_filter)\
+            .filter(models.Q(editor=user) | models.Q(project__members__user=user))\
+            .exists()
+
     @staticmethod
     def get_all_tasks_readable_by(user, recursive=False):
         # Symmetric with get_access_level == "READ". See that for the basic logic.
@@ -875,23 +1478,11 @@ class Task(models.Model):
             ).distinct()
 
         if recursive:
-            # Add in all tasks that these tasks refer to via answers to questions.
-            # (Including tasks in the same project because those may reference
-            # other tasks in other projects with different access levels.)
-            seen_task_ids = set(t.id for t in tasks)
-            tasks1 = tasks
-            while len(tasks1) > 0:
-                # Collect all of the tasks referenced by the last batch as answers,
-                # except ones we've already seen.
-                tasks2 = set()
-                for t in tasks1:
-                    for q, a in t.get_current_answer_records():
-                        if a:
-                            tasks2 |= set(a.answered_by_task.all())
-                tasks2_ids = set(tt.id for tt in tasks2)
-                seen_task_ids |= tasks2_ids
-                tasks |= Task.objects.filter(id__in=tasks2_ids).distinct()
-                tasks1 = tasks2
+            # Add in all tasks that these tasks refer to via answers to questions,
+            # recursively. (Including tasks in the same project because those may
+            # reference other tasks in other projects with different access levels.)
+            referenced_task_ids = Task.get_descendant_task_ids(tasks.values_list("id", flat=True))
+            tasks |= Task.objects.filter(id__in=referenced_task_ids).distinct()
 
         return tasks
 
@@ -899,37 +1490,21 @@ class Task(models.Model):
         # symmetric with get_all_tasks_readable_by
         if self.deleted_at and not allow_access_to_deleted:
             return False
-        if self.editor == user:
-            # The editor.
-            return "WRITE"
-        if ProjectMembership.objects.filter(project=self.project, user=user).exists():
-            # All project members have read-write access to the tasks in that projectget.
-            return "WRITE"
+        if not user.is_authenticated:
+            return None
 
+        # The editor and all project members have read-write access to the
+        # task. Access also comes from access to any Task that refers to this
+        # Task as a *current* answer to a question, expanded out recursively.
+        # Those Tasks grant the same access they have themselves, unless they
+        # are deleted.
+        if self.editor_id == user.id:
+            return "WRITE"
+        task_filter = models.Q(id=self.id)
         if recursive:
-            # Access also comes from access to any Task that refers to this Task as a
-            # *current* answer to the question. First fetch all tasks that refer to this
-            # task, and then filter to see if the answer is current. Include Tasks in
-            # the same project because they may in turn be answers to tasks in other
-            # projects. Expand this out recursively.
-            parent_tasks = set()
-            search_tasks = [self]
-            while len(search_tasks) > 0:
-                ptasks = set(
-                    tah.taskanswer.task
-                    for tah in TaskAnswerHistory.objects
-                        .filter(answered_by_task__in=search_tasks)
-                        .exclude(taskanswer__task__id__in=[t.id for t in parent_tasks])
-                        .select_related("taskanswer__task")
-                    if tah.is_latest())
-                parent_tasks |= ptasks
-                search_tasks = ptasks
-
-            access_levels = set(t.get_access_level(user, recursive=False) for t in parent_tasks)
-            if "WRITE" in access_levels:
-                return "WRITE"
-            if "READ" in access_levels:
-                return "READ"
+            task_filter |= models.Q(id__in=self.get_cached_ancestor_task_ids(), deleted_at=None)
+        if Task.is_editor_or_member_of_any(user, task_filter):
+            return "WRITE"
 
         return None
 
@@ -1020,8 +1595,6 @@ class Task(models.Model):
 
     # COMPUTED PROPERTIES
 
-    IS_COMPUTING_TITLE = False
-
     @property
     def title(self):
         # If the title_override is set, return that.
@@ -1034,27 +1607,67 @@ class Task(models.Model):
             return self.module.spec["title"]
 
         # Render the instance-name template if its rendered value is not cached.
-        if self.cached_state is None:
-            self.cached_state = { }
-        if "title" not in self.cached_state:
+        return self._get_cached_state("title", self._render_title)
+
+    # The IDs of the Tasks whose titles are being rendered by this thread.
+    # Web requests are handled in separate threads, so this must not be
+    # shared between them.
+    computing_titles = threading.local()
+
+    def _render_title(self, answers=None):
+        computing = getattr(Task.computing_titles, "task_ids", None)
+        if computing is None:
+            computing = Task.computing_titles.task_ids = set()
+        if self.id in computing:
+            # Hopefully this never occurs, but rendering the instance-name
+            # template could end up causing the task's title to be computed.
+            raise RuntimeError("Infinite recursion!")
+
+        computing.add(self.id)
+        try:
+            return self.render_simple_string(
+                "instance-name", self.module.spec["title"],
+                answers=answers,
+                is_computing_title=True).strip()
+        finally:
+            computing.discard(self.id)
+
+    @staticmethod
+    def resolve_titles(tasks):
+        # Compute the titles of the Tasks whose titles aren't cached, all at
+        # once, so that pages that list many Tasks don't render them and
+        # save them one at a time. The answers of all of the Tasks are loaded
+        # together and the titles are saved with one update. The given Task
+        # instances are updated in place so that .title is then cached.
+        tasks = [
+            task for task in tasks
+            if not task.title_override
+            and "instance-name" in task.module.spec
+            and not (isinstance(task.cached_state, dict) and "title" in task.cached_state)
+        ]
+        if not tasks:
+            return
 
-            if Task.IS_COMPUTING_TITLE:
-                # Hopefully this never occurs, but rendering the instance-name
-                # template could end up causing the task's title to be computed.
-                raise RuntimeError("Infinite recursion!")
+        # Load the answers.
+        answertuples = { task.id: AnswerSet(task.module) for task in tasks }
+        for task, q, a in Task.get_all_current_answer_records(tasks):
+            answertuples[task.id][q.key] = (q, a is not None, a, a.get_value() if a is not None else None)
 
-            Task.IS_COMPUTING_TITLE = True
+        # Render the titles.
+        for task in tasks:
+            if not isinstance(task.cached_state, dict):
+                task.cached_state = { }
             try:
-                title = self.render_simple_string(
-                    "instance-name", self.module.spec["title"],
-                    is_computing_title=True).strip()
-            finally:
-                Task.IS_COMPUTING_TITLE = False
-
-            self.cached_state["title"] = title
-            self.save(update_fields=["cached_state"])
+                answers = ModuleAnswers(task.module, task, answertuples[task.id]).with_extended_info()
+            except (KeyError, ValueError):
+                # As in render_simple_string, fall back to the Module's
+                # title if the imputed answers can't be evaluated.
+                task.cached_state["title"] = task.module.spec["title"].strip()
+                continue
+            task.cached_state["title"] = task._render_title(answers)
 
-        return self.cached_state["title"]
+        # Save.
+        Task.save_cached_states(tasks, ["title"])
 
 
     def render_introduction(self):
@@ -1066,14 +1679,14 @@ class Task(models.Model):
             'Can you take over answering %s for %s and let me know when it is done?'
                 % (self.title, self.project.title))
 
-    def render_simple_string(self, field, default, **kwargs):
+    def render_simple_string(self, field, default, answers=None, **kwargs):
         try:
             return render_content(
                 {
                     "template": self.module.spec[field],
                     "format": "text",
                 },
-                self.get_answers().with_extended_info(), # get answers + imputed answers
+                answers if answers is not None else self.get_answers().with_extended_info(), # get answers + imputed answers
                 "text",
                 "%s %s" % (repr(self.module), field),
                 **kwargs
@@ -1095,7 +1708,7 @@ class Task(models.Model):
             answers = self.get_answers()
         return answers.render_output(use_data_urls=use_data_urls)
 
-    def download_output_document(self, document_id, download_format, answers=None):
+    def download_output_document(self, document_id, download_format, answers=None, timeout=10):
         # Map output format to:
         # 1) pandoc format name
         # 2) typical file extension
@@ -1170,7 +1783,7 @@ class Task(models.Model):
             with subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE) as proc:
                 stdout, stderr = proc.communicate(
                       html.encode("utf8"),
-                      timeout=10)
+                      timeout=timeout)
                 if proc.returncode != 0: raise subprocess.CalledProcessError(proc.returncode, ' '.join(cmd))
 
             blob = stdout
@@ -1190,7 +1803,7 @@ class Task(models.Model):
                     ) as proc:
                     proc.communicate(
                         doc["html"].encode("utf8"),
-                        timeout=10)
+                        timeout=timeout)
                     if proc.returncode != 0: raise subprocess.CalledProcessError(0, '')
 
                 # return the content of the temporary file
@@ -1244,12 +1857,13 @@ class Task(models.Model):
             qfilter = { "__key": question } # string key
 
         # Optimize for the sub-task already existing. Query directly for
-        # the most recent TaskAnswerHistory record.
+        # the current TaskAnswerHistory record, using the denormalized
+        # TaskAnswer.current_answer pointer rather than sorting the history.
         ansh = TaskAnswerHistory.objects\
-            .filter(taskanswer__task=self, **{ "taskanswer__question"+k: v for k, v in qfilter.items() })\
+            .filter(taskanswer__task=self, taskanswer__current_answer=models.F('id'),
+                **{ "taskanswer__question"+k: v for k, v in qfilter.items() })\
             .select_related("taskanswer__task__module", "taskanswer__question", "answered_by")\
             .prefetch_related("answered_by_task__module__questions")\
-            .order_by('-id')\
             .first()
 
         if ansh:
@@ -1301,22 +1915,14 @@ class Task(models.Model):
             task.was_just_created_by_get_or_create_subtask = True
 
             # Create a new TaskAnswerHistory instance. We never modify
-            # existing instances!
+            # existing instances! For "module-set"-type questions, copy in
+            # the previous set of answers. Then add the new task.
             prev_ansh = ansh
-            ansh = TaskAnswerHistory.objects.create(
-                taskanswer=ans,
+            ansh = ans.create_answer_history(
+                answered_by_tasks=(list(prev_ansh.answered_by_task.all()) if prev_ansh else []) + [task],
                 answered_by=user,
                 stored_value=None)
 
-            # For "module-set"-type questions, copy in the previous set
-            # of answers.
-            if prev_ansh:
-                for t in prev_ansh.answered_by_task.all():
-                    ansh.answered_by_task.add(t)
-
-            # Add the new task.
-            ansh.answered_by_task.add(task)
-
             # Mark that the Task has had an answer changed.
             self.on_answer_changed()
 
@@ -1557,9 +2163,70 @@ class Task(models.Model):
 
         return did_update_any_questions
 
+class TaskComputeClaim(models.Model):
+    # Records that a process is computing a value that it will store in a
+    # Task's cached_state (or in the rendered_document_store), so that other
+    # processes wait for it rather than compute it too (see Task._run_once).
+    task = models.ForeignKey(Task, related_name="compute_claims", on_delete=models.CASCADE, help_text="The Task that the value is being computed for.")
+    key = models.CharField(max_length=255, help_text="The cached_state key (or other name) of the value being computed.")
+    expires = models.DateTimeField(help_text="When other processes stop waiting for the value and compute it themselves.")
+
+    class Meta:
+        unique_together = [('task', 'key')]
+
+    def __str__(self):
+        # For the admin.
+        return "%s of %s" % (self.key, self.task)
+
+    @staticmethod
+    def claim(task, key):
+        # Returns a new claim on the key of the Task, or None if another
+        # process has an unexpired claim on it.
+        from django.db import IntegrityError
+        now = timezone.now()
+        claim = TaskComputeClaim(task=task, key=key, expires=now + Task.COMPUTE_CLAIM_TIMEOUT)
+
+        # Take over an expired claim.
+        if TaskComputeClaim.objects.filter(task=task, key=key, expires__lte=now).update(expires=claim.expires):
+            return claim
+
+        try:
+            with transaction.atomic():
+                claim.save()
+        except IntegrityError:
+            # Another process has claimed it.
+            return None
+        return claim
+
+    def release(self):
+        # Delete the claim, unless it expired and another process took it
+        # over.
+        TaskComputeClaim.objects.filter(task=self.task_id, key=self.key, expires=self.expires).delete()
+
+class RenderedOutputDocument(models.Model):
+    # A rendered output document of a Task, stored so that every process
+    # can use it without rendering it again (see
+    # module_logic.RenderedDocumentStore).
+    task = models.ForeignKey(Task, related_name="rendered_documents", on_delete=models.CASCADE, help_text="The Task whose output document this is.")
+    output_version = models.CharField(max_length=32, help_text="The output version of the Task (see Task.get_output_version) that the document was rendered from.")
+    document_index = models.IntegerField(help_text="The index of the document in the Module's output documents.")
+    output_format = models.CharField(max_length=32, help_text="The format that the document was rendered in.")
+    use_data_urls = models.BooleanField(help_text="Whether images in the document are data: URLs.")
+    content = models.TextField(help_text="The rendered document.")
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('task', 'output_version', 'document_index', 'output_format', 'use_data_urls')]
+
+    def __str__(self):
+        # For the admin.
+        return "Document %d (%s) of %s" % (self.document_index, self.output_format, self.task)
+
 class TaskAnswer(models.Model):
     task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name="answers", help_text="The Task that this TaskAnswer is a part of.")
     question = models.ForeignKey(ModuleQuestion, on_delete=models.PROTECT, help_text="The question (within the Task's Module) that this TaskAnswer is answering.")
+    current_answer = models.ForeignKey('TaskAnswerHistory', blank=True, null=True, on_delete=models.SET_NULL, related_name="+", help_text="The current (most recent) TaskAnswerHistory of this TaskAnswer, denormalized so it doesn't have to be looked up in the history. Updated whenever a TaskAnswerHistory is created.")
 
     notes = models.TextField(blank=True, help_text="Notes entered by editors working on this question.")
 
@@ -1583,12 +2250,57 @@ class TaskAnswer(models.Model):
         return self.task.get_absolute_url_to_question(self.question)
 
     def get_current_answer(self):
-        # The current answer is the one with the highest primary key.
+        # The current answer is the one with the highest primary key,
+        # which is stored in current_answer.
+        if self.current_answer_id is None:
+            return None
         return self.answer_history\
             .prefetch_related("answered_by_task__module__questions")\
-            .order_by('-id')\
+            .filter(id=self.current_answer_id)\
             .first()
 
+    def create_answer_history(self, answered_by_tasks=[], **kwargs):
+        # Create a new TaskAnswerHistory record for this TaskAnswer and make
+        # it the current answer. We never modify existing TaskAnswerHistory
+        # instances! This also kicks the TaskAnswer's updated field.
+        with transaction.atomic():
+            # Lock the TaskAnswer so that concurrent answers are made current
+            # in the order they are created, and get the current answer from
+            # the database since this instance may be out of date.
+            self.current_answer_id = TaskAnswer.objects.select_for_update()\
+                .only("current_answer").get(id=self.id).current_answer_id
+
+            # Tasks that were answers before or will be answers after this
+            # change have different ancestors now.
+            moved_task_ids = set(t.id for t in answered_by_tasks)
+            if self.current_answer_id is not None:
+                moved_task_ids |= set(TaskAnswerHistory.answered_by_task.through.objects
+                    .filter(taskanswerhistory=self.current_answer_id)
+                    .values_list("task_id", flat=True))
+
+            answer = TaskAnswerHistory.objects.create(taskanswer=self, **kwargs)
+            for t in answered_by_tasks:
+                answer.answered_by_task.add(t)
+            self.current_answer = answer
+            self.save(update_fields=["current_answer", "updated"])
+
+            if moved_task_ids:
+                Task.clear_ancestor_task_ids(moved_task_ids)
+        return answer
+
+    @staticmethod
+    def update_current_answers(taskanswers=None):
+        # Set the current_answer field of TaskAnswers (all of them if
+        # taskanswers is None) from their answer history in one query.
+        # Returns the number of TaskAnswers updated.
+        if taskanswers is None:
+            taskanswers = TaskAnswer.objects.all()
+        return taskanswers.update(current_answer=models.Subquery(
+            TaskAnswerHistory.objects
+                .filter(taskanswer=models.OuterRef('pk'))
+                .order_by('-id')
+                .values('id')[:1]))
+
     def has_answer(self):
         ans = self.get_current_answer()
         if ans and not ans.cleared:
@@ -1675,17 +2387,14 @@ class TaskAnswer(models.Model):
             return False
 
         # Store a new TaskAnswerHistory record with the cleared flag set.
-        TaskAnswerHistory.objects.create(
-            taskanswer=self,
+        self.create_answer_history(
             answered_by=user,
             stored_value=None,
             answered_by_file=None,
             cleared=True)
 
-        # Kick the TaskAnswer's updated fields and the Task to mark that the
-        # answer has changed.
-        self.save(update_fields=[])
-        self.task.on_answer_changed()
+        # Kick the Task to mark that the answer has changed.
+        self.task.on_answer_changed(changed_keys={ self.question.key })
         return True
 
     def save_answer(self,
@@ -1727,8 +2436,8 @@ class TaskAnswer(models.Model):
             return False
 
         # The answer is new or changing. Create a new record for it.
-        answer = TaskAnswerHistory.objects.create(
-            taskanswer=self,
+        self.create_answer_history(
+            answered_by_tasks=answered_by_tasks,
             answered_by=user,
             answered_by_method=method,
             stored_value=value,
@@ -1736,13 +2445,9 @@ class TaskAnswer(models.Model):
             answered_by_file=answered_by_file,
             skipped_reason=skipped_reason,
             unsure=unsure)
-        for t in answered_by_tasks:
-            answer.answered_by_task.add(t)
 
-        # Kick the Task and TaskAnswer's updated field and let the Task know that
-        # its answers have changed.
-        self.save(update_fields=[])
-        self.task.on_answer_changed()
+        # Let the Task know that its answers have changed.
+        self.task.on_answer_changed(changed_keys={ self.question.key })
 
         # Return True to indicate we saved something.
         return True
@@ -1769,6 +2474,8 @@ class TaskAnswer(models.Model):
 
     # required to attach a Discussion to it
     def get_project_context_dict(self):
+        # The discussion shows both this Task's title and the project's.
+        Task.resolve_titles([self.task, self.task.project.root_task])
         return {
             "id": self.task.project.id,
             "title": self.task.project.title,
@@ -1896,7 +2603,7 @@ class TaskAnswerHistory(models.Model):
 
     def is_latest(self):
         # Is this the most recent --- the current --- answer for a TaskAnswer.
-        return self.taskanswer.get_current_answer() == self
+        return self.taskanswer.current_answer_id == self.id
 
     def is_skipped(self):
         # A skipped question is one whose answer is None,
@@ -1937,100 +2644,15 @@ class TaskAnswerHistory(models.Model):
         # The "file" question type is answered by a blob that is uploaded
         # by the user. The stored_value field is not used. Instead the
         # answered_by_file field points to the blob. The returned data is
-        # a dict about the blob.
+        # a dict about the blob, which loads its metadata and data URLs
+        # only when they are accessed.
         elif q.spec["type"] == "file":
             # Get the Django File object instance.
             blob = self.answered_by_file
             if not blob.name:
                 # Question was skipped.
                 return None
-
-            # Get the dbstorage.models.StoredFile instance which holds
-            # an auto-detected mime type.
-            from dbstorage.models import StoredFile
-            sf = StoredFile.objects.only("mime_type").get(path=blob.name)
-
-            # Create a display string explaining the file type.
-            if sf.mime_type == "text/plain":
-                file_type = "plain text"
-            elif sf.mime_type.startswith("image/"):
-                file_type = "image"
-            elif sf.mime_type == "text/html":
-                file_type = "HTML"
-            else:
-                import mimetypes
-                file_type = mimetypes.guess_extension(sf.mime_type, strict=False)[1:]
-
-            # Get the URL that can retreive the resource. It's behind
-            # auth so we don't use blob.url, which won't work because
-            # we haven't exposed that url route.
-            import urllib
-            url = self.taskanswer.task.get_absolute_url() \
-                + "/question/" + urllib.parse.quote(self.taskanswer.question.key) \
-                + "/history/" + str(self.id) \
-                + "/media"
-
-            # Make it an absolute URL so that when we expose it through
-            # the API it makes sense.
-            from urllib.parse import urljoin
-            url = urljoin(settings.SITE_ROOT_URL, url)
-
-            # Convert it to a data URL so that it can be rendered in exported documents.
-            content_dataurl = None
-            if q.spec.get("file-type") == "image":
-                content_dataurl = image_to_dataurl(self.answered_by_file, 640)
-
-            # Construct a thumbnail and a URL to it.
-            thumbnail_url = None
-            thumbnail_dataurl = None
-            if not self.thumbnail:
-                # Try to construct a thumbnail.
-                if sf.mime_type == "text/html":
-                    # Use wkhtmltoimage.
-                    import subprocess # nosec
-                    try:
-                        # Pipe to subprocess.
-                        # xvfb is required to run wkhtmltopdf in headless mode on Debian, see https://github.com/wkhtmltopdf/wkhtmltopdf/issues/2037#issuecomment-62019521.
-                        cmd = ["/usr/bin/xvfb-run", "--", "/usr/bin/wkhtmltoimage",
-                                "-q", # else errors go to stdout
-                                "--disable-javascript",
-                                "-f", "png",
-                                # "--disable-smart-width", - generates a warning on stdout that qt is unpatched, which happens in headless mode
-                                "--zoom", ".7",
-                                "--width", "700",
-                                "--height", str(int(700*9/16)),
-                                "-", "-"]
-                        with subprocess.Popen(cmd,
-                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
-                            ) as proc:
-                            stdout, stderr = proc.communicate(
-                                self.answered_by_file.read(),
-                                timeout=10)
-                            if proc.returncode != 0: raise subprocess.CalledProcessError(proc.returncode, ' '.join(cmd))
-
-                        # Store PNG.
-                        from django.core.files.base import ContentFile
-                        value = ContentFile(stdout)
-                        value.name = "thumbnail.png" # needs a name for the storage backend?
-                        self.thumbnail = value
-                        self.save(update_fields=["thumbnail"])
-                    except subprocess.CalledProcessError as e:
-                        print(e)
-
-            if self.thumbnail:
-                # If we have a thumbnail, indicate so by returning a URL to it.
-                thumbnail_url = url + "?thumbnail=1"
-                thumbnail_dataurl = image_to_dataurl(self.thumbnail, 640)
-
-            return {
-                "url": url,
-                "content_dataurl": content_dataurl,
-                "size": blob.size,
-                "type": sf.mime_type,
-                "type_display": file_type,
-                "thumbnail_url": thumbnail_url,
-                "thumbnail_dataurl": thumbnail_dataurl,
-            }
+            return FileAnswerValue(self)
         
         # For all other question types, the value is stored in the stored_value
         # field.
@@ -2053,6 +2675,57 @@ class TaskAnswerHistory(models.Model):
             else:
                 raise Exception("Invalid value in stored_encoding field.")
 
+    @staticmethod
+    def get_answers_needing_thumbnails():
+        # Returns the file answers that a thumbnail can be generated for
+        # but hasn't been yet. Only HTML files get thumbnails.
+        from dbstorage.models import StoredFile
+        return TaskAnswerHistory.objects\
+            .filter(models.Q(thumbnail="") | models.Q(thumbnail=None))\
+            .filter(answered_by_file__in=StoredFile.objects.filter(mime_type="text/html").values("path"))
+
+    def generate_thumbnail(self):
+        # Try to construct a thumbnail. This runs an external program, so
+        # it's done by the generate_thumbnails management command and not
+        # in web requests. Returns whether a thumbnail was generated.
+        if not self.answered_by_file.name:
+            return False
+        from dbstorage.models import StoredFile
+        sf = StoredFile.objects.only("mime_type").get(path=self.answered_by_file.name)
+        if sf.mime_type == "text/html":
+            # Use wkhtmltoimage.
+            import subprocess # nosec
+            try:
+                # Pipe to subprocess.
+                # xvfb is required to run wkhtmltopdf in headless mode on Debian, see https://github.com/wkhtmltopdf/wkhtmltopdf/issues/2037#issuecomment-62019521.
+                cmd = ["/usr/bin/xvfb-run", "--", "/usr/bin/wkhtmltoimage",
+                        "-q", # else errors go to stdout
+                        "--disable-javascript",
+                        "-f", "png",
+                        # "--disable-smart-width", - generates a warning on stdout that qt is unpatched, which happens in headless mode
+                        "--zoom", ".7",
+                        "--width", "700",
+                        "--height", str(int(700*9/16)),
+                        "-", "-"]
+                with subprocess.Popen(cmd,
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                    ) as proc:
+                    stdout, stderr = proc.communicate(
+                        self.answered_by_file.read(),
+                        timeout=10)
+                    if proc.returncode != 0: raise subprocess.CalledProcessError(proc.returncode, ' '.join(cmd))
+
+                # Store PNG.
+                from django.core.files.base import ContentFile
+                value = ContentFile(stdout)
+                value.name = "thumbnail.png" # needs a name for the storage backend?
+                self.thumbnail = value
+                self.save(update_fields=["thumbnail"])
+                return True
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+                print(e)
+        return False
+
     def get_answer_display(self):
         if self.cleared:
             return "[marked unanswered]"
@@ -2245,10 +2918,295 @@ class TaskAnswerHistory(models.Model):
 
         return value, answered_by_tasks, answered_by_file, subtasks_updated
 
+class FileAnswerValue(dict):
+    # The value of an answer to a "file" question. It's a dict with the URL
+    # to the uploaded file, its size, MIME type, and a display string for
+    # its type, a data URL for its content if the question is for an image,
+    # and a URL and data URL to a thumbnail if one has been generated.
+    #
+    # Answers are loaded often just to check whether questions are answered,
+    # e.g. for impute conditions and progress, so everything but the URL is
+    # loaded only when it is first accessed: the file metadata takes a query
+    # and the data URLs require reading and resizing the images.
+
+    metadata_keys = ("size", "type", "type_display", "thumbnail_url")
+    dataurl_keys = ("content_dataurl", "thumbnail_dataurl")
+
+    def __init__(self, answer):
+        # Get the URL that can retreive the resource. It's behind
+        # auth so we don't use blob.url, which won't work because
+        # we haven't exposed that url route.
+        import urllib
+        url = answer.taskanswer.task.get_absolute_url() \
+            + "/question/" + urllib.parse.quote(answer.taskanswer.question.key) \
+            + "/history/" + str(answer.id) \
+            + "/media"
+
+        # Make it an absolute URL so that when we expose it through
+        # the API it makes sense.
+        from urllib.parse import urljoin
+        url = urljoin(settings.SITE_ROOT_URL, url)
+
+        super().__init__(url=url)
+        self.answer = answer
+        self.loaded_keys = set()
+
+    def load(self, keys):
+        if keys[0] in self.loaded_keys:
+            return
+        self.loaded_keys.update(keys)
+
+        if keys == self.metadata_keys:
+            # Get the dbstorage.models.StoredFile instance which holds
+            # an auto-detected mime type and the file size.
+            from dbstorage.models import StoredFile
+            sf = StoredFile.objects.only("mime_type", "size").get(path=self.answer.answered_by_file.name)
+
+            # Create a display string explaining the file type.
+            if sf.mime_type == "text/plain":
+                file_type = "plain text"
+            elif sf.mime_type.startswith("image/"):
+                file_type = "image"
+            elif sf.mime_type == "text/html":
+                file_type = "HTML"
+            else:
+                import mimetypes
+                file_type = mimetypes.guess_extension(sf.mime_type, strict=False)[1:]
+
+            values = {
+                "size": sf.size,
+                "type": sf.mime_type,
+                "type_display": file_type,
+
+                # If we have a thumbnail, indicate so by returning a URL to it.
+                # Thumbnails are generated in the background by the
+                # generate_thumbnails management command.
+                "thumbnail_url": (self["url"] + "?thumbnail=1") if self.answer.thumbnail else None,
+            }
+
+        elif keys == self.dataurl_keys:
+            # Convert it to a data URL so that it can be rendered in exported documents.
+            values = {
+                "content_dataurl":
+                    image_to_dataurl(self.answer.answered_by_file, 640)
+                    if self.answer.taskanswer.question.spec.get("file-type") == "image"
+                    else None,
+                "thumbnail_dataurl":
+                    image_to_dataurl(self.answer.thumbnail, 640)
+                    if self.answer.thumbnail
+                    else None,
+            }
+
+        # Don't overwrite keys that were set explicitly.
+        for key, value in values.items():
+            self.setdefault(key, value)
+
+    def load_key(self, key):
+        for keys in (self.metadata_keys, self.dataurl_keys):
+            if key in keys:
+                self.load(keys)
+                return True
+        return False
+
+    def load_all(self):
+        self.load(self.metadata_keys)
+        self.load(self.dataurl_keys)
+
+    def __bool__(self):
+        # Answered file questions are truthy without loading anything.
+        return True
+
+    def __missing__(self, key):
+        if self.load_key(key):
+            return self[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        self.load_key(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self.load_key(key)
+        return super().__contains__(key)
+
+    def __delitem__(self, key):
+        self.load_key(key)
+        return super().__delitem__(key)
+
+    def pop(self, key, *args):
+        self.load_key(key)
+        return super().pop(key, *args)
+
+    # Everything that sees all of the keys loads all of them, so that
+    # the value behaves like the plain dict it used to be, e.g. when
+    # it is serialized to JSON.
+
+    def __iter__(self):
+        self.load_all()
+        return super().__iter__()
+
+    def __len__(self):
+        self.load_all()
+        return super().__len__()
+
+    def __eq__(self, other):
+        self.load_all()
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        self.load_all()
+        return super().__repr__()
+
+    def keys(self):
+        self.load_all()
+        return super().keys()
+
+    def values(self):
+        self.load_all()
+        return super().values()
+
+    def items(self):
+        self.load_all()
+        return super().items()
+
+    def copy(self):
+        self.load_all()
+        return dict(super().items())
+
+    def __reduce__(self):
+        # Pickle as a plain dict and not with the TaskAnswerHistory.
+        return (dict, (self.copy(),))
+
+class OutputDocumentExport(models.Model):
+    # Converting an output document to PDF or a word processor format runs
+    # external programs and can take a long time for large documents, so it
+    # is done by a background worker (the render_output_documents management
+    # command) rather than in the request. An OutputDocumentExport is both
+    # a request for an export and, once the worker is done, the result. Web
+    # requests serve the most recent finished export, even if the answers
+    # have since changed, while a new one is generated.
+
+    # Formats that are exported in the background. HTML is rendered directly.
+    BACKGROUND_FORMATS = ("pdf", "docx", "odt", "markdown", "plain")
+
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name="output_document_exports", help_text="The Task whose output document is exported.")
+    document_id = models.CharField(max_length=256, help_text="The id of the output document in the Task's Module.")
+    download_format = models.CharField(max_length=16, help_text="The format the document is exported to, e.g. pdf or docx.")
+    requested_by = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL, help_text="The user who requested the export, or null if it was queued because the answers changed.")
+
+    status = models.CharField(max_length=16, default="queued", db_index=True, choices=[("queued", "Queued"), ("running", "Running"), ("done", "Done"), ("failed", "Failed")], help_text="Where the export is in the queue.")
+    output_version = models.CharField(max_length=32, blank=True, null=True, help_text="The Task's output version (see Task.get_output_version) at the time the export was generated, which tells whether the export is up to date.")
+
+    blob = models.BinaryField(blank=True, null=True, help_text="The exported document, once it is done.")
+    filename = models.CharField(max_length=256, blank=True, null=True, help_text="A suggested filename for the exported document.")
+    mime_type = models.CharField(max_length=128, blank=True, null=True, help_text="The MIME type of the exported document.")
+    error = models.TextField(blank=True, null=True, help_text="If the export failed, the error message.")
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+    finished_at = models.DateTimeField(blank=True, null=True, help_text="When the export was done or failed.")
+
+    class Meta:
+        # There is at most one export of a document from each version of a
+        # Task's answers, even when it is requested by many users at once.
+        unique_together = [
+            ('task', 'document_id', 'download_format', 'output_version'),
+        ]
+
+    def __str__(self):
+        return "{} export of '{}' in {} ({})".format(self.download_format, self.document_id, self.task, self.status)
+
+    @staticmethod
+    def get_exports(task, document_id, download_format):
+        return OutputDocumentExport.objects.filter(task=task, document_id=document_id, download_format=download_format)
+
+    @staticmethod
+    def get_latest_finished_export(task, document_id, download_format):
+        return OutputDocumentExport.get_exports(task, document_id, download_format)\
+            .filter(status="done")\
+            .order_by('-id')\
+            .first()
+
+    @staticmethod
+    def request_export(task, document_id, download_format, user):
+        # Returns the export that will satisfy a request for the document:
+        # a queued export, if there is one, or the export of the current
+        # version of the answers, which is queued if there isn't one yet.
+        exports = OutputDocumentExport.get_exports(task, document_id, download_format)
+        export = exports.filter(status="queued").first()
+        if export:
+            return export
+        version = task.get_output_version()
+        from django.db import IntegrityError
+        try:
+            with transaction.atomic():
+                export, is_new = OutputDocumentExport.objects.get_or_create(
+                    task=task, document_id=document_id, download_format=download_format, output_version=version,
+                    defaults={ "requested_by": user })
+        except IntegrityError:
+            # Another request queued it at the same time.
+            export = exports.get(output_version=version)
+        return export
+
+    @staticmethod
+    def queue_reexports(tasks):
+        # Queue an export of every document that has been exported from any
+        # of the tasks, unless one is already queued.
+        exported = set(OutputDocumentExport.objects.filter(task__in=tasks)
+            .values_list("task_id", "document_id", "download_format").distinct())
+        if not exported:
+            return
+        exported -= set(OutputDocumentExport.objects.filter(task__in=tasks, status="queued")
+            .values_list("task_id", "document_id", "download_format"))
+        versions = {
+            task.id: task.get_output_version()
+            for task in Task.objects.filter(id__in={ task_id for task_id, document_id, download_format in exported })
+        }
+        OutputDocumentExport.objects.bulk_create([
+            OutputDocumentExport(task_id=task_id, document_id=document_id, download_format=download_format, output_version=versions[task_id])
+            for task_id, document_id, download_format in exported
+        ], ignore_conflicts=True) # another process may have queued the same export
+
+    def is_current(self):
+        # Was this export generated from the Task's current answers? Queued
+        # exports will be generated from the current answers.
+        return self.status == "queued" or self.output_version == self.task.get_output_version()
+
+    def run(self, timeout):
+        # Generate the export. Called by the background worker after it
+        # has marked this export as running. Exports are queued for the
+        # version of the answers at the time. If the answers have changed
+        # since, the export is generated from the newer answers but keeps the
+        # version it was queued for, so that it's never taken as more current
+        # than it is and stays the only export of that version.
+        try:
+            if self.output_version is None:
+                self.output_version = self.task.get_output_version()
+            self.blob, self.filename, self.mime_type = self.task.download_output_document(
+                self.document_id, self.download_format,
+                answers=self.task.get_answers_with_extended_info(),
+                timeout=timeout)
+            self.status = "done"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e) or repr(e)
+        self.finished_at = timezone.now()
+        self.save()
+
+        # Only the most recent finished export is ever served, so delete
+        # older ones to free up space.
+        if self.status == "done":
+            OutputDocumentExport.get_exports(self.task, self.document_id, self.download_format)\
+                .filter(status__in=("done", "failed"), id__lt=self.id)\
+                .delete()
+
 class InstrumentationEvent(models.Model):
     user = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL)
 
-    event_time = models.DateTimeField(auto_now_add=True, db_index=True)
+    event_time = models.DateTimeField(default=timezone.now, db_index=True)
     event_type = models.CharField(max_length=32)
     event_value = models.FloatField(null=True)
 
@@ -2267,7 +3225,414 @@ class InstrumentationEvent(models.Model):
             ('module', 'event_type', 'event_time'),
         ]
 
-def image_to_dataurl(f, size):
+class InstrumentationEventSummary(models.Model):
+    # The time of the first and the value of the last of the events of a type
+    # for a user, task and question, which is what views need to know about
+    # earlier events (e.g. when a question was first shown) without querying
+    # the ever-growing event table. Maintained by InstrumentationEventBuffer
+    # as it inserts events.
+    event_type = models.CharField(max_length=32)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    task = models.ForeignKey(Task, on_delete=models.CASCADE)
+    question = models.ForeignKey(ModuleQuestion, blank=True, null=True, on_delete=models.CASCADE)
+
+    first_event_time = models.DateTimeField(help_text="The time of the first event.")
+    last_event_time = models.DateTimeField(help_text="The time of the last event.")
+    last_event_value = models.FloatField(null=True, help_text="The value of the last event.")
+
+    class Meta:
+        unique_together = [('task', 'user', 'event_type', 'question')]
+
+class InstrumentationEventRollup(models.Model):
+    # Daily aggregates of InstrumentationEvents by event type, module and
+    # question, which the analytics page reads instead of aggregating over
+    # the (very large) event table. They are updated incrementally by the
+    # rollup_instrumentation_events management command.
+    event_type = models.CharField(max_length=32)
+    day = models.DateField()
+    module = models.ForeignKey(Module, blank=True, null=True, on_delete=models.SET_NULL)
+    question = models.ForeignKey(ModuleQuestion, blank=True, null=True, on_delete=models.SET_NULL)
+
+    events = models.IntegerField(help_text="The number of events aggregated into this rollup.")
+    count = models.IntegerField(help_text="The number of those events that have an event_value.")
+    total = models.FloatField(help_text="The sum of those events' event_values.")
+    last_event_id = models.IntegerField(db_index=True, help_text="The highest InstrumentationEvent id aggregated into this rollup. The highest over all rollups is where the next update starts.")
+
+    class Meta:
+        index_together = [
+            ('event_type', 'day'),
+        ]
+
+    # Events are inserted in batches and their ids are assigned when they are
+    # inserted, so an event can get a lower id than an event that was already
+    # rolled up if its transaction committed late. Only roll up events once
+    # they are old enough that this won't happen.
+    LAG = timedelta(minutes=10)
+
+    @staticmethod
+    def get_high_water_mark():
+        return InstrumentationEventRollup.objects.aggregate(id=models.Max('last_event_id'))["id"] or 0
+
+    @staticmethod
+    @transaction.atomic
+    def update_rollups(batch_size=100000):
+        # Aggregate up to batch_size events past the high-water mark into
+        # the rollups. Returns the number of events aggregated, which is
+        # zero once the rollups are up to date.
+        from django.db.models.functions import TruncDate
+        start = InstrumentationEventRollup.get_high_water_mark()
+        batch = InstrumentationEvent.objects.filter(id__gt=start)
+
+        # The IDs of events that have been deleted or never committed leave
+        # gaps, so limit the batch by the ID of the batch_size'th event past
+        # the high-water mark rather than by start+batch_size.
+        last_id = batch.order_by('id').values_list('id', flat=True)[batch_size-1:batch_size]
+        if last_id:
+            batch = batch.filter(id__lte=last_id[0])
+
+        end = batch\
+            .filter(event_time__lt=timezone.now()-InstrumentationEventRollup.LAG)\
+            .aggregate(id=models.Max('id'))["id"]
+        if end is None:
+            return 0
+
+        # Aggregate the new events.
+        aggregates = InstrumentationEvent.objects\
+            .filter(id__gt=start, id__lte=end)\
+            .annotate(day=TruncDate('event_time'))\
+            .values('event_type', 'day', 'module', 'question')\
+            .annotate(
+                events=models.Count('id'),
+                count=models.Count('event_value'),
+                total=models.Sum('event_value'),
+                last_event_id=models.Max('id'),
+            )\
+            .order_by()
+
+        # Add them to the existing rollups for the same days, or create new ones.
+        existing = {
+            (r.event_type, r.day, r.module_id, r.question_id): r
+            for r in InstrumentationEventRollup.objects.filter(
+                day__in=set(a['day'] for a in aggregates),
+                event_type__in=set(a['event_type'] for a in aggregates))
+        }
+        updated_rollups = []
+        new_rollups = []
+        events = 0
+        for a in aggregates:
+            events += a['events']
+            rollup = existing.get((a['event_type'], a['day'], a['module'], a['question']))
+            if rollup is None:
+                rollup = InstrumentationEventRollup(event_type=a['event_type'], day=a['day'],
+                    module_id=a['module'], question_id=a['question'],
+                    events=0, count=0, total=0, last_event_id=0)
+                new_rollups.append(rollup)
+            else:
+                updated_rollups.append(rollup)
+            rollup.events += a['events']
+            rollup.count += a['count']
+            rollup.total += a['total'] or 0
+            rollup.last_event_id = max(rollup.last_event_id, a['last_event_id'])
+        InstrumentationEventRollup.objects.bulk_update(updated_rollups,
+            ['events', 'count', 'total', 'last_event_id'])
+        InstrumentationEventRollup.objects.bulk_create(new_rollups)
+        return events
+
+    @staticmethod
+    def get_totals(event_type, field):
+        # Returns a dict mapping each value of field ("module" or "question")
+        # to a (count, total) pair over all of the events of event_type. The
+        # rollups lag behind the events by at least LAG and by however long
+        # it has been since the rollup_instrumentation_events command last
+        # ran (on a new deployment, it may not have run at all), so events
+        # past the high-water mark are counted from the events table directly.
+        # Flush this process's buffered events first so that they are counted
+        # too. Events still buffered in other processes are not counted until
+        # those processes flush them.
+        instrumentation_event_buffer.flush()
+        totals = { }
+        def add(rows):
+            for r in rows:
+                count, total = totals.get(r[field], (0, 0))
+                totals[r[field]] = (count + (r['count'] or 0), total + (r['total'] or 0))
+        add(InstrumentationEventRollup.objects
+            .filter(event_type=event_type)
+            .values(field)
+            .annotate(count=models.Sum('count'), total=models.Sum('total'))
+            .order_by())
+        add(InstrumentationEvent.objects
+            .filter(event_type=event_type, id__gt=InstrumentationEventRollup.get_high_water_mark())
+            .values(field)
+            .annotate(count=models.Count('event_value'), total=models.Sum('event_value'))
+            .order_by())
+        return totals
+
+    @staticmethod
+    def delete_rolled_up_events(older_than):
+        # Retention policy for the raw events: Delete events that happened
+        # before older_than (a datetime) and that have been rolled up
+        # already. Returns the number of events deleted.
+        return InstrumentationEvent.objects\
+            .filter(id__lte=InstrumentationEventRollup.get_high_water_mark(), event_time__lt=older_than)\
+            .delete()[0]
+
+class InstrumentationEventBuffer:
+    # Collects InstrumentationEvents in memory and inserts them in batches
+    # with bulk_create, rather than inserting each one during the request
+    # that records it. The buffer is flushed when it holds batch_size events,
+    # when its oldest event is flush_interval seconds old (checked when an
+    # event is added and at the end of each request by the
+    # InstrumentQuestionPageLoadTimes middleware), and at process exit. If
+    # it holds max_size events, further events are dropped and counted
+    # rather than letting the buffer grow without bound. The buffer holds
+    # events recorded by all of the requests handled by the process, so it
+    # isn't flushed inside a transaction, which could be rolled back.
+    #
+    # Views that compute durations from earlier events (e.g. the time since
+    # a question was first shown) read a small summary of them with
+    # get_summary. The summaries of the event types in summary_event_types
+    # are stored in InstrumentationEventSummary as events are inserted,
+    # instead of querying the ever-growing event table each time.
+
+    batch_size = 100
+    flush_interval = 5 # seconds
+    max_size = 10000
+    summary_event_types = { "task-create", "task-done", "task-question-show", "task-question-interact-first" }
+
+    def __init__(self):
+        import threading, atexit
+        self.lock = threading.Lock()
+        self.events = []
+        self.added = 0
+        self.inserted = 0
+        self.dropped = 0
+        atexit.register(self.flush_at_exit)
+
+    def add(self, **kwargs):
+        # Record an event. Takes the same arguments as InstrumentationEvent.
+        kwargs.setdefault("event_time", timezone.now())
+        kwargs.setdefault("extra", { })
+        event = InstrumentationEvent(**kwargs)
+        with self.lock:
+            self.added += 1
+            if len(self.events) >= self.max_size:
+                self.dropped += 1
+                return event
+            self.events.append(event)
+        self.flush_if_due()
+        return event
+
+    def flush_if_due(self):
+        with self.lock:
+            due = len(self.events) >= self.batch_size \
+               or (self.events and (timezone.now() - self.events[0].event_time).total_seconds() >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def can_flush(self):
+        # Whether the events can be inserted now, i.e. the caller is outside
+        # of any transaction.
+        return not transaction.get_connection().in_atomic_block
+
+    def flush(self):
+        # Insert all of the buffered events and update their summaries,
+        # unless the caller is in a transaction.
+        if not self.can_flush():
+            return
+        with self.lock:
+            events, self.events = self.events, []
+        if not events:
+            return
+        from django.db import DatabaseError
+        try:
+            with transaction.atomic():
+                InstrumentationEvent.objects.bulk_create(events)
+                self._save_summaries(events)
+            inserted = events
+        except DatabaseError:
+            # An event may refer to an object whose creation was rolled back.
+            # Insert the events one by one so only the bad ones are lost.
+            inserted = []
+            for event in events:
+                try:
+                    with transaction.atomic():
+                        event.save()
+                        self._save_summaries([event])
+                    inserted.append(event)
+                except DatabaseError:
+                    pass
+            import logging
+            logger = logging.getLogger(__name__)
+            logger.error("dropped {} of {} instrumentation events that could not be saved".format(
+                len(events) - len(inserted), len(events)))
+        with self.lock:
+            self.inserted += len(inserted)
+            self.dropped += len(events) - len(inserted)
+
+    def flush_at_exit(self):
+        # The database may already be unavailable at exit, in which case
+        # the events are lost.
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "added": self.added,
+                "inserted": self.inserted,
+                "dropped": self.dropped,
+                "buffered": len(self.events),
+            }
+
+    # SUMMARIES
+
+    def _get_summary_key(self, event_type, user_id, task_id, question_id):
+        return (event_type, user_id, task_id, question_id)
+
+    def _save_summaries(self, events):
+        # Merge the events into the stored summaries.
+        summaries = { }
+        for event in sorted(events, key=lambda event : event.event_time):
+            if event.event_type not in self.summary_event_types or event.user_id is None or event.task_id is None:
+                continue
+            key = self._get_summary_key(event.event_type, event.user_id, event.task_id, event.question_id)
+            if key not in summaries:
+                summaries[key] = InstrumentationEventSummary(
+                    event_type=event.event_type, user_id=event.user_id, task_id=event.task_id, question_id=event.question_id,
+                    first_event_time=event.event_time)
+            summaries[key].last_event_time = event.event_time
+            summaries[key].last_event_value = event.event_value
+        if not summaries:
+            return
+
+        # Update the summaries that exist. Another process may have inserted
+        # later events already.
+        updates = []
+        for summary in InstrumentationEventSummary.objects.select_for_update()\
+            .filter(task__in={ key[2] for key in summaries }, event_type__in={ key[0] for key in summaries })\
+            .order_by('id'): # lock in a consistent order
+            new_summary = summaries.pop(self._get_summary_key(summary.event_type, summary.user_id, summary.task_id, summary.question_id), None)
+            if new_summary is None:
+                continue
+            summary.first_event_time = min(summary.first_event_time, new_summary.first_event_time)
+            if new_summary.last_event_time >= summary.last_event_time:
+                summary.last_event_time = new_summary.last_event_time
+                summary.last_event_value = new_summary.last_event_value
+            updates.append(summary)
+        InstrumentationEventSummary.objects.bulk_update(updates, ["first_event_time", "last_event_time", "last_event_value"])
+
+        # Add the rest.
+        InstrumentationEventSummary.objects.bulk_create(summaries.values(), ignore_conflicts=True)
+
+    def get_summary(self, event_type, user, task, question=None):
+        # Returns a dict with the first_event_time and last_event_value of
+        # the events of this type (which must be in summary_event_types) for
+        # this user, task and question, or None if there are no such events.
+        # The events still in this process's buffer are included. Events
+        # still in other processes' buffers aren't, until they're flushed.
+        summary = InstrumentationEventSummary.objects\
+            .filter(event_type=event_type, user=user, task=task, question=question)\
+            .order_by('first_event_time')\
+            .first()
+        if summary is not None:
+            ret = {
+                "first_event_time": summary.first_event_time,
+                "last_event_value": summary.last_event_value,
+            }
+            last_event_time = summary.last_event_time
+        else:
+            ret = None
+        key = self._get_summary_key(event_type, user.id, task.id, question.id if question else None)
+        with self.lock:
+            events = [event for event in self.events
+                if self._get_summary_key(event.event_type, event.user_id, event.task_id, event.question_id) == key]
+        for event in events:
+            if ret is None:
+                ret = { "first_event_time": event.event_time }
+                last_event_time = event.event_time
+            ret["first_event_time"] = min(ret["first_event_time"], event.event_time)
+            if event.event_time >= last_event_time:
+                ret["last_event_value"] = event.event_value
+                last_event_time = event.event_time
+        return ret
+
+instrumentation_event_buffer = InstrumentationEventBuffer()
+
+class ImageDerivativeStore:
+    # Stores the thumbnails that image_to_dataurl makes, as data: URLs, in
+    # Django's cache so that pages showing the same icons over and over don't
+    # decode and re-encode them with PIL each time. Entries are keyed by a hash
+    # of the image's content (which, for app assets, is already known), the
+    # thumbnail size, and the format, so they never need to be invalidated.
+    # The cache evicts the least recently used entries when it is full, and
+    # derivatives larger than max_size bytes are not stored. Hits and misses
+    # are counted for this process.
+
+    cache_alias = "image_derivatives"
+    max_size = 1000000
+    timeout = 60*60*24*30 # thirty days
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, content_hash, size, image_format):
+        return "image_derivative_{}_{}_{}".format(content_hash, size, image_format)
+
+    def get(self, content_hash, size, image_format, refresh_func):
+        from django.core.cache import caches
+        cache = caches[self.cache_alias]
+        key = self.get_key(content_hash, size, image_format)
+        value = cache.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = refresh_func()
+        if len(value) <= self.max_size:
+            cache.set(key, value, self.timeout)
+        return value
+
+    def get_stats(self):
+        return { "hits": self.hits, "misses": self.misses }
+
+image_derivative_store = ImageDerivativeStore()
+
+def image_to_dataurl(f, size, content_hash=None):
+    # Returns a data: URL for a PNG thumbnail of the image f, which is a
+    # PIL.Image, a bytes stream, or a bytes string, that is at most size
+    # pixels wide and high. Unless a PIL.Image is given, the thumbnail
+    # is cached in image_derivative_store by a hash of the image content.
+    # If the caller already knows a hash of the content, it may pass it in
+    # as content_hash and pass a function that returns the image as f, so
+    # that the image isn't even read unless the thumbnail isn't cached.
+    from PIL import Image
+    if isinstance(f, Image.Image):
+        # If a PIL.Image is passed in, then use it.
+        return image_to_dataurl_uncached(f, size)
+
+    def get_image_bytes():
+        image = f() if callable(f) else f
+        if not isinstance(image, bytes):
+            # A bytes stream.
+            image = image.read()
+        return image
+
+    if content_hash is None:
+        # Uploaded images are untrusted content, so use a cryptographic hash
+        # to key them so that colliding uploads can't be crafted. This is
+        # also the hash that app assets are keyed by.
+        import hashlib
+        image = get_image_bytes()
+        content_hash = hashlib.sha256(image).hexdigest()
+        get_image_bytes = lambda : image
+
+    return image_derivative_store.get(content_hash, size, "png",
+        lambda : image_to_dataurl_uncached(get_image_bytes(), size))
+
+def image_to_dataurl_uncached(f, size):
     from PIL import Image
     from io import BytesIO
     import base64
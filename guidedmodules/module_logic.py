@@ -1,6 +1,9 @@
 from django.conf import settings
 from jinja2.sandbox import SandboxedEnvironment
 
+import re
+import threading
+
 def get_jinja2_template_vars(template):
     from jinja2 import meta, TemplateSyntaxError
     env = SandboxedEnvironment()
@@ -33,66 +36,55 @@ class Jinja2Environment(SandboxedEnvironment):
         # Call default operator logic.
         return SandboxedEnvironment.call_binop(self, context, operator, left, right)
 
-def walk_module_questions(module, callback):
-    # Walks the questions in depth-first order following the dependency
-    # tree connecting questions. If a question is a dependency of multiple
-    # questions, it is walked only once.
-    #
-    # callback is called for each question in the module with these arguments:
-    #
-    # 1) A ModuleQuestion, after the callback has been called for all
-    #    ModuleQuestions that the question depends on.
-    # 2) A dictionary that has been merged from the return value of all
-    #    of the callback calls on its dependencies.
-    # 3) A set of ModuleQuestion instances that this question depends on,
-    #    so that the callback doesn't have to compute it (again) itself.
-
-    # Remember each question that is processed so we only process each
-    # question at most once. Cache the state that it gives.
-    processed_questions = { }
-
-    # Pre-load all of the dependencies between questions in this module
-    # and get the questions that are not depended on by any question,
-    # which is where the dependency chains start.
-    dependencies, root_questions = get_all_question_dependencies(module)
-
-    # Local function that processes a single question.
-    def walk_question(q, stack):
-        # If we've seen this question already as a dependency of another
-        # question, then return its state dict from last time.
-        if q.key in processed_questions:
-            return processed_questions[q.key]
-        
-        # Prevent infinite recursion.
-        if q.key in stack:
-            raise ValueError("Cyclical dependency in questions: " + "->".join(stack + [q.key]))
-
-        # Execute recursively on the questions it depends on,
-        # in module definition order rather than in a random
-        # order.
-        state = { }
-        deps = list(dependencies[q])
-        deps.sort(key = lambda q : q.definition_order)
-        for qq in deps:
-            state.update(walk_question(qq, stack+[q.key]))
-
-        # Run the callback and get its state.
-        state = callback(q, state, dependencies[q])
-
-        # Remember the state in case we encounter it later.
-        processed_questions[q.key] = dict(state) # clone
-
-        # Return the state to the caller.
-        return state
-
-    # Walk the dependency root questions in document order.
-    root_questions = list(root_questions)
-    root_questions.sort(key = lambda q : q.definition_order)
-    for q in root_questions:
-        walk_question(q, [])
+class LRUCache:
+    # A small, thread-safe, bounded least-recently-used cache that is shared
+    # by all requests handled by this process. Values must be immutable or
+    # safe to share between threads. Hits and misses are counted so that
+    # the effectiveness of the cache can be monitored.
 
-
-def evaluate_module_state(current_answers, parent_context=None):
+    def __init__(self, maxsize):
+        from collections import OrderedDict
+        import threading
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, key, create):
+        with self.lock:
+            if key in self.data:
+                self.hits += 1
+                self.data.move_to_end(key)
+                return self.data[key]
+            self.misses += 1
+
+        # Create the value outside of the lock. If two threads race to create
+        # the same value, the last one wins, which is harmless. If create raises
+        # an exception, nothing is stored.
+        value = create()
+
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def evaluate_module_state(current_answers, parent_context=None, previous_state=None, changed_keys=None):
     # Compute the next question to ask the user, given the user's
     # answers to questions so far, and all imputed answers up to
     # that point.
@@ -100,6 +92,18 @@ def evaluate_module_state(current_answers, parent_context=None):
     # To figure this out, we walk the dependency tree of questions
     # until we arrive at questions that have no unanswered dependencies.
     # Such questions can be put forth to the user.
+    #
+    # If previous_state, a ModuleAnswers returned by an earlier call to
+    # this function, is given along with changed_keys, the set of the keys
+    # of the questions whose user answers have changed since then, then only
+    # the questions that could be affected by the change are evaluated again.
+    # The outcome for all other questions is copied from previous_state.
+
+    # Which questions must be evaluated? None means all of them.
+    affected_keys = None
+    if previous_state is not None:
+        affected_keys = get_affected_question_keys(current_answers.module, changed_keys or set())
+        previous_can_answer = { q.key for q in previous_state.can_answer }
 
     # Build a list of ModuleQuestions that the user may answer now.
     can_answer = set()
@@ -110,9 +114,8 @@ def evaluate_module_state(current_answers, parent_context=None):
     # first before the questions in this list can be answered.
     unanswered = set()
 
-    # Build a new array of answer values.
-    from collections import OrderedDict
-    answertuples = OrderedDict()
+    # Build a new set of answer values.
+    answertuples = AnswerSet(current_answers.module)
 
     # Build a list of questions whose answers were imputed.
     was_imputed = set()
@@ -125,29 +128,46 @@ def evaluate_module_state(current_answers, parent_context=None):
         ModuleAnswers(current_answers.module, current_answers.task, {}), lambda _0, _1, _2, _3, value : str(value), # escapefunc
         parent_context=parent_context)
 
-    # Visitor function.
-    def walker(q, state, deps):
+    # Visit the questions in an order in which every question comes after
+    # all of the questions it depends on. A question can be answered (or
+    # imputed) only once all of the questions it depends on have answers,
+    # which we know by the time we get to it.
+    evaluation_order, sorted_dependencies = get_question_evaluation_order(current_answers.module)
+    for q in evaluation_order:
+        # If the question isn't affected by any changed answers, then
+        # its outcome is the same as last time.
+        if affected_keys is not None and q.key not in affected_keys \
+          and q.key in previous_state.answertuples:
+            answertuple = (q,) + tuple(previous_state.answertuples[q.key][1:])
+            answertuples[q.key] = answertuple
+            if q.key in previous_state.was_imputed:
+                was_imputed.add(q.key)
+            if not answertuple[1]:
+                unanswered.add(q)
+                if q.key in previous_can_answer:
+                    can_answer.add(q)
+            continue
+
         # If any of the dependencies don't have answers yet, then this question
         # cannot be processed yet.
-        for qq in deps:
-            if qq.key not in state:
-                unanswered.add(q)
-                answertuples[q.key] = (q, False, None, None)
-                return { }
+        if not all(answertuples.is_answered(qq.key) for qq in sorted_dependencies[q]):
+            unanswered.add(q)
+            answertuples[q.key] = (q, False, None, None)
+            continue
 
         # Can this question's answer be imputed from answers that
         # it depends on? If the user answered this question (during
         # a state in which it wasn't imputed, but now it is), the
         # user's answer is overridden with the imputed value for
         # consistency with the Module's logic.
-        
+
         # Create an evaluation context for evaluating impute conditions
-        # that only sees the answers of this question's dependencies,
-        # which are in state because we return the answers from this
-        # method and they are collected as the walk continues up the
-        # dependency tree. 
+        # that only sees the answers of this question's dependencies
+        # (and their dependencies), through a view of the answers
+        # collected so far rather than a copy of them.
         impute_context = TemplateContext(
-            ModuleAnswers(current_answers.module, current_answers.task, state),
+            ModuleAnswers(current_answers.module, current_answers.task,
+                AnswerSetView(answertuples, q, sorted_dependencies)),
             impute_context_parent.escapefunc, parent_context=impute_context_parent, root=True)
 
         v = run_impute_conditions(q.spec.get("impute", []), impute_context)
@@ -171,25 +191,18 @@ def evaluate_module_state(current_answers, parent_context=None):
             v = None
 
         else:
-            # This question does not have an answer yet. We don't set
-            # anything in the state that we return, which flags that
-            # the question is not answered.
+            # This question does not have an answer yet, which flags to
+            # the questions that depend on it that they can't be answered
+            # yet either.
             #
             # But we can remember that this question *can* be answered
             # by the user, and that it's not answered yet.
             can_answer.add(q)
             unanswered.add(q)
             answertuples[q.key] = (q, False, None, None)
-            return state
+            continue
 
-        # Update the state that's passed to questions that depend on this
-        # and also the global state of all answered questions.
-        state[q.key] = (q, True, answerobj, v)
         answertuples[q.key] = (q, True, answerobj, v)
-        return state
-
-    # Walk the dependency tree.
-    walk_module_questions(current_answers.module, walker)
 
     # There may be multiple routes through the tree of questions,
     # so we'll prefer the question that is defined first in the spec.
@@ -234,6 +247,9 @@ def get_question_context(answers, question):
                 return "<i>seen</i>"
             if self.answer_value is None:
                 return "<i>skipped</i>"
+            session = ProjectEvaluationSession.get_current()
+            if session is not None:
+                return session.render_answer_html(answers, self.q, self.is_answered, self.answer_obj, self.answer_value)
             if not hasattr(LazyRenderedAnswer, 'tc'):
                 LazyRenderedAnswer.tc = TemplateContext(answers, HtmlAnswerRenderer(show_metadata=False))
             return RenderedAnswer(answers.task, self.q, self.is_answered, self.answer_obj, self.answer_value, LazyRenderedAnswer.tc).__html__()
@@ -279,6 +295,15 @@ def render_content(content, answers, output_format, source, additional_context={
     template_format = content["format"]
     template_body = content["template"]
 
+    # Templates rarely change, but they are rendered on nearly every page.
+    # The expensive preparation steps (Markdown to HTML conversion and Jinja2
+    # compilation) depend only on these values, so their results are kept
+    # in a process-wide cache keyed by them.
+    if isinstance(template_body, str):
+        cache_key = (template_format, output_format, demote_headings, get_template_body_hash(template_body))
+    else:
+        cache_key = None
+
     # Markdown cannot be used with Jinja2 because auto-escaping is highly
     # context dependent. For instance, Markdown can have HTML literal blocks
     # and in those blocks the usual backslash-escaping is replaced with
@@ -298,100 +323,11 @@ def render_content(content, answers, output_format, source, additional_context={
     if template_format == "markdown":
         if output_format == "html" or output_format == "PARSE_ONLY":
             # Convert the template first to HTML using CommonMark.
-
             if not isinstance(template_body, str): raise ValueError("Template %s has incorrect type: %s" % (source, type(template_body)))
-            
-            # We don't want CommonMark to mess up template tags, however. If
-            # there are symbols which have meaning both to Jinaj2 and CommonMark,
-            # then they may get ruined by CommonMark because they may be escaped.
-            # For instance:
-            #
-            #    {% hello "*my friend*" %}
-            #
-            # would become
-            #
-            #    {% hello "<em>my friend</em>" %}
-            #
-            # and
-            #
-            #    [my link]({{variable_holding_url}})
-            #
-            # would become a link whose target is
-            #
-            #    %7B%7Bvariable_holding_url%7D%7D
-            #
-            # And that's not good!
-            #
-            # Do a simple lexical pass over the template and replace template
-            # tags with special codes that CommonMark will ignore. Then we'll
-            # put back the strings after the CommonMark has been rendered into
-            # HTML, so that the template tags end up in their appropriate place.
-            #
-            # Since CommonMark will clean up Unicode in URLs, e.g. in link and
-            # image URLs, by %-encoding non-URL-safe characters, we have to
-            # also override CommonMark's URL escaping function at
-            # https://github.com/rtfd/CommonMark-py/blob/master/CommonMark/common.py#L71
-            # to not %-encode our special codes. Unfortunately urllib.parse.quote's
-            # "safe" argument does not handle non-ASCII characters.
-            from commonmark import inlines
-            def urlencode_special(uri):
-                import urllib.parse
-                return "".join(
-                    urllib.parse.quote(c, safe="/@:+?=&()%#*,") # this is what CommonMark does
-                    if c not in "\uE000\uE001" else c # but keep our special codes
-                    for c in uri)
-            inlines.normalize_uri = urlencode_special
-
-            substitutions = []
-            import re
-            def replace(m):
-                # Record the substitution.
-                index = len(substitutions)
-                substitutions.append(m.group(0))
-                return "\uE000%d\uE001" % index # use Unicode private use area code points
-            template_body = re.sub(r"{%[\w\W]*?%}|{{.*?}}", replace, template_body)
-
-            # Use our CommonMark Tables parser & renderer.
-            from commonmark_extensions.tables import \
-                ParserWithTables as CommonMarkParser, \
-                RendererWithTables as CommonMarkHtmlRenderer
-
-            # Subclass the renderer to control the output a bit.
-            class q_renderer(CommonMarkHtmlRenderer):
-                def __init__(self):
-                    # Our module templates are currently trusted, so we can keep
-                    # safe mode off, and we're making use of that. Safe mode is
-                    # off by default, but I'm making it explicit. If we ever
-                    # have untrusted template content, we will need to turn
-                    # safe mode on.
-                    super().__init__(options={ "safe": False })
-
-                def heading(self, node, entering):
-                    # Generate <h#> tags with one level down from
-                    # what would be normal since they should not
-                    # conflict with the page <h1>.
-                    if entering and demote_headings:
-                        node.level += 1
-                    super().heading(node, entering)
-
-                def code_block(self, node, entering):
-                    # Suppress info strings because with variable substitution
-                    # untrusted content could land in the <code> class attribute
-                    # without a language- prefix.
-                    node.info = None
-                    super().code_block(node, entering)
-
-                def make_table_node(self, node):
-                    return "<table class='table'>"
-
             template_format = "html"
-            template_body = q_renderer().render(CommonMarkParser().parse(template_body))
-
-            # Put the Jinja2 template tags back that we removed prior to running
-            # the CommonMark renderer.
-            def replace(m):
-                return substitutions[int(m.group(1))]
-            template_body = re.sub("\uE000(\d+)\uE001", replace, template_body)
+            template_body = render_content_cache.get_or_create(
+                cache_key + ("commonmark",),
+                lambda : render_markdown_template_to_html(template_body, demote_headings))
 
         elif output_format in ("text", "markdown"):
             # Pass through the markdown markup unchanged.
@@ -507,17 +443,22 @@ def render_content(content, answers, output_format, source, additional_context={
 
         # Execute the template.
 
-        # Evaluate the template. Ensure autoescaping is turned on. Even though
-        # we handle it ourselves, we do so using the __html__ method on
-        # RenderedAnswer, which relies on autoescaping logic. This also lets
-        # the template writer disable autoescaping with "|safe".
-        env = Jinja2Environment(
-            autoescape=True,
-            undefined=jinja2.StrictUndefined) # see below - we defined any undefined variables
-        try:
-            template = env.from_string(template_body)
-        except jinja2.TemplateSyntaxError as e:
-            raise ValueError("There was an error loading the Jinja2 template %s: %s, line %d" % (source, str(e), e.lineno))
+        # Compile the template (or get it from the cache). The compiled
+        # template is bound to a shared Environment with autoescaping on.
+        # The template's variables are cached alongside it so that we don't
+        # have to parse the template again below.
+        def compile_template():
+            env = get_render_content_jinja2_environment()
+            try:
+                template = env.from_string(template_body)
+            except jinja2.TemplateSyntaxError as e:
+                raise ValueError("There was an error loading the Jinja2 template %s: %s, line %d" % (source, str(e), e.lineno))
+            return (template, get_jinja2_template_vars(template_body))
+        if cache_key is not None:
+            template, template_vars = render_content_cache.get_or_create(
+                cache_key + ("jinja2",), compile_template)
+        else:
+            template, template_vars = compile_template()
 
         # For tests, callers can use the "PARSE_ONLY" output format to
         # stop after the template is compiled.
@@ -552,7 +493,7 @@ def render_content(content, answers, output_format, source, additional_context={
             # template, and rendering the variable might mean no one will notice
             # the template is incorrect. But it's probably better UX than having
             # a big error message for the output as a whole or silently ignoring it.
-            for varname in get_jinja2_template_vars(template_body):
+            for varname in template_vars:
                 context.setdefault(varname, UndefinedReference(varname, errorfunc, [source]))
 
             # Now really render.
@@ -595,9 +536,6 @@ def render_content(content, answers, output_format, source, additional_context={
                 #
                 # We also rewrite non-absolute URLs in <a> href's and <img> src
                 # to allow for linking to module-defined static content.
-                #
-                # This also fixes the nested <p>'s within <p>'s when a longtext
-                # field is rendered.
 
                 def rewrite_url(url, allow_dataurl=False):
                     # Rewrite for static assets.
@@ -616,16 +554,9 @@ def render_content(content, answers, output_format, source, additional_context={
                         return "javascript:alert('Invalid link.');"
                     return url
 
-                import html5lib, xml.etree
-                dom = html5lib.HTMLParser().parseFragment(output)
-                for node in dom.iter():
-                    if node.get("href"):
-                        node.set("href", rewrite_url(node.get("href")))
-                    if node.get("src"):
-                        node.set("src", rewrite_url(node.get("src"), allow_dataurl=(node.tag == "{http://www.w3.org/1999/xhtml}img")))
-                output = html5lib.serialize(dom, quote_attr_values="always", omit_optional_tags=False, alphabetical_attributes=True)
+                output = rewrite_html_urls(output, rewrite_url)
 
-                # But the p's within p's fix gives us a lot of empty p's.
+                # Nested p's from rendered longtext answers leave empty p's.
                 output = output.replace("<p></p>", "")
 
                 return output
@@ -636,6 +567,293 @@ def render_content(content, answers, output_format, source, additional_context={
         raise ValueError("Invalid template format encountered: %s." % template_format)
 
 
+# A process-wide cache of prepared templates used by render_content. Entries
+# are keyed by a hash of the template body, so they never become stale ---
+# a changed template simply gets a new key and the old entry ages out.
+render_content_cache = LRUCache(2048)
+
+def get_template_body_hash(template_body):
+    import xxhash
+    return xxhash.xxh64(template_body.encode("utf8")).hexdigest()
+
+def get_render_content_jinja2_environment():
+    # Templates compiled by render_content are cached across requests, so
+    # they must all be bound to a single long-lived Environment.
+    if not hasattr(get_render_content_jinja2_environment, "env"):
+        import jinja2
+        # Ensure autoescaping is turned on. Even though we handle it ourselves,
+        # we do so using the __html__ method on RenderedAnswer, which relies
+        # on autoescaping logic. This also lets the template writer disable
+        # autoescaping with "|safe".
+        get_render_content_jinja2_environment.env = Jinja2Environment(
+            autoescape=True,
+            undefined=jinja2.StrictUndefined) # see render_content - we define any undefined variables
+    return get_render_content_jinja2_environment.env
+
+def render_markdown_template_to_html(template_body, demote_headings):
+    # Convert a Markdown template to an HTML template using CommonMark.
+    #
+    # We don't want CommonMark to mess up template tags. If
+    # there are symbols which have meaning both to Jinaj2 and CommonMark,
+    # then they may get ruined by CommonMark because they may be escaped.
+    # For instance:
+    #
+    #    {% hello "*my friend*" %}
+    #
+    # would become
+    #
+    #    {% hello "<em>my friend</em>" %}
+    #
+    # and
+    #
+    #    [my link]({{variable_holding_url}})
+    #
+    # would become a link whose target is
+    #
+    #    %7B%7Bvariable_holding_url%7D%7D
+    #
+    # And that's not good!
+    #
+    # Do a simple lexical pass over the template and replace template
+    # tags with special codes that CommonMark will ignore. Then we'll
+    # put back the strings after the CommonMark has been rendered into
+    # HTML, so that the template tags end up in their appropriate place.
+    #
+    # Since CommonMark will clean up Unicode in URLs, e.g. in link and
+    # image URLs, by %-encoding non-URL-safe characters, we have to
+    # also override CommonMark's URL escaping function at
+    # https://github.com/rtfd/CommonMark-py/blob/master/CommonMark/common.py#L71
+    # to not %-encode our special codes. Unfortunately urllib.parse.quote's
+    # "safe" argument does not handle non-ASCII characters.
+    from commonmark import inlines
+    def urlencode_special(uri):
+        import urllib.parse
+        return "".join(
+            urllib.parse.quote(c, safe="/@:+?=&()%#*,") # this is what CommonMark does
+            if c not in "\uE000\uE001" else c # but keep our special codes
+            for c in uri)
+    inlines.normalize_uri = urlencode_special
+
+    substitutions = []
+    import re
+    def replace(m):
+        # Record the substitution.
+        index = len(substitutions)
+        substitutions.append(m.group(0))
+        return "\uE000%d\uE001" % index # use Unicode private use area code points
+    template_body = re.sub(r"{%[\w\W]*?%}|{{.*?}}", replace, template_body)
+
+    # Use our CommonMark Tables parser & renderer.
+    from commonmark_extensions.tables import \
+        ParserWithTables as CommonMarkParser, \
+        RendererWithTables as CommonMarkHtmlRenderer
+
+    # Subclass the renderer to control the output a bit.
+    class q_renderer(CommonMarkHtmlRenderer):
+        def __init__(self):
+            # Our module templates are currently trusted, so we can keep
+            # safe mode off, and we're making use of that. Safe mode is
+            # off by default, but I'm making it explicit. If we ever
+            # have untrusted template content, we will need to turn
+            # safe mode on.
+            super().__init__(options={ "safe": False })
+
+        def heading(self, node, entering):
+            # Generate <h#> tags with one level down from
+            # what would be normal since they should not
+            # conflict with the page <h1>.
+            if entering and demote_headings:
+                node.level += 1
+            super().heading(node, entering)
+
+        def code_block(self, node, entering):
+            # Suppress info strings because with variable substitution
+            # untrusted content could land in the <code> class attribute
+            # without a language- prefix.
+            node.info = None
+            super().code_block(node, entering)
+
+        def make_table_node(self, node):
+            return "<table class='table'>"
+
+    template_body = q_renderer().render(CommonMarkParser().parse(template_body))
+
+    # Put the Jinja2 template tags back that we removed prior to running
+    # the CommonMark renderer.
+    def replace(m):
+        return substitutions[int(m.group(1))]
+    return re.sub("\uE000(\d+)\uE001", replace, template_body)
+
+
+# Regular expressions for rewrite_html_urls, following the HTML5 tokenizer.
+HTML_WHITESPACE = "\t\n\f\r "
+HTML_TAG_OPEN_RE = re.compile(r"</?([a-zA-Z][^\t\n\f\r />]*)")
+HTML_ATTRIBUTE_RE = re.compile(r"""[\t\n\f\r /]*(?:(>)|([^\t\n\f\r />][^\t\n\f\r /=>]*)(?:[\t\n\f\r ]*=[\t\n\f\r ]*("[^"]*"|'[^']*'|[^\t\n\f\r >]*))?)?""")
+HTML_COMMENT_END_RE = re.compile(r"--!?>")
+HTML_RAW_TEXT_END_RE = {
+    tag_name: re.compile(r"</" + tag_name + r"[\t\n\f\r />]", re.I)
+    for tag_name in ("script", "style", "textarea", "title", "xmp", "iframe", "noembed", "noframes")
+}
+HTML_CLOSES_P_ELEMENTS = { "address", "article", "aside", "blockquote", "center", "details", "dialog", "dir", "div", "dl", "fieldset", "figcaption", "figure", "footer", "header", "hgroup", "main", "menu", "nav", "ol", "p", "section", "summary", "ul", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "listing", "form", "li", "dd", "dt", "plaintext", "table", "hr", "xmp" }
+HTML_VOID_ELEMENTS = { "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr" }
+HTML_CLOSES_P_END_TAGS = { "body", "html", "td", "th", "tr", "tbody", "thead", "tfoot", "caption", "button", "object", "marquee", "applet", "template" }
+HTML_URL_ATTRIBUTE_RE = re.compile(r"href|src", re.I)
+HTML_NAMED_CHARACTER_REFERENCE_RE = re.compile(r"&([a-zA-Z][a-zA-Z0-9]*)(;?)")
+
+def unescape_html_attribute(value):
+    # Like html.unescape, but named character references are only decoded
+    # where browsers decode them in attribute values, which is not when
+    # there is no semicolon and the name is followed by "=" or is only a
+    # prefix of the alphanumeric run that follows the "&", as in "?a=1&notit=2".
+    import html, html.entities
+    def escape_undecoded(m):
+        name, semicolon = m.groups()
+        if semicolon:
+            decoded = (name + ";") in html.entities.html5
+        else:
+            decoded = name in html.entities.html5 and not value.startswith("=", m.end())
+        if decoded:
+            return m.group(0)
+        return "&amp;" + m.group(0)[1:]
+    return html.unescape(HTML_NAMED_CHARACTER_REFERENCE_RE.sub(escape_undecoded, value))
+
+def rewrite_html_urls(html, rewrite_url):
+    # Rewrite the URLs in every href and src attribute in an HTML fragment
+    # in a single pass over the string, without building a DOM. rewrite_url
+    # is called as rewrite_url(url, allow_dataurl=...), with allow_dataurl
+    # True only for <img> src's, and returns the new URL.
+    #
+    # Since the rewritten URLs are security checks, the fragment is split
+    # into tags, comments, raw text and text the way a browser's tokenizer
+    # does it, so that every tag that a browser will see is seen here. The
+    # rewritten attributes are re-serialized so that browsers read back
+    # exactly the values that were checked. Everything else is copied
+    # through unchanged. Where it is not possible to know how a browser
+    # would tokenize something without building the DOM (foreign content,
+    # CDATA sections, <noscript>), we parse it as markup, which at worst
+    # rewrites something that a browser would have treated as text.
+    #
+    # This also fixes the nested <p>'s within <p>'s when a longtext field
+    # is rendered, the way browsers do: an open <p> is closed by the start
+    # of a block element, and then the </p> that would have closed it is
+    # dropped.
+
+    output = []
+    pos = 0 # the position in html up to which output has been copied
+    i = 0 # the current position in html
+    foreign_depth = { "svg": 0, "math": 0 }
+    in_p = False
+    while True:
+        i = html.find("<", i)
+        if i == -1:
+            break
+
+        # Comments and things parsed as comments run to the next ">" or,
+        # for comments, "-->".
+        if html.startswith("<!--", i):
+            if html.startswith(">", i+4) or html.startswith("->", i+4):
+                i = html.find(">", i) + 1
+                continue
+            m = HTML_COMMENT_END_RE.search(html, i+4)
+            i = m.end() if m else len(html)
+            continue
+        if html.startswith("<!", i) or html.startswith("<?", i) \
+            or (html.startswith("</", i) and not HTML_TAG_OPEN_RE.match(html, i)):
+            end = html.find(">", i+1)
+            i = end + 1 if end != -1 else len(html)
+            continue
+
+        # Anything else that isn't a tag is text.
+        m = HTML_TAG_OPEN_RE.match(html, i)
+        if not m:
+            i += 1
+            continue
+        is_end_tag = html.startswith("</", i)
+        tag_name = m.group(1).lower()
+
+        # Read the attributes up to the end of the tag. End tags can have
+        # attributes too, which are ignored by browsers but still determine
+        # where the tag ends.
+        tag_start = i
+        i = m.end()
+        attributes = []
+        while True:
+            m = HTML_ATTRIBUTE_RE.match(html, i)
+            i = m.end()
+            if m.group(1) or m.group(2) is None:
+                # The end of the tag, or the end of the string in the middle
+                # of the tag, in which case the tag is dropped, as browsers do.
+                break
+            attributes.append(m)
+        if not m.group(1):
+            output.append(html[pos:tag_start])
+            pos = len(html)
+            break
+
+        if is_end_tag:
+            if tag_name == "p" and not in_p:
+                # Drop the </p> of a <p> that was already closed.
+                output.append(html[pos:tag_start])
+                pos = i
+            elif tag_name in HTML_CLOSES_P_ELEMENTS or tag_name in HTML_CLOSES_P_END_TAGS:
+                in_p = False
+            if tag_name in foreign_depth:
+                foreign_depth[tag_name] = max(foreign_depth[tag_name] - 1, 0)
+            continue
+
+        # Close an open <p> before a block element.
+        if tag_name in HTML_CLOSES_P_ELEMENTS:
+            if in_p:
+                output.append(html[pos:tag_start])
+                output.append("</p>")
+                pos = tag_start
+            in_p = (tag_name == "p")
+
+        # Rewrite the URL attributes. Only tags with href or src in their
+        # text can possibly have URL attributes. Tags with rewritten URLs
+        # are re-serialized with their attributes in alphabetical order.
+        if HTML_URL_ATTRIBUTE_RE.search(html, tag_start, i):
+            attribute_values = { }
+            has_url = False
+            for attr in attributes:
+                name = attr.group(2).lower()
+                if name in attribute_values:
+                    continue # browsers ignore repeated attributes
+                value = attr.group(3) or ""
+                if value[:1] in ("'", '"'):
+                    value = value[1:-1]
+                value = unescape_html_attribute(value)
+                if name in ("href", "src") or name.endswith(":href"):
+                    if value:
+                        value = rewrite_url(value, allow_dataurl=(name == "src" and tag_name == "img"))
+                    has_url = True
+                attribute_values[name] = value
+            if has_url:
+                output.append(html[pos:tag_start])
+                output.append("<" + tag_name)
+                for name, value in sorted(attribute_values.items()):
+                    output.append(' ' + name + '="' + value.replace("&", "&amp;").replace('"', "&quot;") + '"')
+                output.append(" />" if m.group(0).endswith("/>") and tag_name not in HTML_VOID_ELEMENTS else ">")
+                pos = i
+
+        # Track whether we are in SVG or MathML, where <style> and
+        # <script> don't contain raw text.
+        if tag_name in foreign_depth:
+            if not m.group(0).endswith("/>"):
+                foreign_depth[tag_name] += 1
+
+        # Skip over the contents of elements that contain raw text, which
+        # runs to the element's end tag.
+        elif tag_name in HTML_RAW_TEXT_END_RE and not any(foreign_depth.values()):
+            m = HTML_RAW_TEXT_END_RE[tag_name].search(html, i)
+            i = m.start() if m else len(html)
+        elif tag_name == "plaintext" and not any(foreign_depth.values()):
+            break
+
+    output.append(html[pos:])
+    return "".join(output)
+
+
 class HtmlAnswerRenderer:
     def __init__(self, show_metadata, use_data_urls=False):
         self.show_metadata = show_metadata
@@ -755,8 +973,29 @@ class HtmlAnswerRenderer:
 
 
 def clear_module_question_cache():
+    # Clears this process's caches. The dependency_graph_store is keyed
+    # by a hash of the module's questions so it never needs to be cleared.
     if hasattr(get_all_question_dependencies, 'cache'):
         del get_all_question_dependencies.cache
+    if hasattr(get_question_evaluation_order, 'cache'):
+        del get_question_evaluation_order.cache
+    if hasattr(get_module_question_index, 'cache'):
+        del get_module_question_index.cache
+    if hasattr(get_question_dependents, 'cache'):
+        del get_question_dependents.cache
+    if hasattr(get_module_spec_hash, 'cache'):
+        del get_module_spec_hash.cache
+    module_context_dependencies_cache.clear()
+    impute_expression_cache.clear()
+
+
+def forget_module_question_cache(module):
+    # Forgets what this process's caches hold about one module, so that
+    # it is loaded from the database again the next time it's needed.
+    for func in (get_all_question_dependencies, get_question_evaluation_order,
+                 get_module_question_index, get_question_dependents, get_module_spec_hash):
+        if hasattr(func, 'cache'):
+            func.cache.pop(module.id, None)
 
 
 def get_all_question_dependencies(module):
@@ -772,17 +1011,35 @@ def get_all_question_dependencies(module):
     for q in module.questions.all():
         all_questions[q.key] = q
 
-    # Compute all of the dependencies of all of the questions.
-    dependencies = {
-        q: get_question_dependencies(q, get_from_question_id=all_questions)
-        for q in all_questions.values()
-    }
+    # Computing the dependencies requires parsing every template in the
+    # module, so the result is shared between processes through the
+    # dependency graph store when another process has already done it.
+    spec_hash = get_module_questions_hash(all_questions.values())
+    graph = dependency_graph_store.get(module, spec_hash)
+    if graph is not None:
+        dependencies = {
+            all_questions[key]: { all_questions[qid] for qid in deps }
+            for key, deps in graph["dependencies"].items()
+        }
+        root_questions = { all_questions[key] for key in graph["roots"] }
 
-    # Find the questions that are at the root of the dependency tree.
-    is_dependency_of_something = set()
-    for deps in dependencies.values():
-        is_dependency_of_something |= deps
-    root_questions = { q for q in dependencies if q not in is_dependency_of_something }
+    else:
+        # Compute all of the dependencies of all of the questions.
+        dependencies = {
+            q: get_question_dependencies(q, get_from_question_id=all_questions)
+            for q in all_questions.values()
+        }
+
+        # Find the questions that are at the root of the dependency tree.
+        is_dependency_of_something = set()
+        for deps in dependencies.values():
+            is_dependency_of_something |= deps
+        root_questions = { q for q in dependencies if q not in is_dependency_of_something }
+
+        dependency_graph_store.set(module, spec_hash, {
+            "dependencies": { q.key: sorted(qq.key for qq in deps) for q, deps in dependencies.items() },
+            "roots": sorted(q.key for q in root_questions),
+        })
 
     ret = (dependencies, root_questions)
 
@@ -792,6 +1049,376 @@ def get_all_question_dependencies(module):
 
     return ret
 
+def get_module_questions_hash(questions):
+    # Returns a hash of the specifications of a module's questions, which
+    # determine the dependency graph of the module.
+    import json, xxhash
+    payload = json.dumps(sorted([q.key, q.spec] for q in questions), sort_keys=True)
+    return xxhash.xxh64(payload.encode("utf8")).hexdigest()
+
+class DependencyGraphStore:
+    # Stores the dependency graphs of modules, serialized as the keys of each
+    # question's dependencies plus the keys of the root questions, in the
+    # database (see ModuleDependencyGraph) so that they are shared by all
+    # processes, including the warm_module_cache management command which
+    # computes them ahead of time. Entries are keyed by the module and a
+    # hash of its question specifications, so a changed module never gets
+    # a stale graph and entries never need to be invalidated. Replace
+    # dependency_graph_store with an instance of a subclass to store graphs
+    # elsewhere.
+
+    def get(self, module, spec_hash):
+        from .models import ModuleDependencyGraph
+        entry = ModuleDependencyGraph.objects.filter(module=module, spec_hash=spec_hash).only("graph").first()
+        return entry.graph if entry is not None else None
+
+    def set(self, module, spec_hash, graph):
+        from django.db import IntegrityError, transaction
+        from .models import ModuleDependencyGraph
+        try:
+            with transaction.atomic():
+                ModuleDependencyGraph.objects.update_or_create(module=module,
+                    defaults={ "spec_hash": spec_hash, "graph": graph })
+        except IntegrityError:
+            # Another process stored the module's graph at the same time.
+            pass
+
+dependency_graph_store = DependencyGraphStore()
+
+class RenderedDocumentStore:
+    # Stores the rendered output documents of Tasks in the database (see
+    # RenderedOutputDocument) rather than in Task.cached_state, which would
+    # otherwise be rewritten in full, data-URL images and all, each time one
+    # document is rendered, so that they are shared by all processes.
+    # Entries are keyed by the Task, its output version (a token in
+    # cached_state that is replaced whenever the cached_state is cleared),
+    # and the document's index and format, so stale entries are never read.
+    # A Task's stale entries are deleted when an entry for a new output
+    # version is stored. Replace rendered_document_store with an instance of
+    # a subclass to store documents elsewhere.
+
+    def get(self, task, version, index, output_format, use_data_urls):
+        from .models import RenderedOutputDocument
+        entry = RenderedOutputDocument.objects.filter(task=task, output_version=version,
+            document_index=index, output_format=output_format, use_data_urls=use_data_urls)\
+            .only("content").first()
+        return entry.content if entry is not None else None
+
+    def set(self, task, version, index, output_format, use_data_urls, content):
+        from django.db import IntegrityError, transaction
+        from .models import RenderedOutputDocument
+        try:
+            with transaction.atomic():
+                RenderedOutputDocument.objects.filter(task=task).exclude(output_version=version).delete()
+                RenderedOutputDocument.objects.create(task=task, output_version=version,
+                    document_index=index, output_format=output_format, use_data_urls=use_data_urls,
+                    content=content)
+        except IntegrityError:
+            # Another process stored the document at the same time.
+            pass
+
+rendered_document_store = RenderedDocumentStore()
+
+class ProjectEvaluationSession:
+    # Memoizes the answers of Tasks, their evaluation with imputed values
+    # and next-question information, and their rendered answers, for the
+    # duration of one web request. Pages like the project page and the
+    # module-finished page look at a Task, its project's root Task and the
+    # root Task's sub-tasks, and templates that refer to the "project"
+    # variable load the root Task's answers again, so without this the
+    # same Tasks are loaded and evaluated several times per request.
+    #
+    # ProjectEvaluationSessionMiddleware makes a session active for each
+    # request. Code outside of a request, or that runs with no active
+    # session, gets the same results without memoization. The memoized
+    # values are discarded whenever any Task's cached state is cleared,
+    # i.e. when answers change (see Task.clear_state).
+
+    active = threading.local()
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.answers = { } # Task ID => ModuleAnswers
+        self.extended_answers = { } # Task ID => ModuleAnswers with extended info
+        self.template_contexts = { } # (Task ID, show_metadata) => TemplateContext
+        self.rendered_answers = { } # (Task ID, question key) => HTML
+
+    @staticmethod
+    def for_request(request):
+        if not hasattr(request, "evaluation_session"):
+            request.evaluation_session = ProjectEvaluationSession()
+        return request.evaluation_session
+
+    @staticmethod
+    def get_current():
+        return getattr(ProjectEvaluationSession.active, "session", None)
+
+    def activate(self):
+        ProjectEvaluationSession.active.session = self
+
+    @staticmethod
+    def deactivate():
+        ProjectEvaluationSession.active.session = None
+
+    @staticmethod
+    def clear_current():
+        session = ProjectEvaluationSession.get_current()
+        if session is not None:
+            session.clear()
+
+    @staticmethod
+    def load_answers(task):
+        # Return task.get_answers(), memoized if there is an active session.
+        session = ProjectEvaluationSession.get_current()
+        if session is None:
+            return task.get_answers()
+        return session.get_answers(task)
+
+    def get_answers(self, task):
+        if task.id not in self.answers:
+            self.answers[task.id] = task.get_answers()
+        return self.answers[task.id]
+
+    def get_answers_with_extended_info(self, task):
+        # Return task.get_answers_with_extended_info(). The returned instance
+        # is shared, so it must not be modified.
+        if task.id not in self.extended_answers:
+            self.extended_answers[task.id] = task.get_answers_with_extended_info(
+                answers=self.get_answers(task))
+        return self.extended_answers[task.id]
+
+    def get_html_template_context(self, answers, show_metadata=False):
+        # Return a TemplateContext that renders answers as HTML for the
+        # ModuleAnswers returned by get_answers_with_extended_info.
+        if answers.task is None or self.extended_answers.get(answers.task.id) is not answers:
+            return TemplateContext(answers, HtmlAnswerRenderer(show_metadata=show_metadata))
+        key = (answers.task.id, show_metadata)
+        if key not in self.template_contexts:
+            self.template_contexts[key] = TemplateContext(answers, HtmlAnswerRenderer(show_metadata=show_metadata))
+        return self.template_contexts[key]
+
+    def render_answer_html(self, answers, question, is_answered, answer_obj, answer_value):
+        # Render an answer in the ModuleAnswers returned by get_answers_with_extended_info
+        # as HTML, without answer metadata.
+        def render():
+            tc = self.get_html_template_context(answers)
+            return RenderedAnswer(answers.task, question, is_answered, answer_obj, answer_value, tc).__html__()
+        if answers.task is None or self.extended_answers.get(answers.task.id) is not answers:
+            return render()
+        key = (answers.task.id, question.key)
+        if key not in self.rendered_answers:
+            self.rendered_answers[key] = render()
+        return self.rendered_answers[key]
+
+def get_question_evaluation_order(module):
+    # Returns a tuple of:
+    #
+    # 1) A list of the module's ModuleQuestions in the order that
+    #    evaluate_module_state visits them: a depth-first post-order walk
+    #    of the dependency tree starting at the root questions, so that
+    #    every question comes after the questions it depends on.
+    # 2) A dict mapping each ModuleQuestion to a list of the questions it
+    #    depends on, sorted in module definition order.
+    #
+    # The walk is iterative rather than recursive so that long chains of
+    # dependencies don't hit Python's recursion limit.
+
+    # Initialize cache, query cache.
+    if not hasattr(get_question_evaluation_order, 'cache'):
+        get_question_evaluation_order.cache = { }
+    if module.id in get_question_evaluation_order.cache:
+        return get_question_evaluation_order.cache[module.id]
+
+    dependencies, root_questions = get_all_question_dependencies(module)
+    sorted_dependencies = {
+        q: sorted(deps, key = lambda q : q.definition_order)
+        for q, deps in dependencies.items()
+    }
+
+    evaluation_order = []
+    processed_questions = set()
+    for root in sorted(root_questions, key = lambda q : q.definition_order):
+        if root.key in processed_questions:
+            continue
+
+        # The path from the root to the question being visited, with
+        # an iterator over the dependencies of each question on the path
+        # that haven't been visited yet.
+        stack = [(root, iter(sorted_dependencies[root]))]
+        on_stack = { root.key }
+        while stack:
+            q, deps = stack[-1]
+            for qq in deps:
+                if qq.key in processed_questions:
+                    continue
+                # Prevent infinite loops.
+                if qq.key in on_stack:
+                    raise ValueError("Cyclical dependency in questions: " + "->".join([s[0].key for s in stack] + [qq.key]))
+                stack.append((qq, iter(sorted_dependencies[qq])))
+                on_stack.add(qq.key)
+                break
+            else:
+                # All of the question's dependencies have been visited.
+                stack.pop()
+                on_stack.remove(q.key)
+                processed_questions.add(q.key)
+                evaluation_order.append(q)
+
+    ret = (evaluation_order, sorted_dependencies)
+
+    # Save to in-memory (in-process) cache. Never in debugging.
+    if not settings.DEBUG:
+        get_question_evaluation_order.cache[module.id] = ret
+
+    return ret
+
+def get_module_question_index(module):
+    # Returns a tuple of:
+    #
+    # 1) A list of the module's ModuleQuestions in module definition order.
+    # 2) A dict mapping the key of each question to its position in the list.
+    #
+    # AnswerSets store answers in lists indexed by these positions, and all
+    # of the AnswerSets of a module share this tuple. It's formed from the
+    # question dependency graph, which has all of the questions of the module
+    # and which evaluating the module needs anyway, so that it doesn't cost
+    # another query.
+
+    # Initialize cache, query cache.
+    if not hasattr(get_module_question_index, 'cache'):
+        get_module_question_index.cache = { }
+    if module.id in get_module_question_index.cache:
+        return get_module_question_index.cache[module.id]
+
+    dependencies, _ = get_all_question_dependencies(module)
+    questions = sorted(dependencies, key = lambda q : q.definition_order)
+    ret = (questions, { q.key: i for i, q in enumerate(questions) })
+
+    # Save to in-memory (in-process) cache. Never in debugging.
+    if not settings.DEBUG:
+        get_module_question_index.cache[module.id] = ret
+
+    return ret
+
+def get_question_dependents(module):
+    # Returns a tuple of:
+    #
+    # 1) A dict mapping each question key to the set of keys of the
+    #    questions that directly depend on it, i.e. the reverse edges
+    #    of the dependency graph.
+    # 2) The set of keys of the questions whose impute rules refer to
+    #    something other than questions in this module, like project
+    #    or organization, whose values aren't tracked by the graph.
+
+    # Initialize cache, query cache.
+    if not hasattr(get_question_dependents, 'cache'):
+        get_question_dependents.cache = { }
+    if module.id in get_question_dependents.cache:
+        return get_question_dependents.cache[module.id]
+
+    dependencies, root_questions = get_all_question_dependencies(module)
+    question_keys = { q.key for q in dependencies }
+
+    dependents = { q.key: set() for q in dependencies }
+    volatile = set()
+    for q, deps in dependencies.items():
+        for qq in deps:
+            dependents[qq.key].add(q.key)
+        for edge_type, name in get_question_template_vars_with_type(q):
+            if edge_type.startswith("impute-") and name not in question_keys:
+                volatile.add(q.key)
+
+    ret = (dependents, volatile)
+
+    # Save to in-memory (in-process) cache. Never in debugging.
+    if not settings.DEBUG:
+        get_question_dependents.cache[module.id] = ret
+
+    return ret
+
+def get_module_context_dependencies(module):
+    # Returns the set of the names of the context variables outside of the
+    # Task itself --- "project" and "organization" --- that any template
+    # in the module refers to, i.e. in its title, output documents, question
+    # prompts, and impute rules. A Task's cached_state can only depend on
+    # the project's or organization's data if its module is in this set.
+    # When we can't tell (e.g. a template can't be parsed), we assume that
+    # the module refers to both.
+    #
+    # The result is cached by the module and a hash of its specification
+    # and its questions' specifications (see get_module_spec_hash), so that
+    # the cache never returns a stale result for a module whose specification
+    # changed (which in practice only happens during debugging) and so works
+    # the same way whether or not we are debugging.
+    return module_context_dependencies_cache.get_or_create(
+        (module.id, get_module_spec_hash(module)),
+        lambda : compute_module_context_dependencies(module, module.questions.all()))
+
+def get_module_spec_hash(module):
+    # Returns a hash of the specification of the module and its questions.
+
+    # Initialize cache, query cache.
+    if not hasattr(get_module_spec_hash, 'cache'):
+        get_module_spec_hash.cache = { }
+    if module.id in get_module_spec_hash.cache:
+        return get_module_spec_hash.cache[module.id]
+
+    import json, xxhash
+    ret = xxhash.xxh64(json.dumps(
+        [module.spec, get_module_questions_hash(module.questions.all())],
+        sort_keys=True).encode("utf8")).hexdigest()
+
+    # Save to in-memory (in-process) cache. Never in debugging.
+    if not settings.DEBUG:
+        get_module_spec_hash.cache[module.id] = ret
+
+    return ret
+
+def compute_module_context_dependencies(module, questions):
+    CONTEXT_VARIABLES = { "project", "organization" }
+
+    def walk(value):
+        # Look for templates in all of the strings in the specification data.
+        # Only strings with Jinja2 markup can refer to variables.
+        if isinstance(value, str):
+            if "{{" in value or "{%" in value:
+                yield from get_jinja2_template_vars(value)
+        elif isinstance(value, list):
+            for item in value:
+                yield from walk(item)
+        elif isinstance(value, dict):
+            for item in value.values():
+                yield from walk(item)
+
+    try:
+        names = set(walk(module.spec))
+        for question in questions:
+            names |= set(walk(question.spec))
+            names |= { name for edge_type, name in get_question_template_vars_with_type(question) }
+        return frozenset(names & CONTEXT_VARIABLES)
+    except Exception:
+        return frozenset(CONTEXT_VARIABLES)
+
+module_context_dependencies_cache = LRUCache(1024)
+
+def get_affected_question_keys(module, changed_keys):
+    # Returns the set of keys of the questions whose evaluation could
+    # change if the answers to the questions in changed_keys changed:
+    # those questions, the volatile questions, and everything that
+    # depends on them, directly or indirectly.
+    dependents, volatile = get_question_dependents(module)
+    affected = set()
+    queue = list(changed_keys) + list(volatile)
+    while queue:
+        key = queue.pop()
+        if key in affected:
+            continue
+        affected.add(key)
+        queue.extend(dependents.get(key, []))
+    return affected
+
 def get_question_dependencies(question, get_from_question_id=None):
     return set(edge[1] for edge in get_question_dependencies_with_type(question, get_from_question_id))
 
@@ -807,8 +1434,20 @@ def get_question_dependencies_with_type(question, get_from_question_id=None):
 
     # Returns a set of ModuleQuestion instances that this question is dependent on
     # as a list of edges that are tuples of (edge_type, question obj).
+    ret = get_question_template_vars_with_type(question)
+
+    # Turn IDs into ModuleQuestion instances.
+    return [ (edge_type, get_from_question_id[qid])
+         for (edge_type, qid) in ret
+         if qid in get_from_question_id
+       ]
+
+def get_question_template_vars_with_type(question):
+    # Returns a list of tuples of (edge_type, variable name) for the
+    # variables that the question's prompt, impute rules, and ask-first
+    # list refer to. Most are the IDs of other questions in the module.
     ret = []
-    
+
     # All questions mentioned in prompt text become dependencies.
     for qid in get_jinja2_template_vars(question.spec.get("prompt", "")):
         ret.append(("prompt", qid))
@@ -836,11 +1475,7 @@ def get_question_dependencies_with_type(question, get_from_question_id=None):
     for qid in question.spec.get("ask-first", []):
         ret.append(("ask-first", qid))
 
-    # Turn IDs into ModuleQuestion instances.
-    return [ (edge_type, get_from_question_id[qid])
-         for (edge_type, qid) in ret
-         if qid in get_from_question_id
-       ]
+    return ret
 
 def run_impute_conditions(conditions, context):
     # Check if any of the impute conditions are met based on
@@ -848,10 +1483,9 @@ def run_impute_conditions(conditions, context):
     # the imputed value. Be careful about values like 0 that
     # are false-y --- must check for "is None" to know if
     # something was imputed or not.
-    env = Jinja2Environment()
     for rule in conditions:
         if "condition" in rule:
-            condition_func = env.compile_expression(rule["condition"])
+            condition_func = compile_impute_expression(rule["condition"])
             try:
                 value = condition_func(context)
             except:
@@ -865,7 +1499,7 @@ def run_impute_conditions(conditions, context):
                 # Imputed value is the raw YAML value.
                 value = rule["value"]
             elif rule.get("value-mode", "raw") == "expression":
-                value = env.compile_expression(rule["value"])(context)
+                value = compile_impute_expression(rule["value"])(context)
                 if isinstance(value, RenderedAnswer):
                     # Unwrap.
                     value =  value.answer
@@ -877,12 +1511,7 @@ def run_impute_conditions(conditions, context):
                     # RenderedProject, RenderedOrganization
                     value = value.as_raw_value()
             elif rule.get("value-mode", "raw") == "template":
-                env = Jinja2Environment(autoescape=True)
-                try:
-                    template = env.from_string(rule["value"])
-                except jinja2.TemplateSyntaxError as e:
-                    raise ValueError("There was an error loading the template %s: %s" % (rule["value"], str(e)))
-                value = template.render(context)
+                value = compile_impute_template(rule["value"])(context)
             else:
                 raise ValueError("Invalid impute condition value-mode.")
 
@@ -893,12 +1522,202 @@ def run_impute_conditions(conditions, context):
     return None
 
 
+# Compiled impute condition expressions and value expressions/templates,
+# keyed by their source text. evaluate_module_state runs the impute rules
+# of every question each time a module's state is computed, so the same
+# expressions are compiled over and over again without this cache. Because
+# the keys are the expressions themselves, a changed question specification
+# can never get a stale compiled expression. The cache is also emptied by
+# clear_module_question_cache.
+impute_expression_cache = LRUCache(8192)
+
+def get_impute_jinja2_environments():
+    # Compiled expressions and templates are cached across requests, so
+    # they must be bound to long-lived Environments.
+    if not hasattr(get_impute_jinja2_environments, "envs"):
+        get_impute_jinja2_environments.envs = {
+            "expression": Jinja2Environment(),
+            "template": Jinja2Environment(autoescape=True),
+        }
+    return get_impute_jinja2_environments.envs
+
+def compile_impute_expression(expression):
+    # Returns a function that evaluates the expression in a context.
+    def compile():
+        func = get_impute_jinja2_environments()["expression"].compile_expression(expression)
+        variables = get_jinja2_template_vars(r"{% if (" + expression + r") %}...{% endif %}")
+        return lambda context : func(get_context_variables(context, variables))
+    return impute_expression_cache.get_or_create(("expression", expression), compile)
+
+def compile_impute_template(template):
+    # Returns a function that renders the template in a context.
+    def compile():
+        import jinja2
+        try:
+            t = get_impute_jinja2_environments()["template"].from_string(template)
+        except jinja2.TemplateSyntaxError as e:
+            raise ValueError("There was an error loading the template %s: %s" % (template, str(e)))
+        variables = get_jinja2_template_vars(template)
+        return lambda context : t.render(get_context_variables(context, variables))
+    return impute_expression_cache.get_or_create(("template", template), compile)
+
+def get_context_variables(context, variables):
+    # Jinja2 copies the whole context into a dict before evaluating an
+    # expression or template, which for a TemplateContext means wrapping
+    # every answer in a RenderedAnswer. Only the variables that the
+    # expression actually uses can affect its value, so just pass those.
+    return { key: context[key] for key in variables if key in context }
+
+
 def get_question_choice(question, key):
     for choice in question.spec["choices"]:
         if choice["key"] == key:
             return choice
     raise KeyError(repr(key) + " is not a choice")
 
+from collections.abc import Mapping, MutableMapping
+class AnswerSet(MutableMapping):
+    """An ordered mapping from the keys of a Module's questions to
+       (question, is_answered, answerobj, value) tuples. Rather than
+       holding a tuple per question, the parts of the tuples are kept in
+       parallel lists indexed by the position of each question in module
+       definition order, and the list of questions and the index of their
+       keys are shared by all of the AnswerSets of the Module. Iteration
+       is in definition order."""
+
+    __slots__ = ("questions", "index", "answered", "answerobjs", "answervalues", "count")
+
+    def __init__(self, module):
+        self.questions, self.index = get_module_question_index(module)
+        self.answered = [None] * len(self.questions) # None if the question has no entry
+        self.answerobjs = [None] * len(self.questions)
+        self.answervalues = [None] * len(self.questions)
+        self.count = 0
+
+    def __getitem__(self, key):
+        i = self.index[key]
+        if self.answered[i] is None:
+            raise KeyError(key)
+        return (self.questions[i], self.answered[i], self.answerobjs[i], self.answervalues[i])
+
+    def __setitem__(self, key, answertuple):
+        i = self.index.get(key)
+        if i is None:
+            i = self.add_question(answertuple[0])
+        if self.answered[i] is None:
+            self.count += 1
+        _, is_answered, answerobj, value = answertuple
+        self.answered[i] = bool(is_answered)
+        self.answerobjs[i] = answerobj
+        self.answervalues[i] = value
+
+    def __delitem__(self, key):
+        i = self.index[key]
+        if self.answered[i] is None:
+            raise KeyError(key)
+        self.answered[i] = None
+        self.answerobjs[i] = None
+        self.answervalues[i] = None
+        self.count -= 1
+
+    def __contains__(self, key):
+        i = self.index.get(key)
+        return i is not None and self.answered[i] is not None
+
+    def __iter__(self):
+        for q, is_answered in zip(self.questions, self.answered):
+            if is_answered is not None:
+                yield q.key
+
+    def __len__(self):
+        return self.count
+
+    def add_question(self, question):
+        # The question isn't in the module's question index. That happens
+        # when the module's questions were changed in another process (e.g.
+        # by the authoring tool) after this process cached the index. Forget
+        # what this process cached about the module so that it's loaded
+        # again, and move the entries to their positions in the new index.
+        # Returns the position of the question.
+        forget_module_question_cache(question.module)
+        questions, index = get_module_question_index(question.module)
+        if question.key not in index:
+            # The question is newer still. Keep it at the end of this
+            # AnswerSet only.
+            questions = questions + [question]
+            index = dict(index)
+            index[question.key] = len(questions) - 1
+        entries = [(q.key, self.answered[i], self.answerobjs[i], self.answervalues[i])
+                   for i, q in enumerate(self.questions)
+                   if self.answered[i] is not None and q.key in index]
+        self.questions, self.index = questions, index
+        self.answered = [None] * len(self.questions)
+        self.answerobjs = [None] * len(self.questions)
+        self.answervalues = [None] * len(self.questions)
+        self.count = len(entries)
+        for key, is_answered, answerobj, value in entries:
+            i = self.index[key]
+            self.answered[i] = is_answered
+            self.answerobjs[i] = answerobj
+            self.answervalues[i] = value
+        return self.index[question.key]
+
+    def is_answered(self, key):
+        # Returns whether the question has an entry that says it's answered.
+        i = self.index.get(key)
+        return i is not None and bool(self.answered[i])
+
+
+class AnswerSetView(Mapping):
+    """A read-only view of the answers in an AnswerSet to the questions that a
+       question depends on, directly or indirectly, which is what the question's
+       impute conditions are evaluated against."""
+
+    __slots__ = ("answer_set", "question", "dependencies", "_keys")
+
+    def __init__(self, answer_set, question, dependencies):
+        self.answer_set = answer_set
+        self.question = question
+        self.dependencies = dependencies # ModuleQuestion => list of ModuleQuestions it depends on
+        self._keys = None
+
+    def get_keys(self):
+        # Collect the keys of all of the questions the question depends on,
+        # but only if they are asked for, since impute conditions normally
+        # only use the question's direct dependencies.
+        if self._keys is None:
+            self._keys = set()
+            stack = list(self.dependencies[self.question])
+            while stack:
+                q = stack.pop()
+                if q.key not in self._keys:
+                    self._keys.add(q.key)
+                    stack.extend(self.dependencies[q])
+        return self._keys
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self.answer_set[key]
+
+    def __contains__(self, key):
+        if not self.answer_set.is_answered(key):
+            return False
+        for q in self.dependencies[self.question]:
+            if q.key == key:
+                return True
+        return key in self.get_keys()
+
+    def __iter__(self):
+        keys = self.get_keys()
+        for key in self.answer_set:
+            if key in keys and self.answer_set.is_answered(key):
+                yield key
+
+    def __len__(self):
+        return len([key for key in self])
+
+
 class ModuleAnswers(object):
     """Represents a set of answers to a Task."""
 
@@ -911,29 +1730,92 @@ class ModuleAnswers(object):
     def __str__(self):
         return "<ModuleAnswers for %s - %s>" % (self.module, self.task)
 
-    def as_dict(self):
+    def get_answertuples(self):
         if self.answertuples is None:
             # Lazy-load by calling the task's get_answers function
             # and copying its answers dictionary.
             if self.task is None:
-                self.answertuples = { q.key: (q, False, None, None) for q in sorted(self.module.questions.all(), key = lambda q : q.definition_order) }
+                self.answertuples = AnswerSet(self.module)
+                for q in self.answertuples.questions:
+                    self.answertuples[q.key] = (q, False, None, None)
             else:
-                self.answertuples = self.task.get_answers().answertuples
+                self.answertuples = ProjectEvaluationSession.load_answers(self.task).answertuples
+        return self.answertuples
+
+    def as_dict(self):
+        self.get_answertuples() # lazy load if necessary
         if self.answers_dict is None:
             self.answers_dict = { q.key: value for q, is_ans, ansobj, value in self.answertuples.values() if is_ans }
         return self.answers_dict
 
-    def with_extended_info(self, parent_context=None):
+    def get_subtasks(self):
+        # Return the Tasks that answer the module and module-set questions.
+        tasks = []
+        for value in self.as_dict().values():
+            for v in (value if isinstance(value, list) else [value]):
+                if isinstance(v, ModuleAnswers) and v.task is not None:
+                    tasks.append(v.task)
+        return tasks
+
+    def with_extended_info(self, parent_context=None, previous_state=None, changed_keys=None):
         # Return a new ModuleAnswers instance that has imputed values added
         # and information about the next question(s) and unanswered questions.
-        return evaluate_module_state(self, parent_context=parent_context)
+        return evaluate_module_state(self, parent_context=parent_context,
+            previous_state=previous_state, changed_keys=changed_keys)
+
+    def get_module_state(self):
+        # Return a JSON-serializable summary of the outcome of evaluate_module_state
+        # for this instance, which can be turned back into a ModuleAnswers with
+        # from_module_state, or None if the imputed values can't be serialized.
+        # User answers are not included, since they are stored elsewhere.
+        import json
+        state = {
+            "unanswered": [q.key for q in self.unanswered],
+            "can_answer": [q.key for q in self.can_answer],
+            "imputed": { key: self.answertuples[key][3] for key in self.was_imputed },
+            "answered": [key for key, (q, is_answered, answerobj, value) in self.answertuples.items()
+                         if is_answered and key not in self.was_imputed],
+        }
+        try:
+            if json.loads(json.dumps(state)) != state:
+                return None
+        except (TypeError, ValueError):
+            return None
+        return state
+
+    @staticmethod
+    def from_module_state(current_answers, state):
+        # Re-create the return value of evaluate_module_state from the output
+        # of get_module_state and the user's current answers. Answers that
+        # changed since the state was saved will be wrong in the return value,
+        # so it may only be passed to evaluate_module_state as previous_state
+        # along with the keys of the changed answers.
+        questions = { q.key: q for q in current_answers.module.questions.all() }
+        answertuples = AnswerSet(current_answers.module)
+        if any(key not in questions or key not in answertuples.index for key in
+          state["unanswered"] + list(state["imputed"]) + state["answered"]):
+            # The module's questions have changed.
+            return None
+        for key in state["unanswered"]:
+            answertuples[key] = (questions[key], False, None, None)
+        for key, value in state["imputed"].items():
+            answertuples[key] = (questions[key], True, None, value)
+        for key in state["answered"]:
+            if key in current_answers.as_dict():
+                answertuples[key] = (questions[key], True, current_answers.get(key), current_answers.as_dict()[key])
+            else:
+                answertuples[key] = (questions[key], True, None, None)
+        ret = ModuleAnswers(current_answers.module, current_answers.task, answertuples)
+        ret.was_imputed = set(state["imputed"])
+        ret.unanswered = [questions[key] for key in state["unanswered"]]
+        ret.can_answer = [questions[key] for key in state["can_answer"]]
+        return ret
 
     def get(self, question_key):
         return self.answertuples[question_key][2]
 
     def get_questions(self):
-        self.as_dict() # lazy load if necessary
-        return [v[0] for v in self.answertuples.values()]
+        return [v[0] for v in self.get_answertuples().values()]
 
     def render_answers(self, show_unanswered=True, show_imputed=True, show_imputed_nulls=True, show_metadata=False):
         # Return a generator that provides tuples of
@@ -1014,11 +1896,6 @@ class ModuleAnswers(object):
                         doc_name = "'%s' output document '%s'" % (self.module_answers.module.module_name, doc_name)
 
                         # Try to render it.
-                        task_cache_key = "output_r1_{}_{}_{}".format(
-                            self.index,
-                            key,
-                            1 if use_data_urls else 0,
-                        )
                         def do_render():
                             try:
                                 return render_content(self.document, self.module_answers, key, doc_name, show_answer_metadata=True, use_data_urls=use_data_urls)
@@ -1030,7 +1907,7 @@ class ModuleAnswers(object):
                                     import html
                                     ret = "<p class=text-danger>" + html.escape(ret) + "</p>"
                                 return ret
-                        self.rendered_content[key] = self.module_answers.task._get_cached_state(task_cache_key, do_render)
+                        self.rendered_content[key] = self.module_answers.task._get_rendered_document(self.index, key, use_data_urls, do_render)
 
                     return self.rendered_content[key]
 
@@ -1063,13 +1940,17 @@ class UndefinedReference:
     def __getitem__(self, item):
         return UndefinedReference(item, self.errorfunc, self.path+[self.varname])
 
-from collections.abc import Mapping
 class TemplateContext(Mapping):
     """A Jinja2 execution context that wraps the Pythonic answers to questions
        of a ModuleAnswers instance in RenderedAnswer instances that provide
        template and expression functionality like the '.' accessor to get to
        the answers of a sub-task."""
 
+    # Many of these are created while evaluating and rendering a project,
+    # so they don't get a __dict__.
+    __slots__ = ("module_answers", "escapefunc", "root", "errorfunc", "source",
+                 "show_answer_metadata", "is_computing_title", "_cache", "parent_context")
+
     def __init__(self, module_answers, escapefunc, parent_context=None, root=False, errorfunc=None, source=None, show_answer_metadata=None, is_computing_title=False):
         self.module_answers = module_answers
         self.escapefunc = escapefunc
@@ -1091,28 +1972,27 @@ class TemplateContext(Mapping):
         return self._cache[item]
 
     def _execute_lazy_module_answers(self):
+        # Returns the answer tuples of the module answers, loading them
+        # the first time.
+        if callable(self.module_answers):
+            self.module_answers = self.module_answers()
         if self.module_answers is None:
             # This is a TemplateContext for an unanswered question with an unknown
             # module type. We treat this as if it were a Task that had no questions but
             # also is not finished.
-            self._module_questions = { }
-            return
-        if callable(self.module_answers):
-            self.module_answers = self.module_answers()
-        self._module_questions = { q.key: q for q in self.module_answers.get_questions() }
+            return { }
+        return self.module_answers.get_answertuples()
 
     def getitem(self, item):
-        self._execute_lazy_module_answers()
+        answertuples = self._execute_lazy_module_answers()
 
         # If 'item' matches a question ID, wrap the internal Pythonic/JSON-able value
         # with a RenderedAnswer instance which take care of converting raw data values
         # into how they are rendered in templates (escaping, iteration, property accessors)
         # and evaluated in expressions.
-        question = self._module_questions.get(item)
-        if question:
+        if item in answertuples:
             # The question might or might not be answered. If not, its value is None.
-            self.module_answers.as_dict() # trigger lazy-loading
-            _, is_answered, answerobj, answervalue = self.module_answers.answertuples.get(item, (None, None, None, None))
+            question, is_answered, answerobj, answervalue = answertuples[item]
             return RenderedAnswer(self.module_answers.task, question, is_answered, answerobj, answervalue, self)
 
         # The context also provides the project and organization that the Task belongs to,
@@ -1145,11 +2025,8 @@ class TemplateContext(Mapping):
 
         # The 'questions' key returns (question, answer) pairs.
         if item == "questions":
-            if self.module_answers is None:
-                return []
-            self.module_answers.as_dict() # trigger lazy-loading
             ret = []
-            for question, is_answered, answerobj, answervalue in self.module_answers.answertuples.values():
+            for question, is_answered, answerobj, answervalue in answertuples.values():
                 ret.append((
                     question.spec,
                     RenderedAnswer(self.module_answers.task, question, is_answered, answerobj, answervalue, self)
@@ -1169,14 +2046,14 @@ class TemplateContext(Mapping):
         raise AttributeError(error_message.format(**error_message_vars))
 
     def __iter__(self):
-        self._execute_lazy_module_answers()
+        answertuples = self._execute_lazy_module_answers()
 
         seen_keys = set()
 
         # question names
-        for q in self._module_questions.values():
-            seen_keys.add(q.key)
-            yield q.key
+        for key in answertuples:
+            seen_keys.add(key)
+            yield key
 
         # special values
         if self.module_answers and self.module_answers.task:
@@ -1194,6 +2071,18 @@ class TemplateContext(Mapping):
             if attribute not in seen_keys:
                 yield attribute
 
+    def __contains__(self, item):
+        # The same as checking if __iter__ yields item, but without
+        # listing all of the questions.
+        if item in self._execute_lazy_module_answers():
+            return True
+        if self.module_answers and self.module_answers.task:
+            if item == "title":
+                return not self.is_computing_title or not self.root
+            if item in ("task_link", "project", "organization"):
+                return True
+        return item in ("is_started", "is_finished", "questions", "output_documents")
+
     def __len__(self):
         return len([x for x in self])
 
@@ -1231,11 +2120,13 @@ class TemplateContext(Mapping):
 
 
 class RenderedProject(TemplateContext):
+    __slots__ = ("project",)
+
     def __init__(self, project, parent_context=None):
         self.project = project
         def _lazy_load():
             if self.project.root_task:
-                return self.project.root_task.get_answers()
+                return ProjectEvaluationSession.load_answers(self.project.root_task)
         super().__init__(_lazy_load, parent_context.escapefunc, parent_context=parent_context)
         self.source = self.source + ["project variable"]
     def __str__(self):
@@ -1251,12 +2142,14 @@ class RenderedProject(TemplateContext):
         return self.escapefunc(None, None, None, None, self.as_raw_value())
 
 class RenderedOrganization(TemplateContext):
+    __slots__ = ("task", "_org")
+
     def __init__(self, task, parent_context=None):
         self.task =task
         def _lazy_load():
             project = self.organization.get_organization_project()
             if project.root_task:
-                return project.root_task.get_answers()
+                return ProjectEvaluationSession.load_answers(project.root_task)
         super().__init__(_lazy_load, parent_context.escapefunc, parent_context=parent_context)
         self.source = self.source + ["organization variable"]
 
@@ -1275,6 +2168,9 @@ class RenderedOrganization(TemplateContext):
         return self.escapefunc(None, None, None, None, self.as_raw_value())
 
 class RenderedAnswer:
+    __slots__ = ("task", "question", "is_answered", "answerobj", "answer",
+                 "parent_context", "escapefunc", "question_type", "cached_tc")
+
     def __init__(self, task, question, is_answered, answerobj, answer, parent_context):
         self.task = task
         self.question = question
@@ -1320,6 +2216,10 @@ class RenderedAnswer:
         elif self.question_type in ("module", "module-set"):
             ans = self.answer # ModuleAnswers or list of ModuleAnswers
             if self.question_type == "module": ans = [ans] # make it a lsit
+            if not self.parent_context.is_computing_title:
+                # Compute the titles of all of the answers at once.
+                from .models import Task
+                Task.resolve_titles(a.task for a in ans if a.task is not None)
             def get_title(task):
                 if self.parent_context.is_computing_title:
                     # When we're computing the title for "instance-name", prevent
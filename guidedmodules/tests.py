@@ -233,6 +233,186 @@ class ImputeConditionTests(TestCaseWithFixtureData):
         self.assertEqual(answers.get("im_templ_1"), '1')
         self.assertEqual(answers.get("im_templ_2"), '2')
 
+    def test_impute_expressions_are_compiled_once(self):
+        # Evaluating a module twice should reuse the compiled impute rules.
+        m = self.getModule("impute_conditions")
+        clear_module_question_cache()
+        ModuleAnswers(m, None, { }).with_extended_info()
+        misses = impute_expression_cache.misses
+        answers = ModuleAnswers(m, None, { }).with_extended_info()
+        self.assertEqual(impute_expression_cache.misses, misses)
+        self.assertEqual(answers.as_dict().get("im_templ_2"), '2')
+
+class ModuleStateTests(TestCaseWithFixtureData):
+    ## EVALUATE_MODULE_STATE TESTS ##
+
+    def create_synthetic_module(self, num_questions):
+        # Create a module whose questions form a long chain of ask-first
+        # dependencies, with every third question imputed from the one
+        # before it.
+        from .models import ModuleQuestion
+        m = Module(source=self.fixture_app.source, app=self.fixture_app,
+            module_name="synthetic", spec={ "id": "synthetic", "title": "Synthetic" })
+        m.save()
+        questions = []
+        for i in range(num_questions):
+            spec = { "id": "q%d" % i, "type": "text", "title": "Question %d" % i }
+            if i > 0:
+                spec["ask-first"] = ["q%d" % (i-1)]
+            if i % 3 == 2:
+                spec["impute"] = [{ "condition": "q%d == 'yes'" % (i-1), "value": "yes" }]
+            questions.append(ModuleQuestion(module=m, key=spec["id"], definition_order=i, spec=spec))
+        ModuleQuestion.objects.bulk_create(questions)
+
+        # Module IDs are reused across tests, so forget what was cached
+        # about the modules of earlier tests.
+        clear_module_question_cache()
+        return m
+
+    def test_evaluate_long_dependency_chain(self):
+        # A chain of dependencies longer than Python's recursion limit
+        # should evaluate without error and in linear time: each question
+        # is visited once and the answers aren't copied for each question.
+        from unittest import mock
+        from . import module_logic
+        m = self.create_synthetic_module(2000)
+        questions = { q.key: q for q in m.questions.all() }
+        answers = ModuleAnswers(m, None, {
+            "q%d" % i: (questions["q%d" % i], True, None, "yes")
+            for i in range(2000) if i < 1000 and i % 3 != 2
+        })
+        visits = []
+        def run_impute_conditions(conditions, context):
+            visits.append(context.module_answers.answertuples)
+            return module_logic_run_impute_conditions(conditions, context)
+        module_logic_run_impute_conditions = module_logic.run_impute_conditions
+        with mock.patch.object(module_logic, "run_impute_conditions", run_impute_conditions):
+            state = answers.with_extended_info()
+
+        # The first 1000 questions are answered or imputed, so q1000
+        # is the only question that can be answered next.
+        self.assertEqual([q.key for q in state.can_answer], ["q1000"])
+        self.assertEqual(len(state.unanswered), 1000)
+        self.assertEqual(len(state.was_imputed), 333)
+        self.assertEqual(list(state.answertuples)[:3], ["q0", "q1", "q2"])
+
+        # The impute conditions of the questions whose dependencies are
+        # answered were each run once, with views of the same answers that
+        # never had to collect all of the questions' dependencies.
+        self.assertEqual([view.question.key for view in visits], ["q%d" % i for i in range(1001)])
+        self.assertEqual({ id(view.answer_set) for view in visits }, { id(state.answertuples) })
+        self.assertEqual([view for view in visits if view._keys is not None], [])
+
+    def test_answer_set(self):
+        m = self.create_synthetic_module(6)
+        questions = { q.key: q for q in m.questions.all() }
+
+        # Answers are kept in definition order, whatever order they are set in.
+        answers = AnswerSet(m)
+        for key in ("q2", "q0", "q1", "q3"):
+            answers[key] = (questions[key], key != "q3", None, key.upper())
+        self.assertEqual(list(answers), ["q0", "q1", "q2", "q3"])
+        self.assertEqual(answers["q1"], (questions["q1"], True, None, "Q1"))
+        self.assertNotIn("q4", answers)
+        del answers["q1"]
+        self.assertEqual(len(answers), 3)
+        self.assertNotIn("q1", answers)
+        answers["q1"] = (questions["q1"], True, None, "Q1")
+
+        # A view for a question sees only the answered questions it depends on.
+        _, sorted_dependencies = get_question_evaluation_order(m)
+        view = AnswerSetView(answers, questions["q4"], sorted_dependencies)
+        self.assertEqual(list(view), ["q0", "q1", "q2"])
+        self.assertIn("q0", view)
+        self.assertNotIn("q3", view)
+        view = AnswerSetView(answers, questions["q2"], sorted_dependencies)
+        self.assertEqual(dict(view), { "q0": answers["q0"], "q1": answers["q1"] })
+
+        # Template contexts and rendered answers don't have a __dict__.
+        state = ModuleAnswers(m, None, answers).with_extended_info()
+        tc = TemplateContext(state, lambda _0, _1, _2, _3, value : str(value))
+        self.assertEqual(tc["q1"].answer, "Q1")
+        self.assertFalse(hasattr(tc, "__dict__"))
+        self.assertFalse(hasattr(tc["q1"], "__dict__"))
+
+        # A question added to the module by another process, after this
+        # process cached the module's questions, gets its answer too.
+        new_question = m.questions.create(key="q_new", definition_order=-1,
+            spec={ "id": "q_new", "type": "text", "title": "New" })
+        answers["q_new"] = (new_question, True, None, "NEW")
+        self.assertEqual(list(answers), ["q_new", "q0", "q1", "q2", "q3"])
+        self.assertEqual(answers["q2"], (questions["q2"], True, None, "Q2"))
+        self.assertEqual(AnswerSet(m).index["q_new"], 0)
+
+    def test_shared_dependency_graph_store(self):
+        # A process that hasn't computed a module's dependency graph gets
+        # it from the shared store.
+        m = self.getModule("impute_conditions")
+        clear_module_question_cache()
+        dependencies, root_questions = get_all_question_dependencies(m)
+        self.assertIsNotNone(dependency_graph_store.get(m, get_module_questions_hash(m.questions.all())))
+        self.assertEqual(Module.objects.get(id=m.id).dependency_graph.spec_hash, get_module_questions_hash(m.questions.all()))
+
+        clear_module_question_cache()
+        dependencies2, root_questions2 = get_all_question_dependencies(m)
+        self.assertEqual(dependencies2, dependencies)
+        self.assertEqual(root_questions2, root_questions)
+
+    def assertSameModuleState(self, a, b):
+        self.assertEqual(
+            [(key, is_answered, answerobj, value) for key, (q, is_answered, answerobj, value) in a.answertuples.items()],
+            [(key, is_answered, answerobj, value) for key, (q, is_answered, answerobj, value) in b.answertuples.items()])
+        self.assertEqual(a.was_imputed, b.was_imputed)
+        self.assertEqual(a.can_answer, b.can_answer)
+        self.assertEqual(a.unanswered, b.unanswered)
+
+    def test_incremental_evaluation(self):
+        m = self.create_synthetic_module(30)
+        questions = { q.key: q for q in m.questions.all() }
+        def get_answers(values):
+            return ModuleAnswers(m, None, { key: (questions[key], True, None, value) for key, value in values.items() })
+
+        before = { "q0": "yes", "q1": "yes", "q3": "yes", "q4": "yes", "q6": "no" }
+        previous_state = get_answers(before).with_extended_info()
+
+        for changed_key, value in (("q4", "no"), ("q6", "yes"), ("q1", "no")):
+            after = dict(before)
+            after[changed_key] = value
+            self.assertSameModuleState(
+                get_answers(after).with_extended_info(previous_state=previous_state, changed_keys={ changed_key }),
+                get_answers(after).with_extended_info())
+
+    def test_incremental_evaluation_of_task(self):
+        from .models import TaskAnswer
+        m = self.create_synthetic_module(10)
+        task = Task.objects.create(module=m, project=self.project, editor=self.user)
+        def save_answer(key, value):
+            TaskAnswer.objects.get_or_create(task=task, question=m.questions.get(key=key))[0]\
+                .save_answer(value, [], None, self.user, "web")
+            task.refresh_from_db()
+
+        save_answer("q0", "yes")
+        task.get_answers_with_extended_info()
+        self.assertIn("module_state", task.cached_state)
+
+        # After saving an answer, the saved module state is kept and the
+        # changed question is remembered.
+        save_answer("q1", "yes")
+        self.assertEqual(task.cached_state["module_state_changed_keys"], ["q1"])
+        self.assertSameModuleState(
+            task.get_answers_with_extended_info(),
+            task.get_answers().with_extended_info())
+        self.assertNotIn("module_state_changed_keys", task.cached_state)
+        self.assertEqual(task.cached_state["module_state"]["imputed"], { "q2": "yes" })
+
+        # Answers changed through different instances of the Task, e.g. in
+        # different processes, are merged into the changed keys.
+        t1 = Task.objects.get(id=task.id)
+        t2 = Task.objects.get(id=task.id)
+        t1.on_answer_changed(changed_keys={ "q3" })
+        t2.on_answer_changed(changed_keys={ "q4" })
+        self.assertEqual(Task.objects.get(id=task.id).cached_state["module_state_changed_keys"], ["q3", "q4"])
+
 class RenderTests(TestCaseWithFixtureData):
     ## GENERAL RENDER TESTS ##
 
@@ -386,6 +566,33 @@ class RenderTests(TestCaseWithFixtureData):
             },
             '<p>this is bad: <!-- raw HTML omitted -->click me<!-- raw HTML omitted --></p>')
 
+    def test_render_content_template_cache(self):
+        # Rendering the same template twice should prepare it only once
+        # but still substitute the current answers each time.
+        template = "# Cache Test {{q_text}}"
+        def test(value, expected):
+            self.assertEqual(
+                self.render_content(
+                    "question_types_text",
+                    "markdown", template,
+                    { "q_text": value },
+                    "html"),
+                expected)
+        render_content_cache.clear()
+        hits = render_content_cache.hits
+        test("first", "<h2>Cache Test first</h2>")
+        self.assertEqual(render_content_cache.hits, hits)
+        test("second", "<h2>Cache Test second</h2>")
+        self.assertEqual(render_content_cache.hits, hits + 2) # CommonMark stage and Jinja2 stage
+
+        # demote_headings is part of the cache key.
+        m = self.getModule("question_types_text")
+        self.assertEqual(
+            render_content({ "format": "markdown", "template": template },
+                ModuleAnswers(m, None, { "q_text": (m.questions.get(key="q_text"), True, None, "third") }),
+                "html", str(self), demote_headings=False).strip(),
+            "<h1>Cache Test third</h1>")
+
     def render_content(self, module, template_format, template, answers, output_format):
         m = self.getModule(module)
         t = Task(id=500, module=m, project=self.project, extra={})
@@ -641,6 +848,879 @@ class RenderTests(TestCaseWithFixtureData):
             expected_impute_value = expected
         self.assertEqual(actual, expected_impute_value, msg="impute value expression %s" % expression)
 
+class HtmlUrlRewriterTests(TestCase):
+    # rewrite_html_urls replaced a pass that parsed HTML output with html5lib,
+    # rewrote href and src attributes in the DOM, and serialized it again.
+    # Check that it gives the same results on a corpus of tricky HTML.
+
+    corpus = [
+        '<p>Hello <a href="page.html">link</a></p>',
+        '<a href="javascript:alert(1)">x</a>',
+        "<a HREF='JavaScript:alert(1)'>x</a>",
+        '<a href=javascript:alert(1)>x</a>',
+        '<a href="&#106;avascript:alert(1)">x</a>',
+        '<a href="java&#x09;script:alert(1)">x</a>',
+        '<img src="data:image/png;base64,AAAA">',
+        '<iframe src="data:text/html,hi"></iframe>',
+        '<a href="data:text/html,hi">x</a>',
+        '<a/href="javascript:alert(1)">x</a>',
+        '<a title=">" href="javascript:alert(1)">x</a>',
+        '<!-- <a href="javascript:x"> --><a href="javascript:alert(1)">x</a>',
+        '<!--><a href="javascript:alert(1)">x</a>',
+        '<!---><a href="javascript:alert(1)">x</a>',
+        '<!-- x --!><a href="javascript:alert(1)">x</a>',
+        '<![CDATA[ x ]]><a href="javascript:alert(1)">x</a>',
+        '<!DOCTYPE html><a href="javascript:alert(1)">x</a>',
+        '<?php x ?><a href="javascript:alert(1)">x</a>',
+        '</p title=">"><a href="javascript:alert(1)">x</a>',
+        '</ x><a href="javascript:alert(1)">x</a>',
+        '<script>var a = \'<a href="javascript:x">\';</script><a href="javascript:alert(1)">x</a>',
+        '<style>a { b: "</style><a href=javascript:alert(1)>x</a>',
+        '<textarea><a href="javascript:x"></textarea>',
+        '<title><a href="javascript:x"></title>',
+        '<svg><style><a href="javascript:alert(1)">x</a></style></svg>',
+        '<math><style><a href="javascript:alert(1)">x</a></style></math>',
+        '<svg/><style><a href="javascript:alert(1)">x</a></style>',
+        '<p>1 < 2 and <a href="x">3</a></p>',
+        '<a href="x" href="javascript:alert(1)">x</a>',
+        '<a href = "javascript:alert(1)" >x</a>',
+        '<a href=""></a><a href>x</a>',
+        "<p><div class='question-answer'><p>text</p></div></p>",
+        '<img src="mailto:x"><img src=\'https://x/y.png?a=1&amp;b=2\'>',
+        '<a href="mailto:a@b.c">m</a> <a href="http://x.y/?a=<b>">q</a>',
+        '<table class=\'table\'><tr><td><a href="vbscript:x">v</a></td></tr></table>',
+        '<a href="javascript:alert(1)',
+        "<a href='x'>unterminated",
+        '<noscript><a href="javascript:alert(1)">x</a></noscript>',
+        '<xmp><a href="javascript:alert(1)">x</a></xmp><a href="javascript:alert(1)">y</a>',
+        '<plaintext><a href="javascript:alert(1)">x</a>',
+        '<scriptx><a href="javascript:alert(1)">x</a>',
+        '<a href="&amp;notit=1">x</a><a href="?a=1&notit=2">y</a>\n',
+        '<a href="?a=1&notit;=2&amp;x=&lt;&not=3&not &copy">x</a>',
+        '<a href="&#106avascript:alert(1)">x</a>\n',
+        '<svg><image href="x.png"/><a href="javascript:alert(1)"><text>t</text></a></svg>',
+        "<a id=1 href=\"x\" ID=2 class='c' hidden>x</a><img src=x.png alt=a/>",
+        '<p><img src="" alt="image" /></p>',
+    ]
+
+    @staticmethod
+    def rewrite_url(url, allow_dataurl=False):
+        # Like render_content's rewrite_url, with a stand-in for static assets.
+        import urllib.parse
+        if ":" not in url.split("/")[0] and not url.startswith("#"):
+            url = "/static/" + url
+        u = urllib.parse.urlparse(url)
+        if allow_dataurl and u.scheme == "data":
+            return url
+        if u.scheme not in ("", "http", "https", "mailto"):
+            return "javascript:alert('Invalid link.');"
+        return url
+
+    @staticmethod
+    def serialize(dom):
+        import html5lib
+        return html5lib.serialize(dom, quote_attr_values="always", omit_optional_tags=False, alphabetical_attributes=True)\
+            .replace("<p></p>", "")
+
+    def rewrite_html_urls_html5lib(self, html):
+        # The previous implementation.
+        import html5lib
+        dom = html5lib.HTMLParser().parseFragment(html)
+        for node in dom.iter():
+            if node.get("href"):
+                node.set("href", self.rewrite_url(node.get("href")))
+            if node.get("src"):
+                node.set("src", self.rewrite_url(node.get("src"), allow_dataurl=(node.tag == "{http://www.w3.org/1999/xhtml}img")))
+        return self.serialize(dom)
+
+    def test_corpus(self):
+        # Compare the DOMs that browsers would build from the outputs.
+        import html5lib
+        for html in self.corpus:
+            self.assertEqual(
+                self.serialize(html5lib.HTMLParser().parseFragment(rewrite_html_urls(html, self.rewrite_url))),
+                self.rewrite_html_urls_html5lib(html),
+                msg=html)
+
+    def test_svg_links(self):
+        # html5lib didn't rewrite namespaced attributes like xlink:href.
+        self.assertEqual(
+            rewrite_html_urls('<svg><a xlink:href="javascript:alert(1)"><text>t</text></a></svg>', self.rewrite_url),
+            '<svg><a xlink:href="javascript:alert(\'Invalid link.\');"><text>t</text></a></svg>')
+
+    def test_benchmark(self):
+        import time
+        chunk = """<h2>Control AC-{0}</h2>
+<p>The organization <em>develops</em> and <strong>documents</strong> an access control policy. See <a href="policy.html#ac-{0}">the policy</a>.</p>
+<div class='question-answer' data-module='Access Control'><p>Our answer includes <code>code</code> and a list:</p><ul><li>one</li><li>two &amp; three</li></ul></div>
+<table class='table'><tr><th>Role</th><th>Responsibility</th></tr><tr><td>ISSO</td><td><img src="assets/logo.png" alt="logo"></td></tr></table>
+"""
+
+        # A 1 MB document is rewritten quickly.
+        html = "".join(chunk.format(i) for i in range(2100))
+        self.assertGreater(len(html), 1000000)
+        start = time.time()
+        rewrite_html_urls(html, self.rewrite_url)
+        self.assertLess(time.time() - start, 5)
+
+        # And faster than with html5lib, which is too slow to time on the
+        # whole document here.
+        html = html[:len(html)//20]
+        start = time.time()
+        rewrite_html_urls(html, self.rewrite_url)
+        elapsed = time.time() - start
+        start = time.time()
+        self.rewrite_html_urls_html5lib(html)
+        self.assertLess(elapsed * 5, time.time() - start)
+
+class TaskAnswerTests(TestCaseWithFixtureData):
+    ## CURRENT ANSWER TESTS ##
+
+    def save_answer(self, task, key, value, answered_by_tasks=[]):
+        TaskAnswer.objects.get_or_create(task=task, question=task.module.questions.get(key=key))[0]\
+            .save_answer(value, answered_by_tasks, None, self.user, "web")
+
+    def test_current_answer_records_in_tree(self):
+        # Create a task that has a sub-task as the answer to a module question.
+        parent = Task.objects.create(module=self.getModule("question_types_module"), project=self.project, editor=self.user)
+        child = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        self.save_answer(child, "q1", "first answer")
+        self.save_answer(child, "q1", "second answer")
+        self.save_answer(parent, "q_module", None, [child])
+
+        # Only the most recent answers are current.
+        records = [(t, q.key, a.get_value() if a else None)
+            for t, q, a in Task.get_all_current_answer_records_in_tree([parent])
+            if a or q.key == "q1"]
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0][:2], (parent, "q_module"))
+        self.assertEqual(records[1], (child, "q1", "second answer"))
+
+        # Clearing an answer makes it not current.
+        TaskAnswer.objects.get(task=child, question__key="q1").clear_answer(self.user)
+        self.assertEqual(
+            [q.key for q, a in child.get_current_answer_records() if a],
+            [])
+
+    def test_current_answer_pointer(self):
+        task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        self.save_answer(task, "q1", "first answer")
+        self.save_answer(task, "q1", "second answer")
+        ans = TaskAnswer.objects.get(task=task, question__key="q1")
+        first, second = ans.answer_history.order_by('id')
+        self.assertEqual(ans.current_answer, second)
+        self.assertEqual(ans.get_current_answer(), second)
+        self.assertTrue(second.is_latest())
+        self.assertFalse(first.is_latest())
+
+        # The backfill recomputes the same pointer.
+        TaskAnswer.objects.filter(id=ans.id).update(current_answer=None)
+        TaskAnswer.update_current_answers()
+        ans.refresh_from_db()
+        self.assertEqual(ans.current_answer, second)
+
+        # Answering through an out-of-date instance still replaces the
+        # current answer in the database.
+        stale = TaskAnswer.objects.get(id=ans.id)
+        third = ans.create_answer_history(answered_by=self.user, stored_value="third answer")
+        fourth = stale.create_answer_history(answered_by=self.user, stored_value="fourth answer")
+        self.assertGreater(fourth.id, third.id)
+        self.assertEqual(TaskAnswer.objects.get(id=ans.id).current_answer, fourth)
+
+    ## CACHED STATE INVALIDATION TESTS ##
+
+    def test_clear_state(self):
+        # Create a sub-task of the project's root task, an unrelated task
+        # in the project, and a task whose module refers to the project.
+        root = self.project.root_task
+        child = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        other = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        m = Module(source=self.fixture_app.source, app=self.fixture_app,
+            module_name="refers_to_project", spec={
+                "id": "refers_to_project", "title": "Refers to Project",
+                "output": [{ "format": "markdown", "template": "{{project.simple_module.q1}}" }] })
+        m.save()
+        peeker = Task.objects.create(module=m, project=self.project, editor=self.user)
+        self.save_answer(root, "simple_module", None, [child])
+
+        def get_cleared_tasks():
+            return { t for t in (root, child, other, peeker)
+                if Task.objects.get(id=t.id).cached_state is None }
+        def set_cached_state():
+            Task.objects.filter(project=self.project).update(cached_state={ "title": "cached" })
+
+        # Changing the sub-task clears its state and its parent's, and because
+        # the parent is the project's root task, the state of the task that
+        # refers to the project. The unrelated task is not cleared.
+        set_cached_state()
+        self.save_answer(child, "q1", "answer")
+        self.assertEqual(get_cleared_tasks(), { root, child, peeker })
+
+        # Changing the unrelated task clears only its own state.
+        set_cached_state()
+        self.save_answer(other, "q1", "answer")
+        self.assertEqual(get_cleared_tasks(), { other })
+
+        # The modules' context dependencies are cached even when debugging,
+        # keyed by the module's specification so that a changed module
+        # is scanned again.
+        from django.test import override_settings
+        from .module_logic import get_module_context_dependencies, module_context_dependencies_cache, \
+            forget_module_question_cache
+        with override_settings(DEBUG=True):
+            forget_module_question_cache(m) # a process that is debugging caches nothing else
+            misses = module_context_dependencies_cache.misses
+            self.assertEqual(get_module_context_dependencies(Module.objects.get(id=m.id)), { "project" })
+            self.assertEqual(module_context_dependencies_cache.misses, misses)
+            m.spec["output"][0]["template"] = "{{organization.name}}"
+            m.save()
+            self.assertEqual(get_module_context_dependencies(Module.objects.get(id=m.id)), { "organization" })
+            self.assertEqual(module_context_dependencies_cache.misses, misses + 1)
+
+        # Outside of debugging, the lookup doesn't query or hash anything
+        # once the module has been seen.
+        get_module_context_dependencies(m)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_module_context_dependencies(m), { "organization" })
+
+    def test_rendered_document_store(self):
+        from .module_logic import rendered_document_store
+        task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        self.save_answer(task, "q1", "42")
+        self.assertIn("The Answer: 42", task.render_output_documents()[0]["text"])
+
+        # The document is stored outside of cached_state, which only holds
+        # a small version token.
+        task = Task.objects.get(id=task.id)
+        version = task.cached_state["output_version"]
+        self.assertEqual(
+            rendered_document_store.get(task, version, 0, "text", False),
+            task.render_output_documents()[0]["text"])
+        self.assertEqual([k for k in task.cached_state if k.startswith("output_") and k != "output_version"], [])
+
+        # Changing an answer changes the version so the document is re-rendered.
+        self.save_answer(task, "q1", "43")
+        task = Task.objects.get(id=task.id)
+        self.assertIn("The Answer: 43", task.render_output_documents()[0]["text"])
+        self.assertNotEqual(task.cached_state["output_version"], version)
+
+        # The documents are stored in the database, where every process
+        # sees them, and the stale ones are deleted.
+        self.assertEqual(
+            set(task.rendered_documents.values_list("output_version", flat=True)),
+            { task.cached_state["output_version"] })
+        self.assertIn("The Answer: 43",
+            rendered_document_store.get(Task.objects.get(id=task.id), task.get_output_version(), 0, "text", False))
+
+    def test_output_document_export(self):
+        from .models import OutputDocumentExport
+        from .management.commands.render_output_documents import Command as render_output_documents
+        m = Module(source=self.fixture_app.source, app=self.fixture_app,
+            module_name="exported", spec={
+                "id": "exported", "title": "Exported",
+                "output": [{ "id": "doc", "format": "markdown", "template": "Answer: {{q1}}" }] })
+        m.save()
+        m.questions.create(key="q1", definition_order=0, spec={ "id": "q1", "type": "text", "title": "Q1" })
+        task = Task.objects.create(module=m, project=self.project, editor=self.user)
+        self.save_answer(task, "q1", "first")
+
+        # Requesting an export queues it, and requesting it again while it is
+        # queued doesn't queue another.
+        export = OutputDocumentExport.request_export(task, "doc", "markdown", self.user)
+        self.assertEqual(export.status, "queued")
+        self.assertEqual(OutputDocumentExport.request_export(task, "doc", "markdown", self.user), export)
+
+        # There is only ever one export of a version of the answers.
+        from django.db import IntegrityError, transaction
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OutputDocumentExport.objects.create(task=task, document_id="doc", download_format="markdown", output_version=export.output_version)
+
+        # The worker generates it.
+        render_output_documents().run_queued_exports()
+        export.refresh_from_db()
+        self.assertEqual(export.status, "done")
+        self.assertEqual(bytes(export.blob).decode("utf8").strip(), "Answer: first")
+        self.assertEqual(export.filename, "doc.md")
+        self.assertTrue(export.is_current())
+        self.assertEqual(OutputDocumentExport.request_export(task, "doc", "markdown", self.user), export)
+
+        # Changing an answer makes the export stale and queues a new one.
+        self.save_answer(task, "q1", "second")
+        export = OutputDocumentExport.objects.get(id=export.id)
+        self.assertFalse(export.is_current())
+        self.assertEqual(OutputDocumentExport.get_exports(task, "doc", "markdown").filter(status="queued").count(), 1)
+        render_output_documents().run_queued_exports()
+        latest = OutputDocumentExport.get_latest_finished_export(task, "doc", "markdown")
+        self.assertEqual(bytes(latest.blob).decode("utf8").strip(), "Answer: second")
+        self.assertEqual(OutputDocumentExport.get_exports(task, "doc", "markdown").count(), 1)
+
+    def test_output_document_text(self):
+        from .module_logic import rendered_document_store
+        m = Module(source=self.fixture_app.source, app=self.fixture_app,
+            module_name="stage_code", spec={
+                "id": "stage_code", "title": "Stage Code",
+                "output": [
+                    { "id": "report", "format": "markdown", "template": "Report: {{q1}}" },
+                    { "id": "govready_lifecycle_stage_code", "format": "text", "template": "us_nist_rmf_{{q1}}" },
+                ] })
+        m.save()
+        m.questions.create(key="q1", definition_order=0, spec={ "id": "q1", "type": "text", "title": "Q1" })
+        task = Task.objects.create(module=m, project=self.project, editor=self.user)
+        self.save_answer(task, "q1", "2_select")
+
+        # Only the named document is rendered, and its text is cached.
+        self.assertEqual(task.get_output_document_text("govready_lifecycle_stage_code").strip(), "us_nist_rmf_2_select")
+        self.assertIsNone(task.get_output_document_text("missing"))
+        self.assertIsNone(rendered_document_store.get(task, task.get_output_version(), 0, "text", False))
+        task = Task.objects.select_related("module").get(id=task.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(task.get_output_document_text("govready_lifecycle_stage_code").strip(), "us_nist_rmf_2_select")
+
+        # Changing an answer invalidates it.
+        self.save_answer(task, "q1", "3_implement")
+        task = Task.objects.get(id=task.id)
+        self.assertEqual(task.get_output_document_text("govready_lifecycle_stage_code").strip(), "us_nist_rmf_3_implement")
+
+    def test_project_evaluation_session(self):
+        from .module_logic import ProjectEvaluationSession, RenderedProject, TemplateContext
+        parent = Task.objects.create(module=self.getModule("question_types_module"), project=self.project, editor=self.user)
+        child = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        self.save_answer(child, "q1", "answer")
+        self.save_answer(parent, "q_module", None, [child])
+        self.project.root_task = parent
+        self.project.save()
+        parent = Task.objects.get(id=parent.id)
+
+        session = ProjectEvaluationSession()
+        session.activate()
+        try:
+            # Tasks are evaluated once per session, including when templates
+            # load the project's answers.
+            answers = session.get_answers_with_extended_info(parent)
+            with self.assertNumQueries(0):
+                self.assertIs(session.get_answers_with_extended_info(parent), answers)
+                tc = TemplateContext(answers, str)
+                RenderedProject(self.project, parent_context=tc)["q_module"]
+                self.assertIs(ProjectEvaluationSession.load_answers(parent), session.get_answers(parent))
+
+            # The sub-tasks' states are computed without evaluating the
+            # Task that was already evaluated again.
+            Task.clear_state([child])
+            answers = session.get_answers_with_extended_info(parent)
+            child = answers.as_dict()["q_module"].task
+            Task.compute_states_in_tree([parent], session.extended_answers)
+            self.assertEqual(child.cached_state["progress_percent_tuple"], (1, 2))
+            self.assertEqual(parent.cached_state["progress_percent_tuple"], (1, 3))
+
+            # Changing an answer forgets everything evaluated so far.
+            self.save_answer(child, "q1", "another answer")
+            self.assertIsNot(session.get_answers_with_extended_info(parent), answers)
+        finally:
+            ProjectEvaluationSession.deactivate()
+
+    def test_cached_state_concurrency(self):
+        task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        Task.clear_state([task])
+
+        # Keys computed by different instances (i.e. processes) are merged.
+        t1 = Task.objects.get(id=task.id)
+        t2 = Task.objects.get(id=task.id)
+        t1._get_cached_state("a", lambda : 1)
+        t2._get_cached_state("b", lambda : 2)
+        self.assertEqual(Task.objects.get(id=task.id).cached_state, { "a": 1, "b": 2 })
+
+        # A value computed while the state is cleared isn't saved.
+        def refresh():
+            Task.clear_state([task])
+            return 3
+        t1._get_cached_state("c", refresh)
+        self.assertEqual(t1.cached_state["c"], 3)
+        self.assertIsNone(Task.objects.get(id=task.id).cached_state)
+
+        # A value that another process has computed is used rather than
+        # computed again.
+        t1 = Task.objects.get(id=task.id)
+        Task.objects.filter(id=task.id).update(cached_state={ "d": 4 })
+        with self.assertNumQueries(1):
+            self.assertEqual(t1._get_cached_state("d", lambda : 1/0), 4)
+
+        # Outside of transactions, a process claims a value while it computes
+        # it, and other processes wait for the value rather than compute it.
+        from datetime import timedelta
+        from unittest import mock
+        from .models import TaskComputeClaim
+        with mock.patch.object(Task, "_can_claim_compute", lambda : True):
+            other = TaskComputeClaim.claim(task, "e")
+            self.assertIsNone(TaskComputeClaim.claim(task, "e"))
+            def sleep(seconds):
+                # The other process saves the value while this one waits.
+                Task.objects.filter(id=task.id).update(cached_state={ "e": 5 })
+            with mock.patch("time.sleep", sleep):
+                self.assertEqual(t1._get_cached_state("e", lambda : 1/0), 5)
+            other.release()
+            self.assertIsNotNone(TaskComputeClaim.claim(task, "e"))
+
+            # They stop waiting and compute the value themselves once
+            # the claim times out.
+            Task.objects.filter(id=task.id).update(cached_state=None)
+            t1 = Task.objects.get(id=task.id)
+            with mock.patch.object(Task, "COMPUTE_CLAIM_TIMEOUT", timedelta(0)):
+                self.assertEqual(t1._get_cached_state("e", lambda : 6), 6)
+
+            # Expired claims are taken over, and then their original
+            # owner can't release them.
+            other = TaskComputeClaim.claim(task, "f")
+            TaskComputeClaim.objects.filter(task=task, key="f").update(expires=other.expires-timedelta(days=1))
+            claim = TaskComputeClaim.claim(task, "f")
+            self.assertIsNotNone(claim)
+            other.release()
+            self.assertIsNone(TaskComputeClaim.claim(task, "f"))
+            claim.release()
+            self.assertFalse(TaskComputeClaim.objects.filter(task=task, key="f").exists())
+
+    def test_compute_states_in_tree(self):
+        def make_tree():
+            parent = Task.objects.create(module=self.getModule("question_types_module"), project=self.project, editor=self.user)
+            child = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+            self.save_answer(child, "q1", "answer")
+            self.save_answer(parent, "q_module", None, [child])
+            return parent, child
+
+        # Compute the states one Task at a time.
+        parent, child = make_tree()
+        Task.clear_state([parent, child])
+        parent = Task.objects.get(id=parent.id)
+        expected = (parent.is_finished(), parent.get_progress_percent_tuple())
+
+        # Compute the states in one pass. The results are the same and are
+        # saved, and the states of the sub-tasks are computed too.
+        parent, child = make_tree()
+        Task.clear_state([parent, child])
+        parent = Task.objects.get(id=parent.id)
+        Task.compute_states_in_tree([parent])
+        with self.assertNumQueries(0):
+            self.assertEqual((parent.is_finished(), parent.get_progress_percent_tuple()), expected)
+        parent = Task.objects.get(id=parent.id)
+        child = Task.objects.get(id=child.id)
+        self.assertEqual((parent.is_finished(), tuple(parent.get_progress_percent_tuple())), expected)
+        self.assertIn("is_finished", child.cached_state)
+        self.assertIn("progress_percent_tuple", child.cached_state)
+
+        # Tasks whose states are cached aren't evaluated again.
+        with self.assertNumQueries(0):
+            Task.compute_states_in_tree([parent])
+
+    def test_resolve_titles(self):
+        m = Module(source=self.fixture_app.source, app=self.fixture_app,
+            module_name="titled", spec={ "id": "titled", "title": "Titled", "instance-name": "Item {{q1}}" })
+        m.save()
+        m.questions.create(key="q1", definition_order=0, spec={ "id": "q1", "type": "text", "title": "Q1" })
+        tasks = [Task.objects.create(module=m, project=self.project, editor=self.user) for i in range(3)]
+        for i, task in enumerate(tasks):
+            self.save_answer(task, "q1", str(i))
+
+        # The titles of all of the tasks are computed in one go and saved.
+        tasks = list(Task.objects.filter(id__in=[t.id for t in tasks]).select_related("module__source", "module__app", "project").order_by("id"))
+        with self.assertNumQueries(7):
+            Task.resolve_titles(tasks)
+        with self.assertNumQueries(0):
+            self.assertEqual([t.title for t in tasks], ["Item 0", "Item 1", "Item 2"])
+        self.assertEqual([t.cached_state["title"] for t in Task.objects.filter(id__in=[t.id for t in tasks]).order_by("id")],
+            ["Item 0", "Item 1", "Item 2"])
+
+        # Tasks whose imputed answers can't be evaluated get the Module's
+        # title, as when their titles are computed one at a time.
+        m.questions.create(key="q2", definition_order=1, spec={ "id": "q2", "type": "text", "title": "Q2",
+            "impute": [{ "value": "x", "value-mode": "invalid" }] })
+        broken = Task.objects.create(module=m, project=self.project, editor=self.user)
+        self.assertEqual(Task.objects.get(id=broken.id).title, "Titled")
+        Task.clear_state(tasks + [broken])
+        tasks = list(Task.objects.filter(id__in=[tasks[0].id, broken.id]).order_by("id"))
+        Task.resolve_titles(tasks)
+        with self.assertNumQueries(0):
+            self.assertEqual([t.title for t in tasks], ["Titled", "Titled"])
+
+    def test_file_answer_value(self):
+        import json
+        from django.core.files.base import ContentFile
+        from .models import TaskAnswerHistory
+        task = Task.objects.create(module=self.getModule("question_types_media"), project=self.project, editor=self.user)
+        f = ContentFile(b"Hello world.")
+        f.name = "hello.txt"
+        TaskAnswer.objects.create(task=task, question=task.module.questions.get(key="q_file"))\
+            .save_answer(None, [], f, self.user, "web")
+
+        # Getting the value and checking that it's answered doesn't load
+        # the file metadata.
+        answer = TaskAnswerHistory.objects.select_related("taskanswer__task__module", "taskanswer__question")\
+            .get(taskanswer__task=task)
+        with self.assertNumQueries(0):
+            value = answer.get_value()
+            self.assertTrue(value)
+            self.assertTrue(value["url"].endswith("/history/{}/media".format(answer.id)))
+
+        # The metadata is loaded in one query when it's first accessed.
+        with self.assertNumQueries(1):
+            self.assertEqual(value["type"], "text/plain")
+            self.assertEqual(value.get("size"), 12)
+            self.assertEqual(value["type_display"], "plain text")
+            self.assertIsNone(value["thumbnail_url"])
+        self.assertIsNone(value["content_dataurl"])
+        self.assertEqual(json.loads(json.dumps(value)), {
+            "url": value["url"],
+            "size": 12,
+            "type": "text/plain",
+            "type_display": "plain text",
+            "thumbnail_url": None,
+            "content_dataurl": None,
+            "thumbnail_dataurl": None,
+        })
+
+class ProjectAccessTests(TestCaseWithFixtureData):
+    def test_projects_with_read_priv(self):
+        from guardian.shortcuts import assign_perm
+        from siteapp.models import Portfolio, ProjectMembership
+        from discussion.models import Discussion
+        user = User.objects.create(username="project.reader")
+        def make_project(**kwargs):
+            project = Project.objects.create(organization=self.organization, **kwargs)
+            project.root_task = Task.objects.create(module=self.getModule("app"), project=project, editor=self.user)
+            project.save()
+            return project
+
+        # One project for each way that a user can get read access to a project.
+        member = make_project()
+        ProjectMembership.objects.create(project=member, user=user)
+        admin = make_project()
+        ProjectMembership.objects.create(project=admin, user=user, is_admin=True)
+        editor = make_project()
+        Task.objects.create(module=self.getModule("simple"), project=editor, editor=user)
+        guest = make_project()
+        taskans = TaskAnswer.objects.create(task=guest.root_task, question=guest.root_task.module.questions.first())
+        Discussion.get_for(self.organization, taskans, create=True).guests.add(user)
+        permitted = make_project()
+        assign_perm("view_project", user, permitted)
+        portfolio = Portfolio.objects.create(title="Reader's Portfolio")
+        assign_perm("view_portfolio", user, portfolio)
+        in_portfolio = make_project(portfolio=portfolio)
+
+        # Projects the user has no access to and system projects are not included.
+        make_project()
+        account_project = make_project(is_account_project=True)
+        ProjectMembership.objects.create(project=account_project, user=user)
+
+        projects = Project.get_projects_with_read_priv(user)
+        self.assertEqual(set(projects), { member, admin, editor, guest, permitted, in_portfolio })
+        self.assertEqual(projects, sorted(projects, key=lambda p : p.updated, reverse=True))
+        self.assertEqual({ p for p in projects if getattr(p, "user_is_admin", False) }, { admin })
+
+        # Filters and excludes apply to all of them.
+        self.assertEqual(set(Project.get_projects_with_read_priv(user, filters={ "portfolio": portfolio })), { in_portfolio })
+        self.assertEqual(set(Project.get_projects_with_read_priv(user, excludes={ "portfolio": None })), { in_portfolio })
+        self.assertEqual(len(Project.get_projects_with_read_priv(User.objects.create(username="nobody"))), 0)
+
+    def test_task_access_level(self):
+        from siteapp.models import Portfolio, ProjectMembership
+        def save_answer(task, key, answered_by_tasks):
+            TaskAnswer.objects.get_or_create(task=task, question=task.module.questions.get(key=key))[0]\
+                .save_answer(None, answered_by_tasks, None, self.user, "web")
+
+        # A chain of tasks in another user's project, the top one of which
+        # is answered in a project that the reader is a member of.
+        reader = User.objects.create(username="task.reader")
+        ProjectMembership.objects.create(project=self.project, user=reader)
+        other_project = Project.objects.create(organization=self.organization,
+            portfolio=Portfolio.objects.create(title="Another User's Portfolio"))
+        parent = Task.objects.create(module=self.getModule("question_types_module"), project=self.project, editor=self.user)
+        middle = Task.objects.create(module=self.getModule("question_types_module"), project=other_project, editor=self.user)
+        child = Task.objects.create(module=self.getModule("simple"), project=other_project, editor=self.user)
+        save_answer(middle, "q_module", [child])
+        self.assertEqual(child.get_access_level(reader), None)
+        self.assertFalse(other_project.has_read_priv(reader))
+
+        # Access flows down through current answers.
+        save_answer(parent, "q_module", [middle])
+        self.assertEqual(Task.get_ancestor_task_ids([child.id]), { middle.id, parent.id })
+        child = Task.objects.get(id=child.id)
+        Task.resolve_ancestor_task_ids([child])
+        self.assertEqual(Task.objects.get(id=child.id).cached_state["ancestor_task_ids"], sorted([middle.id, parent.id]))
+        self.assertEqual(child.get_access_level(reader), "WRITE")
+        self.assertEqual(child.get_cached_ancestor_task_ids(), { middle.id, parent.id })
+        with self.assertNumQueries(1):
+            self.assertEqual(child.get_access_level(reader), "WRITE")
+        self.assertTrue(other_project.has_read_priv(reader))
+        self.assertEqual(
+            set(Task.get_all_tasks_readable_by(reader, recursive=True).filter(project=other_project)),
+            { middle, child })
+
+        # Changing the answer revokes it, even though the child's ancestors
+        # were cached.
+        save_answer(parent, "q_module", [])
+        child = Task.objects.get(id=child.id)
+        self.assertNotIn("ancestor_task_ids", child.cached_state or {})
+        self.assertEqual(child.get_access_level(reader), None)
+        self.assertFalse(other_project.has_read_priv(reader))
+
+        # Changing the answer also revokes it while the child's row is
+        # locked by a computation, and ancestors computed before the change
+        # but saved after it are discarded.
+        from django.db import transaction
+        save_answer(parent, "q_module", [middle])
+        Task.resolve_ancestor_task_ids([Task.objects.get(id=child.id)])
+        stale = Task.objects.get(id=child.id)
+        with transaction.atomic():
+            Task.objects.select_for_update().get(id=child.id)
+            save_answer(parent, "q_module", [])
+        self.assertNotIn("ancestor_task_ids", Task.objects.get(id=child.id).cached_state or {})
+        Task.save_cached_states([stale], ["ancestor_task_ids"])
+        self.assertNotIn("ancestor_task_ids", Task.objects.get(id=child.id).cached_state or {})
+        self.assertEqual(Task.objects.get(id=child.id).get_access_level(reader), None)
+
+        # Deleted tasks don't grant access.
+        save_answer(parent, "q_module", [middle])
+        parent.deleted_at = parent.created
+        parent.save(update_fields=["deleted_at"])
+        self.assertEqual(Task.objects.get(id=child.id).get_access_level(reader), None)
+
+    def test_authorization_context(self):
+        from guardian.shortcuts import assign_perm
+        from siteapp.models import Portfolio, ProjectMembership
+        from siteapp.middleware import AuthorizationContext
+        user = User.objects.create(username="candidate.writer")
+        portfolio = Portfolio.objects.create(title="Candidates")
+        def make_tasks(n):
+            tasks = []
+            for i in range(n):
+                project = Project.objects.create(organization=self.organization, portfolio=portfolio)
+                tasks.append(Task.objects.create(module=self.getModule("simple"), project=project, editor=self.user))
+            return tasks
+
+        # Tasks the user can write through membership, editorship, guardian
+        # permissions (ones that grant write privs and others, which make
+        # the user a member), and not at all.
+        def make_candidates(n):
+            member, editor, permitted, perm_member, none = make_tasks(n), make_tasks(n), make_tasks(n), make_tasks(n), make_tasks(n)
+            for t in member:
+                ProjectMembership.objects.create(project=t.project, user=user)
+            for t in editor:
+                t.editor = user
+                t.save()
+            for t in permitted:
+                assign_perm("change_project", user, t.project)
+            for t in perm_member:
+                assign_perm("view_project", user, t.project)
+            tasks = list(Task.objects.filter(id__in=[t.id for t in member+editor+permitted+perm_member+none]).select_related("project"))
+            return tasks, set(member+editor+permitted+perm_member)
+
+        # The results match Task.has_write_priv, and the number of queries
+        # doesn't depend on the number of Tasks, even when their ancestors
+        # aren't cached yet.
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        query_counts = []
+        for n in (1, 4):
+            tasks, writable = make_candidates(n)
+            self.assertEqual({ t for t in tasks if t.has_write_priv(user) }, writable)
+            self.assertEqual(Project.get_write_privs(user, { t.project for t in tasks }),
+                { t.project: t.project.has_write_priv(user) for t in tasks })
+            authz = AuthorizationContext(user)
+            with CaptureQueriesContext(connection) as queries:
+                can_write = authz.can_write_many(tasks)
+            query_counts.append(len(queries))
+            self.assertEqual({ t for t in tasks if can_write[t] }, writable)
+            self.assertEqual(
+                { t.id: set(t.cached_state["ancestor_task_ids"]) for t in tasks },
+                { t.id: Task.get_ancestor_task_ids([t.id]) for t in tasks })
+
+            # Checks are memoized.
+            with self.assertNumQueries(0):
+                self.assertEqual({ t for t in tasks if authz.can_write(t) }, writable)
+        self.assertEqual(query_counts[0], query_counts[1])
+
+class InstrumentationTests(TestCaseWithFixtureData):
+    def test_instrumentation_event_buffer(self):
+        from .models import InstrumentationEvent, InstrumentationEventBuffer
+        buffer = InstrumentationEventBuffer()
+        task = self.project.root_task
+        question = task.module.questions.first()
+
+        # Events are buffered.
+        with self.assertNumQueries(0):
+            first = buffer.add(user=self.user, event_type="task-question-show", event_value=1, task=task, question=question)
+            second = buffer.add(user=self.user, event_type="task-question-show", event_value=2, task=task, question=question)
+        self.assertEqual(InstrumentationEvent.objects.filter(event_type="task-question-show").count(), 0)
+
+        # They aren't flushed inside a transaction (tests run inside one),
+        # since it could be rolled back.
+        buffer.flush()
+        self.assertEqual(buffer.get_stats()["buffered"], 2)
+        buffer.can_flush = lambda : True
+
+        # Flushing writes them in one INSERT, keeping their times.
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            buffer.flush()
+        self.assertEqual(len([q for q in queries if q["sql"].startswith("INSERT") and "instrumentationevent\"" in q["sql"]]), 1)
+        self.assertEqual(
+            list(InstrumentationEvent.objects.filter(event_type="task-question-show").order_by('id').values_list("event_time", "event_value")),
+            [(first.event_time, 1), (second.event_time, 2)])
+
+        # Summaries are looked up with one query and include the buffered
+        # events, without flushing them.
+        self.assertEqual(buffer.get_summary("task-question-show", self.user, task, question),
+            { "first_event_time": first.event_time, "last_event_value": 2 })
+        buffer.add(user=self.user, event_type="task-question-show", event_value=3, task=task, question=question)
+        with self.assertNumQueries(1):
+            summary = buffer.get_summary("task-question-show", self.user, task, question)
+        self.assertEqual(summary, { "first_event_time": first.event_time, "last_event_value": 3 })
+        self.assertIsNone(buffer.get_summary("task-done", self.user, task))
+        done = buffer.add(user=self.user, event_type="task-done", task=task)
+        self.assertEqual(buffer.get_summary("task-done", self.user, task)["first_event_time"], done.event_time)
+        self.assertEqual(buffer.get_stats()["buffered"], 2)
+
+        # Other processes see the summaries once the events are flushed.
+        buffer.flush()
+        other_buffer = InstrumentationEventBuffer()
+        self.assertEqual(other_buffer.get_summary("task-question-show", self.user, task, question),
+            { "first_event_time": first.event_time, "last_event_value": 3 })
+        self.assertEqual(other_buffer.get_summary("task-done", self.user, task)["first_event_time"], done.event_time)
+
+        # The buffer is bounded.
+        buffer.max_size = 2
+        for i in range(5):
+            buffer.add(user=self.user, event_type="test", task=task)
+        self.assertEqual(buffer.get_stats(), { "added": 9, "inserted": 4, "dropped": 3, "buffered": 2 })
+        buffer.flush()
+
+    def test_instrumentation_event_rollups(self):
+        from datetime import timedelta
+        from django.db.models import Avg, Count, Sum
+        from django.utils import timezone
+        from .models import InstrumentationEvent, InstrumentationEventRollup
+        modules = list(Module.objects.all()[0:2])
+        def add_events(values, age):
+            for i, value in enumerate(values):
+                InstrumentationEvent.objects.create(event_type="task-done", event_value=value,
+                    module=modules[i % 2], event_time=timezone.now()-age, extra={})
+        def rolled_up_averages():
+            return {
+                r["module"]: (r["total"] / r["count"], r["count"])
+                for r in InstrumentationEventRollup.objects.filter(event_type="task-done")
+                    .values("module").annotate(total=Sum("total"), count=Sum("count"))
+            }
+        def averages():
+            return {
+                r["module"]: (r["avg"], r["count"])
+                for r in InstrumentationEvent.objects.filter(event_type="task-done")
+                    .values("module").annotate(avg=Avg("event_value"), count=Count("event_value"))
+            }
+
+        # Events are rolled up once they are old enough.
+        add_events([1, 2, 3, None, 5], timedelta(days=3))
+        add_events([10, 20], timedelta(days=1))
+        add_events([100], timedelta(seconds=0))
+        self.assertEqual(InstrumentationEventRollup.update_rollups(), 7)
+        self.assertEqual(InstrumentationEventRollup.update_rollups(), 0)
+        self.assertEqual(InstrumentationEventRollup.objects.filter(event_type="task-done").count(), 4)
+
+        # Later events are added to the existing rollups, along with the
+        # recent event before them.
+        add_events([7, 8], timedelta(days=1))
+        self.assertEqual(InstrumentationEventRollup.update_rollups(), 3)
+        self.assertEqual(InstrumentationEventRollup.objects.filter(event_type="task-done").count(), 5)
+        self.assertEqual(rolled_up_averages(), averages())
+
+        # Rolled-up events can be deleted without changing the rollups.
+        self.assertEqual(InstrumentationEventRollup.delete_rolled_up_events(timezone.now()-timedelta(days=2)), 5)
+        self.assertEqual(InstrumentationEvent.objects.filter(event_type="task-done").count(), 5)
+        self.assertEqual(rolled_up_averages()[modules[0].id], ((1+3+5+10+100+7)/6, 6))
+
+        # The analytics page reads the rollups.
+        from django.test import RequestFactory
+        from .views import analytics
+        request = RequestFactory().get("/tasks/analytics")
+        request.user = User.objects.create(username="staff", is_staff=True)
+        self.assertContains(analytics(request), "<td>{}</td>".format(round((1+3+5+10+100+7+2+20+8)/9)))
+
+        # Events that haven't been rolled up yet, including ones still in
+        # the buffer, are counted too.
+        from unittest import mock
+        from .models import instrumentation_event_buffer
+        add_events([400], timedelta(seconds=0))
+        with mock.patch.object(instrumentation_event_buffer, "can_flush", lambda : True):
+            instrumentation_event_buffer.add(event_type="task-done", event_value=500, module=modules[1])
+            self.assertEqual(InstrumentationEventRollup.get_totals("task-done", "module")[modules[1].id],
+                (4, 2+20+8+500))
+            self.assertContains(analytics(request), "<td>{}</td>".format(round((1+3+5+10+100+7+2+20+8+400+500)/11)))
+
+        # Batches are limited by the number of events, however large the
+        # gaps between their IDs are.
+        InstrumentationEvent.objects.filter(id__gt=InstrumentationEventRollup.get_high_water_mark()).delete()
+        add_events([9, 9, 9], timedelta(days=1))
+        for i in range(3):
+            self.assertEqual(InstrumentationEventRollup.update_rollups(batch_size=1), 1)
+        self.assertEqual(InstrumentationEventRollup.update_rollups(batch_size=1), 0)
+        self.assertEqual(rolled_up_averages()[modules[1].id], ((2+20+8+9)/4, 4))
+
+class AppCatalogTests(TestCaseWithFixtureData):
+    def test_app_catalog(self):
+        from unittest import mock
+        from siteapp.views import get_compliance_apps_catalog_for_user
+        from .models import AppVersion
+        self.fixture_app.source.available_to_all = True
+        self.fixture_app.source.save()
+
+        # Adding an app to the catalog renders its catalog entry, so loading
+        # the catalog doesn't render anything and the number of queries
+        # doesn't depend on the number of apps.
+        appver = self.fixture_app.source.add_app_to_catalog("simple_project")
+        self.assertEqual(AppVersion.objects.get(id=appver.id).catalog_entry["title"], appver.catalog_metadata["title"])
+        with mock.patch.object(AppVersion, "render_catalog_entry", side_effect=AssertionError):
+            with self.assertNumQueries(3):
+                catalog = list(get_compliance_apps_catalog_for_user(self.user))
+        entry = [app for app in catalog if app["key"] == "fixture/simple_project"][0]
+        self.assertEqual(entry["title"], appver.catalog_metadata["title"])
+        self.assertEqual(entry["versions"], [appver])
+        self.assertEqual(entry["organizations"], [self.organization])
+
+        # Changing the catalog metadata changes the entry.
+        appver.catalog_metadata["title"] = "A New Title"
+        appver.save()
+        catalog = list(get_compliance_apps_catalog_for_user(self.user))
+        self.assertEqual([app["title"] for app in catalog if app["key"] == "fixture/simple_project"], ["A New Title"])
+
+class ImageDerivativeTests(TestCaseWithFixtureData):
+    def test_image_to_dataurl(self):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.cache import caches
+        from .models import image_to_dataurl, image_derivative_store
+        caches[image_derivative_store.cache_alias].clear()
+        buf = BytesIO()
+        Image.new("RGB", (200, 100)).save(buf, "png")
+        image = buf.getvalue()
+
+        # The first thumbnail is computed and the second is a cache hit.
+        stats = image_derivative_store.get_stats()
+        url = image_to_dataurl(image, 50)
+        self.assertTrue(url.startswith("data:image/png;base64,"))
+        self.assertEqual(image_to_dataurl(BytesIO(image), 50), url)
+        self.assertEqual(image_derivative_store.misses - stats["misses"], 1)
+        self.assertEqual(image_derivative_store.hits - stats["hits"], 1)
+
+        # A different size is a different thumbnail.
+        self.assertNotEqual(image_to_dataurl(image, 25), url)
+
+        # Image content is keyed by its SHA256 hash, the same hash that
+        # app assets are keyed by.
+        import hashlib
+        self.assertEqual(image_to_dataurl(lambda : 1/0, 50, content_hash=hashlib.sha256(image).hexdigest()), url)
+
+        # When the content hash is given, the image isn't read on a hit.
+        image_to_dataurl(lambda : image, 50, content_hash="abc")
+        self.assertEqual(image_to_dataurl(lambda : 1/0, 50, content_hash="abc"), url)
+
 class ImportExportTests(TestCaseWithFixtureData):
     ## IMPORT/EXPORT TASK DATA TESTS ##
 
@@ -7,12 +7,15 @@ from django.db import transaction
 
 import re
 
-from .models import Module, ModuleQuestion, Task, TaskAnswer, TaskAnswerHistory, InstrumentationEvent
+from .models import Module, ModuleQuestion, Task, TaskAnswer, TaskAnswerHistory, OutputDocumentExport, \
+    instrumentation_event_buffer
 
 import guidedmodules.module_logic as module_logic
+from .module_logic import ProjectEvaluationSession
 import guidedmodules.answer_validation as answer_validation
 from discussion.models import Discussion
 from siteapp.models import User, Invitation, Project, ProjectMembership
+from siteapp.middleware import AuthorizationContext
 from siteapp.forms import ProjectForm
 
 import fs, fs.errors
@@ -100,10 +103,12 @@ def task_view(view_func):
             question = get_object_or_404(ModuleQuestion, module=task.module, key=question_key)
             taskans = TaskAnswer.objects.filter(task=task, question=question).first()
 
-        # Does the user have read privs here?
+        # Does the user have read privs here? The checks are memoized
+        # for the rest of the request.
+        authz = AuthorizationContext.for_request(request)
         def read_priv():
             # Yes if they have read privs on the task in general...
-            if task.has_read_priv(request.user, allow_access_to_deleted=True):
+            if authz.can_read(task, allow_access_to_deleted=True):
                 # See below for checking if the task was deleted.
                 return True
 
@@ -146,8 +151,11 @@ def task_view(view_func):
             return HttpResponseRedirect(task.get_absolute_url() + pagepath + question_key)
 
         # Load the answers the user has saved so far, and fetch imputed
-        # answers and next-question info.
-        answered = task.get_answers().with_extended_info()
+        # answers and next-question info. The evaluation is incremental
+        # when only some answers changed since the last page view, and
+        # it's shared with anything else that evaluates this Task during
+        # the request.
+        answered = ProjectEvaluationSession.for_request(request).get_answers_with_extended_info(task)
 
         # Common context variables.
         context = {
@@ -156,9 +164,9 @@ def task_view(view_func):
 
             "m": task.module,
             "task": task,
-            "is_discussion_guest": not task.has_read_priv(request.user), # i.e. only here for discussion
-            "write_priv": task.has_write_priv(request.user),
-            "is_admin": request.user in task.project.get_admins(),
+            "is_discussion_guest": not authz.can_read(task), # i.e. only here for discussion
+            "write_priv": authz.can_write(task),
+            "is_admin": authz.is_project_admin(task.project),
             "send_invitation": Invitation.form_context_dict(request.user, task.project, [task.editor]),
             "open_invitations": task.get_open_invitations(request.user),
             "source_invitation": task.get_source_invitation(request.user),
@@ -190,7 +198,7 @@ def save_answer(request, task, answered, context, __):
         return HttpResponseNotAllowed(["POST"])
 
     # does user have write privs?
-    if not task.has_write_priv(request.user):
+    if not AuthorizationContext.for_request(request).can_write(task):
         return HttpResponseForbidden()
 
     # normal redirect - load next linear question if possible
@@ -302,7 +310,7 @@ def save_answer(request, task, answered, context, __):
                 for item in value.split(',')
                 ]
             for t in answered_by_tasks:
-                if t.module != q.answer_type_module or not t.has_read_priv(request.user):
+                if t.module != q.answer_type_module or not AuthorizationContext.for_request(request).can_read(t):
                     raise ValueError("invalid task ID")
             if q.spec["type"] == "module" and len(answered_by_tasks) != 1:
                 raise ValueError("did not provide exactly one task ID")
@@ -347,14 +355,11 @@ def save_answer(request, task, answered, context, __):
     # --------------------------
     # How long was it since the question was initially viewed? That gives us
     # how long it took to answer the question.
-    i_task_question_view = InstrumentationEvent.objects\
-        .filter(user=request.user, event_type="task-question-show", task=task, question=q)\
-        .order_by('event_time')\
-        .first()
-    i_event_value = (timezone.now() - i_task_question_view.event_time).total_seconds() \
+    i_task_question_view = instrumentation_event_buffer.get_summary("task-question-show", request.user, task, q)
+    i_event_value = (timezone.now() - i_task_question_view["first_event_time"]).total_seconds() \
         if i_task_question_view else None
     # Save.
-    InstrumentationEvent.objects.create(
+    instrumentation_event_buffer.add(
         user=request.user,
         event_type="task-question-" + instrumentation_event_type,
         event_value=i_event_value,
@@ -439,11 +444,18 @@ def show_question(request, task, answered, context, q):
         # The user can choose from any Task instances they have read permission on
         # and that are of the correct Module type.
         answer_tasks = Task.get_all_tasks_readable_by(request.user, recursive=True)\
-            .filter(module=answer_module)
+            .filter(module=answer_module)\
+            .select_related("project__portfolio", "module__source", "module__app")\
+            .prefetch_related("project__contained_in_folders")
 
         # Annotate the instances with whether the user also has write permission.
+        # This is checked for all of the instances at once.
+        can_write = AuthorizationContext.for_request(request).can_write_many(answer_tasks)
         for t in answer_tasks:
-            t.can_write = t.has_write_priv(request.user)
+            t.can_write = can_write[t]
+
+        # The template shows their titles.
+        Task.resolve_titles(answer_tasks)
 
         # Sort the instances:
         #  first: the current answer, if any
@@ -461,15 +473,12 @@ def show_question(request, task, answered, context, q):
 
     # Add instrumentation event.
     # How many times has this question been shown?
-    i_prev_view = InstrumentationEvent.objects\
-        .filter(user=request.user, event_type="task-question-show", task=task, question=q)\
-        .order_by('-event_time')\
-        .first()
+    i_prev_view = instrumentation_event_buffer.get_summary("task-question-show", request.user, task, q)
     # Save.
-    InstrumentationEvent.objects.create(
+    instrumentation_event_buffer.add(
         user=request.user,
         event_type="task-question-show",
-        event_value=(i_prev_view.event_value+1) if i_prev_view else 1,
+        event_value=(i_prev_view["last_event_value"]+1) if i_prev_view and i_prev_view["last_event_value"] is not None else 1,
         module=task.module,
         question=q,
         project=task.project,
@@ -530,8 +539,8 @@ def show_question(request, task, answered, context, q):
     # and providing a download link.
     answer_rendered = None
     if taskq and taskq.question.spec["type"] == "file" and answer:
-        from .module_logic import TemplateContext, RenderedAnswer, HtmlAnswerRenderer
-        tc = TemplateContext(answered, HtmlAnswerRenderer(show_metadata=False))
+        from .module_logic import RenderedAnswer
+        tc = ProjectEvaluationSession.for_request(request).get_html_template_context(answered)
         ra = RenderedAnswer(task, taskq.question, True, answer, existing_answer, tc)
         answer_rendered = ra.__html__()
 
@@ -567,7 +576,13 @@ def show_question(request, task, answered, context, q):
 
     # Pre-load the answers to project root task questions and impute answers so
     # that we know which questions are suppressed by imputed values.
-    root_task_answers = task.project.root_task.get_answers().with_extended_info()
+    session = ProjectEvaluationSession.for_request(request)
+    root_task_answers = session.get_answers_with_extended_info(task.project.root_task)
+
+    # Compute whether the sub-tasks are finished and their progress in
+    # one pass rather than one sub-task at a time.
+    Task.compute_states_in_tree(root_task_answers.get_subtasks(), session.extended_answers)
+
     task_progress_project_list = []
     # current_mq_group = ""
     current_group = None
@@ -748,17 +763,13 @@ def task_finished(request, task, answered, context, *unused_args):
 
     # Add instrumentation event.
     # Has the user been here before?
-    i_task_done = InstrumentationEvent.objects\
-        .filter(user=request.user, event_type="task-done", task=task)\
-        .exists()
+    i_task_done = instrumentation_event_buffer.get_summary("task-done", request.user, task) is not None
     # How long since the task was created?
-    i_task_create = InstrumentationEvent.objects\
-        .filter(user=request.user, event_type="task-create", task=task)\
-        .first()
-    i_event_value = (timezone.now() - i_task_create.event_time).total_seconds() \
+    i_task_create = instrumentation_event_buffer.get_summary("task-create", request.user, task)
+    i_event_value = (timezone.now() - i_task_create["first_event_time"]).total_seconds() \
         if i_task_create else None
     # Save.
-    InstrumentationEvent.objects.create(
+    instrumentation_event_buffer.add(
         user=request.user,
         event_type="task-done" if not i_task_done else "task-review",
         event_value=i_event_value,
@@ -782,7 +793,13 @@ def task_finished(request, task, answered, context, *unused_args):
 
     # Pre-load the answers to project root task questions and impute answers so
     # that we know which questions are suppressed by imputed values.
-    root_task_answers = task.project.root_task.get_answers().with_extended_info()
+    session = ProjectEvaluationSession.for_request(request)
+    root_task_answers = session.get_answers_with_extended_info(task.project.root_task)
+
+    # Compute whether the sub-tasks are finished and their progress in
+    # one pass rather than one sub-task at a time.
+    Task.compute_states_in_tree(root_task_answers.get_subtasks(), session.extended_answers)
+
     task_progress_project_list = []
     # current_mq_group = ""
     current_group = None
@@ -945,7 +962,7 @@ def download_answer_file(request, task, answered, context, q, history_id):
     # if it exists.
     blob = tah.answered_by_file
     if request.GET.get("thumbnail"):
-        tah.get_value() # populate lazy-created thumbnail
+        # Thumbnails are generated in the background and may not exist yet.
         if not tah.thumbnail.name: raise Http404()
         blob = tah.thumbnail
 
@@ -982,19 +999,63 @@ def download_answer_file(request, task, answered, context, q, history_id):
 
     return resp
 
+def get_output_document_for_export(task, document_id, download_format):
+    # Validate the document and format of an export request.
+    if download_format not in OutputDocumentExport.BACKGROUND_FORMATS:
+        raise Http404()
+    for doc in task.module.spec.get("output", []):
+        if doc.get("id") == document_id:
+            return doc
+    raise Http404()
+
 @task_view
 def download_module_output(request, task, answered, context, question, document_id, download_format):
     if document_id in (None, ""):
         raise Http404()
-    try:
-        blob, filename, mime_type= task.download_output_document(document_id, download_format, answers=answered)
-    except ValueError:
-        raise Http404()
 
-    resp = HttpResponse(blob, mime_type)
-    resp['Content-Disposition'] = 'inline; filename=' + filename
+    # HTML is rendered directly.
+    if download_format not in OutputDocumentExport.BACKGROUND_FORMATS:
+        try:
+            blob, filename, mime_type= task.download_output_document(document_id, download_format, answers=answered)
+        except ValueError:
+            raise Http404()
+
+        resp = HttpResponse(blob, mime_type)
+        resp['Content-Disposition'] = 'inline; filename=' + filename
+        return resp
+
+    # Other formats are exported by a background worker. Serve the most recent
+    # export, even if it is out of date, and make sure a new one is coming.
+    get_output_document_for_export(task, document_id, download_format)
+    OutputDocumentExport.request_export(task, document_id, download_format, request.user)
+    export = OutputDocumentExport.get_latest_finished_export(task, document_id, download_format)
+    if export is None:
+        resp = HttpResponse("The document is being generated. Please try again in a moment.", "text/plain", status=202)
+        resp['Retry-After'] = "5"
+        return resp
+
+    resp = HttpResponse(bytes(export.blob), export.mime_type)
+    resp['Content-Disposition'] = 'inline; filename=' + export.filename
+    resp['X-Document-Freshness'] = "current" if export.is_current() else "stale"
     return resp
 
+@task_view
+def download_module_output_status(request, task, answered, context, question, document_id, download_format):
+    # Requests an export of an output document, if needed, and returns its
+    # status, for the download button to poll until the document is ready.
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    if download_format not in OutputDocumentExport.BACKGROUND_FORMATS:
+        return JsonResponse({ "status": "done", "is_current": True })
+    get_output_document_for_export(task, document_id, download_format)
+    export = OutputDocumentExport.request_export(task, document_id, download_format, request.user)
+    return JsonResponse({
+        "status": export.status,
+        "is_current": export.is_current(),
+        "has_previous_export": OutputDocumentExport.get_latest_finished_export(task, document_id, download_format) is not None,
+        "error": export.error,
+    })
+
 @login_required
 def instrumentation_record_interaction(request):
     if request.method != "POST":
@@ -1017,24 +1078,20 @@ def instrumentation_record_interaction(request):
     # We're recording the *first* interaction, so we'll
     # stop if an interaction has already been recorded.
 
-    if InstrumentationEvent.objects.filter(
-        user=request.user, event_type="task-question-interact-first",
-        task=task, question=question).exists():
+    if instrumentation_event_buffer.get_summary("task-question-interact-first",
+        request.user, task, question) is not None:
         return HttpResponse("ok")
 
     # When was the question first viewed? We'll use that
     # to compute the time to first interaction.
 
-    i_task_question_view = InstrumentationEvent.objects\
-        .filter(user=request.user, event_type="task-question-show", task=task, question=question)\
-        .order_by('event_time')\
-        .first()
-    event_value = (timezone.now() - i_task_question_view.event_time).total_seconds() \
+    i_task_question_view = instrumentation_event_buffer.get_summary("task-question-show", request.user, task, question)
+    event_value = (timezone.now() - i_task_question_view["first_event_time"]).total_seconds() \
         if i_task_question_view else None
 
     # Save.
 
-    InstrumentationEvent.objects.create(
+    instrumentation_event_buffer.add(
         user=request.user,
         event_type="task-question-interact-first",
         event_value=event_value,
@@ -1606,6 +1663,7 @@ def get_task_timetamp(request):
                     continue
 
                 # Scan sub-tasks for new answers.
+                Task.resolve_titles(a.answered_by_task.all())
                 for subtask in a.answered_by_task.all():
                     ret.extend(summarize_task_changes(subtask, path+[subtask.title], seen_tasks))
 
@@ -1659,43 +1717,39 @@ def start_a_discussion(request):
 
 @login_required
 def analytics(request):
-    from django.db.models import Avg, Count
-
-    from guidedmodules.models import ModuleQuestion
+    from guidedmodules.models import ModuleQuestion, InstrumentationEventRollup
 
     if not request.user.is_staff:
         return HttpResponseForbidden()
 
+    # The tables are computed from the daily rollups of the instrumentation
+    # events, which the rollup_instrumentation_events management command keeps
+    # up to date, plus the events that haven't been rolled up yet.
     def compute_table(opt):
-        qs = InstrumentationEvent.objects\
-            .filter(event_type=opt["event_type"])\
-            .values(opt["field"])
-
-        overall = qs.aggregate(
-                avg_value=Avg('event_value'),
-                count=Count('event_value'),
-            )
-        
-        rows = qs\
-            .exclude(**{opt["field"]: None})\
-            .annotate(
-                avg_value=Avg('event_value'),
-                count=Count('event_value'),
-            )\
-            .exclude(avg_value=None)\
-            .order_by('-avg_value')\
+        totals = InstrumentationEventRollup.get_totals(opt["event_type"], opt["field"])
+
+        count = sum(c for c, t in totals.values())
+        overall = sum(t for c, t in totals.values()) / count if count else None
+
+        rows = sorted(
+            (
+                { opt["field"]: key, "n": c, "avg_value": t / c }
+                for key, (c, t) in totals.items()
+                if key is not None and c > 0
+            ),
+            key=lambda r : -r["avg_value"])\
             [0:10]
 
         bulk_objs = opt['model'].objects.in_bulk(r[opt['field']] for r in rows)
 
         opt.update({
-            "overall": round(overall['avg_value']) if overall['avg_value'] is not None else "No Data",
-            "n": overall['count'],
+            "overall": round(overall) if overall is not None else "No Data",
+            "n": count,
             "rows": [{
                     "obj": str(bulk_objs[v[opt['field']]]),
                     "label": opt['label']( bulk_objs[v[opt['field']]] ),
                     "detail": opt['detail']( bulk_objs[v[opt['field']]] ),
-                    "n": v['count'],
+                    "n": v['n'],
                     "value": round(v['avg_value']),
                 }
                 for v in rows ],
@@ -1,5 +1,6 @@
 from django.http import HttpResponse, HttpResponseRedirect
 from django.conf import settings
+from django.db import models
 from django.shortcuts import render
 from django.urls import reverse
 import django.contrib.auth.backends
@@ -69,4 +70,109 @@ class ProxyHeaderUserAuthenticationBackend(django.contrib.auth.backends.RemoteUs
                 ))
 
         # Return.
-        return user
\ No newline at end of file
+        return user
+
+
+class AuthorizationContext:
+    # Memoizes the authorization checks made for one user during one
+    # request, so that a page that checks the same Task or Project several
+    # times, or checks many Tasks at once, doesn't repeat the membership and
+    # guardian permission queries for each check. The results are the same
+    # as the corresponding model methods (Task.has_read_priv, etc.). Nothing
+    # is invalidated, so check before making changes, not after.
+
+    def __init__(self, user):
+        self.user = user
+        self.memo = { }
+
+    @staticmethod
+    def for_request(request):
+        # Get the AuthorizationContext that AuthorizationContextMiddleware
+        # attached to the request, or make one if the request didn't go
+        # through the middleware or the request's user has since changed
+        # (e.g. by logging in).
+        authz = getattr(request, "authz", None)
+        if authz is None or authz.user != request.user:
+            authz = AuthorizationContext(request.user)
+            request.authz = authz
+        return authz
+
+    def _memoize(self, key, func):
+        if key not in self.memo:
+            self.memo[key] = func()
+        return self.memo[key]
+
+    def is_project_admin(self, project):
+        return self._memoize(("project_admin", project.id),
+            lambda : self.user in project.get_admins())
+
+    def project_has_read_priv(self, project):
+        return self._memoize(("project_read", project.id),
+            lambda : project.has_read_priv(self.user))
+
+    def project_has_write_priv(self, project):
+        return self._memoize(("project_write", project.id),
+            lambda : project.has_write_priv(self.user))
+
+    def get_task_access_level(self, task, allow_access_to_deleted=False):
+        if task.deleted_at and not allow_access_to_deleted:
+            return False
+        return self._memoize(("task_access", task.id),
+            lambda : task.get_access_level(self.user, allow_access_to_deleted=True))
+
+    def can_read(self, task, allow_access_to_deleted=False):
+        # Same as Task.has_read_priv.
+        return self.get_task_access_level(task, allow_access_to_deleted) in ("READ", "WRITE") \
+            or self.project_has_read_priv(task.project)
+
+    def can_write(self, task, allow_access_to_deleted=False):
+        # Same as Task.has_write_priv.
+        return self.get_task_access_level(task, allow_access_to_deleted) == "WRITE" \
+            or self.project_has_write_priv(task.project)
+
+    def can_write_many(self, tasks):
+        # Returns a dict mapping each of the given Tasks to whether the user
+        # has write privs on it (the same as Task.has_write_priv). Whether
+        # the Tasks grant access themselves is checked for all of them at
+        # once, with a fixed number of queries per level of the answer tree
+        # above them (see Task.resolve_ancestor_task_ids). Tasks that don't
+        # grant access fall back to the Projects' write privs, which are
+        # checked for all of the Projects at once (see
+        # Project.get_write_privs).
+        from guidedmodules.models import Task
+        tasks = list(tasks)
+
+        # Compute the access levels of the Tasks that haven't been checked
+        # already in one query over the Tasks and their ancestors.
+        unchecked = [t for t in tasks if not t.deleted_at and ("task_access", t.id) not in self.memo]
+        if unchecked and self.user.is_authenticated:
+            Task.resolve_ancestor_task_ids(unchecked)
+            ancestors = { t.id: t.get_cached_ancestor_task_ids() for t in unchecked }
+            granting_task_ids = set(Task.objects
+                .filter(
+                    models.Q(id__in=[t.id for t in unchecked])
+                    | models.Q(id__in=set().union(*ancestors.values()), deleted_at=None))
+                .filter(models.Q(editor=self.user) | models.Q(project__members__user=self.user))
+                .values_list("id", flat=True))
+            for t in unchecked:
+                self.memo[("task_access", t.id)] = "WRITE" \
+                    if (t.editor_id == self.user.id or ({ t.id } | ancestors[t.id]) & granting_task_ids) \
+                    else None
+
+        # For the rest, check the write privs of all of their Projects at once.
+        from .models import Project
+        projects = { t.project for t in tasks
+            if self.get_task_access_level(t) != "WRITE" and ("project_write", t.project_id) not in self.memo }
+        for project, has_write_priv in Project.get_write_privs(self.user, projects).items():
+            self.memo[("project_write", project.id)] = has_write_priv
+
+        return { t: self.can_write(t) for t in tasks }
+
+class AuthorizationContextMiddleware:
+    # Attach an AuthorizationContext for the logged-in user to the request,
+    # as request.authz. Must come after AuthenticationMiddleware.
+    def __init__(self, next_middleware):
+        self.next_middleware = next_middleware
+    def __call__(self, request):
+        AuthorizationContext.for_request(request)
+        return self.next_middleware(request)
@@ -560,7 +560,13 @@ class Project(models.Model):
         from guidedmodules.models import Task
         if user.has_perm('view_project', self) or ProjectMembership.objects.filter(project=self, user=user).exists():
             return True
-        if Task.get_all_tasks_readable_by(user, recursive=True).filter(project=self).exists():
+        # Any task in this project is readable if the user is the editor of,
+        # or a member of the project of, it or any task that refers to it.
+        # Rather than enumerating every task the user can read, walk upward
+        # from this project's tasks.
+        project_task_ids = set(Task.objects.filter(project=self).values_list("id", flat=True))
+        if Task.is_editor_or_member_of_any(user,
+            models.Q(id__in=project_task_ids | Task.get_ancestor_task_ids(project_task_ids), deleted_at=None)):
             return True
         for d in self.get_discussions_in_project_as_guest(user):
             return True
@@ -587,6 +593,51 @@ class Project(models.Model):
             return True
         return False
 
+    @staticmethod
+    def get_write_privs(user, projects):
+        # Returns a dict mapping each of the Projects to has_write_priv(user),
+        # computed for all of them at once: the user's memberships in the
+        # Projects are loaded in one query, and the user's guardian permissions
+        # on the Projects and on their Portfolios in one batch each, rather
+        # than running all of has_write_priv's queries for each Project.
+        from guardian.core import ObjectPermissionChecker
+        projects = list(projects)
+        if not projects:
+            return { }
+        if not user.is_authenticated:
+            return { project: project.has_write_priv(user) for project in projects }
+
+        portfolios = Portfolio.objects.in_bulk({ project.portfolio_id for project in projects } - { None })
+        member_project_ids = set(ProjectMembership.objects
+            .filter(user=user, project__in=projects)
+            .values_list("project_id", flat=True))
+        checker = ObjectPermissionChecker(user)
+        checker.prefetch_perms(projects)
+        if portfolios:
+            checker.prefetch_perms(portfolios.values())
+
+        def has_perm(perm, obj):
+            if obj is None:
+                return user.has_perm(perm, obj)
+            return checker.has_perm(perm, obj)
+
+        def has_write_priv(project):
+            # Same as has_write_priv.
+            portfolio = portfolios.get(project.portfolio_id)
+            if has_perm('change_portfolio', portfolio) or has_perm('view_portfolio', portfolio):
+                return True
+            if has_perm('change_project', project):
+                return True
+            # The same as user in project.get_members().
+            if (not project.is_account_project) and (
+                   project.id in member_project_ids
+                or len(checker.get_perms(project)) > 0
+                or (portfolio is not None and len(checker.get_perms(portfolio)) > 0)):
+                return True
+            return False
+
+        return { project: has_write_priv(project) for project in projects }
+
     def get_all_participants(self):
         # Get all users who have read access to this project. Inverse of
         # has_read_priv.
@@ -635,64 +686,77 @@ class Project(models.Model):
         # Gets all projects a user has read priv to, excluding
         # account and organization profile projects, and sorted
         # in reverse chronological order by modified date.
+        #
+        # Rather than loading every Project and Portfolio and checking
+        # each one for permissions, the ways that a user can get read
+        # access to a project are each expressed as a subquery of project
+        # IDs and OR'd together into a single query, with the caller's
+        # filters and excludes applied in the database to all of them.
 
         projects = set()
 
         if not user.is_authenticated:
             return projects
 
-        # Add all of the Projects the user is a member of.
-        for pm in ProjectMembership.objects\
-            .filter(user=user)\
-            .filter(**{ "project__"+k: v for k, v in filters.items() })\
-            .exclude(**{ "project__"+k: v for k, v in excludes.items() })\
-            .select_related('project__root_task__module')\
-            .prefetch_related('project__root_task__module__questions'):
-            projects.add(pm.project)
-            if pm.is_admin:
-                # Annotate with whether the user is an admin of the project.
-                pm.project.user_is_admin = True
-
-        # Add projects that the user is the editor of a task in, even if
-        # the user isn't a team member of that project.
-        from guidedmodules.models import Task
-        for task in Task.get_all_tasks_readable_by(user)\
-            .filter(**{ "project__"+k: v for k, v in filters.items() })\
-            .exclude(**{ "project__"+k: v for k, v in excludes.items() })\
-            .order_by('-created')\
-            .select_related('project__root_task__module')\
-            .prefetch_related('project__root_task__module__questions'):
-            projects.add(task.project)
-
-        # Add projects that the user is participating in a Discussion in
-        # as a guest.
+        from guidedmodules.models import Task, TaskAnswer
         from discussion.models import Discussion
-        for d in Discussion.objects.filter(guests=user):
-            if d.attached_to is not None: # because it is generic there is no cascaded delete and the Discussion can become dangling
-                if not filters or d.attached_to.task.project in Project.objects.filter(**filters):
-                    if not excludes or d.attached_to.task.project not in Project.objects.exclude(**filters):
-                        projects.add(d.attached_to.task.project)
 
-
-        # Add projects the user has permissions for
-        for project in Project.objects.all():
-            user_permissions = get_user_perms(user, project)
-            if len(user_permissions):
-                projects.add(project)
-
-        # Add projects the user has permissions for through a portfolio
-        for portfolio in Portfolio.objects.all():
-            user_permissions = get_user_perms(user, portfolio)
-            if len(user_permissions):
-                for project in portfolio.projects.all():
-                    projects.add(project)
-
-        # Don't show system projects.
-        system_projects = set(p for p in projects if p.is_organization_project or p.is_account_project)
-        projects -= system_projects
-
-        # Sort.
-        projects = sorted(projects, key = lambda x : x.updated, reverse=True)
+        # Projects the user is a member of.
+        member_of = ProjectMembership.objects.filter(user=user)\
+            .values("project_id")
+
+        # Projects that the user is the editor of a task in, even if
+        # the user isn't a team member of that project. (The rest of
+        # Task.get_all_tasks_readable_by is covered by membership.)
+        editor_of = Task.objects.filter(editor=user, deleted_at=None)\
+            .values("project_id")
+
+        # Projects that the user is participating in a Discussion in
+        # as a guest. Discussions are attached to TaskAnswers by a generic
+        # relation, so there is no cascaded delete and a Discussion can
+        # be dangling --- those simply don't match any TaskAnswer here.
+        guest_in = TaskAnswer.objects.filter(
+                id__in=Discussion.objects.filter(
+                    guests=user,
+                    attached_to_content_type=ContentType.objects.get_for_model(TaskAnswer),
+                ).values("attached_to_object_id"))\
+            .values("task__project_id")
+
+        # Projects the user has any permission on, and projects in portfolios
+        # the user has any permission on, matching get_user_perms (which only
+        # looks at permissions granted directly to the user).
+        def objects_with_any_user_perm(model):
+            return get_objects_for_user(user,
+                [p.codename for p in get_perms_for_model(model)], model,
+                any_perm=True, use_groups=False,
+                with_superuser=False, accept_global_perms=False)\
+                .values("id")
+
+        projects = Project.objects\
+            .filter(
+                  models.Q(id__in=member_of)
+                | models.Q(id__in=editor_of)
+                | models.Q(id__in=guest_in)
+                | models.Q(id__in=objects_with_any_user_perm(Project))
+                | models.Q(portfolio__in=objects_with_any_user_perm(Portfolio))
+            )\
+            .filter(**filters)\
+            .exclude(**excludes)\
+            .exclude(is_organization_project=True)\
+            .exclude(is_account_project=True)\
+            .distinct()\
+            .order_by('-updated')\
+            .select_related('root_task__module')\
+            .prefetch_related('root_task__module__questions')
+        projects = list(projects)
+
+        # Annotate with whether the user is an admin of the project.
+        admin_of = set(ProjectMembership.objects
+            .filter(user=user, is_admin=True, project__in=projects)
+            .values_list("project_id", flat=True))
+        for project in projects:
+            if project.id in admin_of:
+                project.user_is_admin = True
 
         return projects
 
@@ -710,14 +774,15 @@ class Project(models.Model):
         # Get all tasks that the user might want to continue working on
         # (except for the project root task).
         from guidedmodules.models import Task
-        return [
-            task for task in
-            Task.get_all_tasks_readable_by(user)
+        tasks = list(Task.get_all_tasks_readable_by(user)
                 .filter(project=self, editor=user) \
+                .exclude(id=self.root_task_id) \
                 .order_by('-updated')\
-                .select_related('project')
-            if not task.is_finished()
-               and task != self.root_task ]
+                .select_related('project', 'module'))
+        Task.compute_states_in_tree(tasks)
+        return [
+            task for task in tasks
+            if not task.is_finished() ]
 
     def set_root_task(self, module, editor, expected_module_type="project"):
         # create task and set it as the project root task
@@ -217,13 +217,22 @@ CACHES = {
 	'default': {
 		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
 		'LOCATION': '127.0.0.1:11211',
-	}
+	},
+	# Thumbnails of images as data: URLs (see guidedmodules.models.ImageDerivativeStore).
+	'image_derivatives': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+		'LOCATION': 'image_derivatives',
+		'OPTIONS': {
+			'MAX_ENTRIES': 1000,
+		},
+	},
 }
 if environment.get('memcached'):
 	# But if the 'memcached' environment setting is true,
 	# enable a memcached cache using the default host/port
 	# (see above) *and* enable the cached_db session backend.
 	CACHES['default']['BACKEND'] = 'django.core.cache.backends.memcached.MemcachedCache'
+	CACHES['image_derivatives'] = CACHES['default']
 	SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 
 # Logging.
@@ -40,7 +40,9 @@ if environment.get("trust-user-authentication-headers"):
 MIDDLEWARE += [
     #'debug_toolbar.middleware.DebugToolbarMiddleware',
     'siteapp.middleware.ContentSecurityPolicyMiddleware',
+    'siteapp.middleware.AuthorizationContextMiddleware',
     'guidedmodules.middleware.InstrumentQuestionPageLoadTimes',
+    'guidedmodules.middleware.ProjectEvaluationSessionMiddleware',
 ]
 
 TEMPLATES[0]['OPTIONS']['context_processors'] += [
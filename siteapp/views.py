@@ -18,6 +18,7 @@ from guardian.shortcuts import get_perms_for_model
 from discussion.models import Discussion
 from guidedmodules.models import (Module, ModuleQuestion, ProjectMembership,
                                   Task)
+from guidedmodules.module_logic import ProjectEvaluationSession
 
 from .forms import PortfolioForm, ProjectForm
 from .good_settings_helpers import \
@@ -75,14 +76,14 @@ def assign_project_lifecycle_stage(projects):
     # Load each project's lifecycle stage, which is computed by each project's
     # root task's app's output document named govready_lifecycle_stage_code.
     # That output document yields a string identifying a lifecycle stage.
+    # Only that document is rendered, and its text is cached in the root
+    # task's cached_state, so the projects should be loaded with
+    # select_related("root_task__module").
     for project in projects:
-        outputs = project.root_task.render_output_documents()
-        for doc in outputs:
-            if doc.get("id") == "govready_lifecycle_stage_code":
-                value = doc["text"].strip()
-                if value in lifecycle_stage_code_mapping:
-                    project.lifecycle_stage = lifecycle_stage_code_mapping[value]
-                    break
+        value = project.root_task.get_output_document_text("govready_lifecycle_stage_code")
+        value = value.strip() if value is not None else None
+        if value in lifecycle_stage_code_mapping:
+            project.lifecycle_stage = lifecycle_stage_code_mapping[value]
         else:
             # No matching output document with a non-empty value.
             project.lifecycle_stage = lifecycle_stage_code_mapping["none_none"]
@@ -127,9 +128,12 @@ def get_compliance_apps_catalog_for_user(user):
     # catalogs across all of the organizations they are a member of, but
     # remember which organizations generated which apps.
     from siteapp.models import Organization
+    from guidedmodules.models import AppVersion
     catalog = { }
-    for org in Organization.get_all_readable_by(user):
-        apps = get_compliance_apps_catalog(org)
+    orgs = list(Organization.get_all_readable_by(user))
+    startable_apps = AppVersion.get_startable_apps_by_organization(orgs)
+    for org in orgs:
+        apps = get_compliance_apps_catalog(org, startable_apps[org])
         for app in apps:
             # Add to merged catalog.
             catalog.setdefault(app['key'], app)
@@ -144,13 +148,15 @@ def get_compliance_apps_catalog_for_user(user):
 
     return catalog
 
-def get_compliance_apps_catalog(organization):
-    # Load the compliance apps available to the given organization.
+def get_compliance_apps_catalog(organization, appvers=None):
+    # Load the compliance apps available to the given organization. appvers
+    # may be given if the startable AppVersions were already loaded.
 
     from guidedmodules.models import AppVersion
     from collections import defaultdict
 
-    appvers = AppVersion.get_startable_apps(organization)
+    if appvers is None:
+        appvers = AppVersion.get_startable_apps(organization)
 
     # Group the AppVersions into apps. An app is a unique source+appname pair.
     # For each app, one or more versions may be available.
@@ -175,67 +181,10 @@ def get_compliance_apps_catalog(organization):
     return apps
 
 def render_app_catalog_entry(appversion, appversions, organization):
-    from guidedmodules.module_logic import render_content
-    from guidedmodules.models import image_to_dataurl
-
-    key = "{source}/{name}".format(source=appversion.source.slug, name=appversion.appname)
-
-    catalog = appversion.catalog_metadata
-    if not isinstance(catalog, dict): catalog = { }
-
-    app_module = appversion.modules.filter(module_name="app").first()
-
-    return {
-        # app identification
-        "appsource_id": appversion.source.id,
-        "key": key,
-
-        # main display fields
-        "title": catalog.get('title') or appversion.appname,
-        "description": { # rendered as markdown
-            "short": render_content(
-                {
-                    "template": catalog.get("description", {}).get("short") or "",
-                    "format": "markdown",
-                },
-                None,
-                "html",
-                "%s %s" % (key, "short description")
-            ),
-            "long": render_content(
-                {
-                    "template": catalog.get("description", {}).get("long")
-                        or catalog.get("description", {}).get("short")
-                        or "",
-                    "format": "markdown",
-                },
-                None,
-                "html",
-                "%s %s" % (key, "short description")
-            )
-        },
-
-        # catalog page metadata
-        "categories": catalog.get("categories", [catalog.get("category")]),
-        "search_haystak": "".join([ # free text search uses this
-            appversion.appname,
-            catalog.get('title', ""),
-            catalog.get("vendor", ""),
-            catalog.get("description", {}).get("short", ""),
-            catalog.get("description", {}).get("long", ""),
-        ]),
-        "icon": None if "icon" not in catalog
-                    else image_to_dataurl(appversion.get_asset(catalog["icon"]), 128),
-        "protocol": app_module.spec.get("protocol", []) if app_module else [],
-        
-        # catalog detail page metadata
-        "vendor": catalog.get("vendor"),
-        "vendor_url": catalog.get("vendor_url"),
-        "source_url": catalog.get("source_url"),
-        "status": catalog.get("status"),
-        "version": appversion.version_number,
-        "recommended_for": catalog.get("recommended_for", []),
-
+    # The rendered parts of the entry are cached with the AppVersion. Copy
+    # the entry so that the cached entry isn't modified.
+    entry = dict(appversion.get_catalog_entry())
+    entry.update({
         # versions that can be started
         "versions": appversions,
 
@@ -244,7 +193,8 @@ def render_app_catalog_entry(appversion, appversions, organization):
 
         # placeholder for future logic
         "authz": "none",
-    }
+    })
+    return entry
 
 def get_task_question(request):
     # Filter catalog by apps that satisfy the right protocol.
@@ -504,10 +454,16 @@ def project(request, project):
     # Meaning, I'm not a member, but I still need access to certain tasks and
     # certain questions within those tasks.
     discussions = list(project.get_discussions_in_project_as_guest(request.user))
+    Task.resolve_titles(d.attached_to.task for d in discussions)
 
     # Pre-load the answers to project root task questions and impute answers so
     # that we know which questions are suppressed by imputed values.
-    root_task_answers = project.root_task.get_answers().with_extended_info()
+    session = ProjectEvaluationSession.for_request(request)
+    root_task_answers = session.get_answers_with_extended_info(project.root_task)
+
+    # Compute whether the sub-tasks are finished and their progress in
+    # one pass rather than one sub-task at a time.
+    Task.compute_states_in_tree(root_task_answers.get_subtasks(), session.extended_answers)
 
     # Check if this user has authorization to start tasks in this Project.
     can_start_task = project.can_start_task(request.user)
@@ -785,7 +741,7 @@ def project_outputs(request, project):
                 "format": format,
                 "template": template
                 },
-                project.root_task.get_answers().with_extended_info(),
+                ProjectEvaluationSession.for_request(request).get_answers_with_extended_info(project.root_task),
                 "html",
                 "project output documents",
                 show_answer_metadata=True